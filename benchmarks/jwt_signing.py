@@ -0,0 +1,90 @@
+"""
+Скорость подписи и проверки access-токенов для каждого алгоритма JWT.
+Ключи генерируются в памяти, файлы из cert/ не нужны.
+
+Запуск:
+    python -m benchmarks.jwt_signing
+    python -m benchmarks.jwt_signing --iterations 1000
+"""
+
+import argparse
+import sys
+from time import perf_counter
+from typing import Callable
+
+import numpy as np
+import orjson
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519, rsa
+from cryptography.hazmat.primitives.asymmetric.types import PrivateKeyTypes
+
+from src.auth.utils import algorithm_for_key, decode_jwt, encode_jwt
+
+# Полезная нагрузка как у access-токена приложения
+PAYLOAD: dict = {
+    "type": "access",
+    "sub": "1",
+    "email": "user@example.com",
+    "role": "user",
+    "rv": "0a1b2c3d:0",
+}
+
+
+def generate_keys() -> list[PrivateKeyTypes]:
+    return [
+        rsa.generate_private_key(public_exponent=65537, key_size=2048),
+        ec.generate_private_key(ec.SECP256R1()),
+        ed25519.Ed25519PrivateKey.generate(),
+    ]
+
+
+def measure(func: Callable[[], object], iterations: int) -> dict:
+    func()  # прогрев
+    latencies: list[float] = []
+    for _ in range(iterations):
+        start: float = perf_counter()
+        func()
+        latencies.append(perf_counter() - start)
+    return {
+        "p50_ms": round(float(np.percentile(latencies, 50)) * 1000, 4),
+        "per_second": round(iterations / sum(latencies), 1),
+    }
+
+
+def bench_key(private_key: PrivateKeyTypes, iterations: int) -> dict:
+    """Подпись и проверка через encode_jwt/decode_jwt приложения, без кеша токенов"""
+    algorithm: str = algorithm_for_key(private_key)
+    public_key = private_key.public_key()
+    token: str = encode_jwt(PAYLOAD, "access", private_key, algorithm)
+    return {
+        "sign": measure(
+            lambda: encode_jwt(PAYLOAD, "access", private_key, algorithm), iterations
+        ),
+        # Чужой ключ не совпадает с ключом приложения, поэтому кеш не используется
+        "verify": measure(lambda: decode_jwt(token, public_key, algorithm), iterations),
+        "token_bytes": len(token),
+    }
+
+
+def run_benchmarks(iterations: int) -> dict[str, dict]:
+    return {
+        algorithm_for_key(key): bench_key(key, iterations) for key in generate_keys()
+    }
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Замеры подписи и проверки JWT")
+    parser.add_argument("--iterations", type=int, default=500)
+    args = parser.parse_args(argv)
+
+    report: dict = run_benchmarks(args.iterations)
+    print(orjson.dumps(report, option=orjson.OPT_INDENT_2).decode())
+    for algorithm, result in report.items():
+        print(
+            f"{algorithm:>6}: подпись {result['sign']['per_second']:>9.1f}/с, "
+            f"проверка {result['verify']['per_second']:>9.1f}/с"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
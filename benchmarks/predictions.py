@@ -0,0 +1,277 @@
+"""
+Замеры пути предсказания по этапам и целиком через ASGI-приложение.
+Вместо MobileNet-SSD используется детерминированная сеть-заглушка,
+поэтому замеры работают без файла модели и сети.
+
+Запуск:
+    python -m benchmarks.predictions                 # сравнить с baseline.json
+    python -m benchmarks.predictions --update-baseline
+"""
+
+import argparse
+import asyncio
+import base64
+import sys
+from logging import WARNING, getLogger
+from pathlib import Path
+from time import perf_counter
+from typing import Any, Callable
+
+import cv2
+import numpy as np
+import orjson
+from httpx import ASGITransport, AsyncClient
+
+from src.api_predictions import predictions_img, service
+from src.api_predictions.cache import prediction_cache
+from src.api_predictions.history import history_writer
+from src.api_predictions.model_registry import INPUT_SIZE, ModelRegistry
+from src.api_predictions.postprocess import draw_detections
+from src.api_predictions.schemas import PredictionParams
+from src.auth.utils import encode_jwt
+from src.core.config import settings
+from src.main import app
+
+BASELINE_PATH = Path(__file__).parent / "baseline.json"
+
+# Размеры синтетических изображений: ширина и высота
+IMAGE_SIZES: tuple[tuple[int, int], ...] = ((640, 480), (1920, 1080), (4000, 3000))
+
+# Допустимое ухудшение p50 относительно базовой линии (1.0 - вдвое медленнее)
+DEFAULT_TOLERANCE = 1.0
+# Разница меньше этой считается шумом для самых быстрых этапов
+MIN_DELTA_MS = 2.0
+
+
+class StandInNet:
+    """
+    Детерминированная замена MobileNet-SSD с интерфейсом cv2.dnn.Net.
+    Делит вход на сетку 4x4 и для самых ярких ячеек возвращает объекты,
+    так что выход зависит от изображения, а стоимость - от размера пакета
+    """
+
+    grid: int = 4
+    per_image: int = 5
+
+    def __init__(self) -> None:
+        self._blob: np.ndarray | None = None
+
+    def setInput(self, blob: np.ndarray) -> None:
+        self._blob = blob
+
+    def forward(self) -> np.ndarray:
+        blob: np.ndarray = self._blob
+        n, _, h, w = blob.shape
+        g: int = self.grid
+        cells: np.ndarray = (
+            blob[:, :, : h - h % g, : w - w % g]
+            .reshape(n, 3, g, h // g, g, w // g)
+            .mean(axis=(1, 3, 5))
+            .reshape(n, -1)
+        )
+        order: np.ndarray = np.argsort(-cells, axis=1, kind="stable")[:, : self.per_image]
+        rows: list[list[float]] = []
+        for image_id in range(n):
+            for rank, cell in enumerate(order[image_id].tolist()):
+                y, x = divmod(cell, g)
+                rows.append([
+                    image_id,
+                    1 + cell % 20,
+                    0.95 - 0.1 * rank,
+                    x / g,
+                    y / g,
+                    (x + 1) / g,
+                    (y + 1) / g,
+                ])
+        return np.array(rows, dtype=np.float32).reshape(1, 1, -1, 7)
+
+
+def synthetic_image(width: int, height: int, seed: int = 0) -> bytes:
+    """JPEG с шумом и прямоугольниками, одинаковый при каждом запуске"""
+    rng = np.random.default_rng(seed)
+    img: np.ndarray = rng.integers(0, 64, (height, width, 3), dtype=np.uint8)
+    for _ in range(8):
+        x, y = int(rng.integers(0, width // 2)), int(rng.integers(0, height // 2))
+        color = tuple(int(c) for c in rng.integers(64, 256, 3))
+        cv2.rectangle(img, (x, y), (x + width // 4, y + height // 4), color, -1)
+    _, buffer = cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, 90])
+    return buffer.tobytes()
+
+
+def summarize(latencies: list[float]) -> dict:
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000
+    return {
+        "p50_ms": round(float(p50), 3),
+        "p95_ms": round(float(p95), 3),
+        "p99_ms": round(float(p99), 3),
+        "images_per_second": round(len(latencies) / sum(latencies), 2),
+    }
+
+
+def measure(func: Callable[[], Any], iterations: int, warmup: int = 1) -> dict:
+    for _ in range(warmup):
+        func()
+    latencies: list[float] = []
+    for _ in range(iterations):
+        start: float = perf_counter()
+        func()
+        latencies.append(perf_counter() - start)
+    return summarize(latencies)
+
+
+def bench_stages(content: bytes, iterations: int) -> dict[str, dict]:
+    """Замеры отдельных этапов для одного изображения"""
+    params = PredictionParams()
+    net = StandInNet()
+    decoded = predictions_img.decode_upload(
+        content, predictions_img.decode_target_side(params)
+    )
+    img: np.ndarray = decoded.image
+    blob: np.ndarray = cv2.dnn.blobFromImages(
+        [img], predictions_img.BLOB_SCALE, INPUT_SIZE, predictions_img.BLOB_MEAN
+    )
+    net.setInput(blob)
+    detections: np.ndarray = net.forward()
+    selected = predictions_img.select_for_params(
+        detections, decoded.width, decoded.height, params
+    )
+    drawn: np.ndarray = img.copy()
+    draw_detections(drawn, selected)
+    quality: list[int] = [cv2.IMWRITE_JPEG_QUALITY, settings.predict_jpeg_quality]
+    _, encoded = cv2.imencode(".jpg", drawn, quality)
+    jpeg: bytes = encoded.tobytes()
+
+    def forward() -> None:
+        net.setInput(blob)
+        net.forward()
+
+    return {
+        "decode": measure(
+            lambda: predictions_img.decode_upload(
+                content, predictions_img.decode_target_side(params)
+            ),
+            iterations,
+        ),
+        "blob": measure(
+            lambda: cv2.dnn.blobFromImages(
+                [img], predictions_img.BLOB_SCALE, INPUT_SIZE, predictions_img.BLOB_MEAN
+            ),
+            iterations,
+        ),
+        "forward": measure(forward, iterations),
+        "postprocess": measure(
+            lambda: predictions_img.select_for_params(
+                detections, decoded.width, decoded.height, params
+            ),
+            iterations,
+        ),
+        "draw": measure(lambda: draw_detections(img.copy(), selected), iterations),
+        "jpeg_encode": measure(lambda: cv2.imencode(".jpg", drawn, quality), iterations),
+        "base64": measure(lambda: base64.b64encode(jpeg), iterations),
+    }
+
+
+async def bench_endpoint(content: bytes, iterations: int, output: str) -> dict:
+    """Замер запроса к /predictions/predict/ через ASGI без сети"""
+    headers: dict = {"Authorization": f"Bearer {encode_jwt({'sub': '1'}, 'access')}"}
+    latencies: list[float] = []
+    async with AsyncClient(
+        transport=ASGITransport(app=app), base_url="http://testserver"
+    ) as client:
+        for i in range(iterations + 1):
+            start: float = perf_counter()
+            response = await client.post(
+                "/predictions/predict/",
+                params={"output": output},
+                files={"file": ("bench.jpg", content, "image/jpeg")},
+                headers=headers,
+            )
+            elapsed: float = perf_counter() - start
+            if response.status_code != 200:
+                raise RuntimeError(f"Ответ {response.status_code}: {response.text}")
+            if i:  # первый запрос - прогрев
+                latencies.append(elapsed)
+    return summarize(latencies)
+
+
+def use_stand_in_model() -> None:
+    """Подменяет модель заглушкой и отключает кеш и историю на время замеров"""
+    registry = ModelRegistry(StandInNet, version="stand-in")
+    predictions_img.model_registry = registry
+    service.model_registry = registry
+    prediction_cache.max_bytes = 0
+    history_writer.enabled = False
+
+
+def run_benchmarks(
+    iterations: int, sizes: tuple[tuple[int, int], ...] = IMAGE_SIZES
+) -> dict:
+    use_stand_in_model()
+    report: dict[str, dict] = {}
+    for width, height in sizes:
+        content: bytes = synthetic_image(width, height)
+        results: dict[str, dict] = bench_stages(content, iterations)
+        for output in ("json", "base64"):
+            results[f"endpoint_{output}"] = asyncio.run(
+                bench_endpoint(content, iterations, output)
+            )
+        report[f"{width}x{height}"] = results
+    return report
+
+
+def compare_with_baseline(
+    report: dict, baseline: dict, tolerance: float = DEFAULT_TOLERANCE
+) -> list[str]:
+    """Список этапов, у которых p50 хуже базовой линии больше чем на tolerance"""
+    regressions: list[str] = []
+    for size, stages in report.items():
+        for stage, result in stages.items():
+            expected: dict | None = baseline.get(size, {}).get(stage)
+            if expected is None:
+                continue
+            limit: float = max(
+                expected["p50_ms"] * (1 + tolerance), expected["p50_ms"] + MIN_DELTA_MS
+            )
+            if result["p50_ms"] > limit:
+                regressions.append(
+                    f"{size} {stage}: p50 {result['p50_ms']:.3f} мс "
+                    f"> {limit:.3f} мс (база {expected['p50_ms']:.3f} мс)"
+                )
+    return regressions
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Замеры пути предсказания")
+    parser.add_argument("--iterations", type=int, default=30)
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument("--baseline", type=Path, default=BASELINE_PATH)
+    parser.add_argument("--update-baseline", action="store_true")
+    args = parser.parse_args(argv)
+    # Журнал запросов искажает замеры и засоряет logs.log
+    getLogger().setLevel(WARNING)
+
+    report: dict = run_benchmarks(args.iterations)
+    print(orjson.dumps(report, option=orjson.OPT_INDENT_2).decode())
+
+    if args.update_baseline:
+        args.baseline.write_bytes(
+            orjson.dumps(report, option=orjson.OPT_INDENT_2 | orjson.OPT_SORT_KEYS)
+        )
+        print(f"Базовая линия сохранена в {args.baseline}")
+        return 0
+    if not args.baseline.exists():
+        print(f"Нет базовой линии {args.baseline}, запустите с --update-baseline")
+        return 0
+
+    regressions: list[str] = compare_with_baseline(
+        report, orjson.loads(args.baseline.read_bytes()), args.tolerance
+    )
+    if regressions:
+        print("Замедление относительно базовой линии:", *regressions, sep="\n  ")
+        return 1
+    print("Замедлений относительно базовой линии нет")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
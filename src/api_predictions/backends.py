@@ -0,0 +1,245 @@
+import os
+import threading
+from abc import ABC, abstractmethod
+from logging import Logger, getLogger
+from pathlib import Path
+from time import perf_counter
+from typing import Any
+
+import cv2
+import numpy as np
+
+from src.api_predictions.model_registry import INPUT_SIZE, CaffeNetLoader
+from src.core.config import settings
+
+logger: Logger = getLogger(__name__)
+
+# Значения настройки predict_opencv_target
+OPENCV_TARGETS: dict[str, int] = {
+    "cpu": cv2.dnn.DNN_TARGET_CPU,
+    "opencl": cv2.dnn.DNN_TARGET_OPENCL,
+}
+
+
+def available_cpus() -> int:
+    """Число ядер, доступных процессу (с учётом привязки к ядрам в контейнере)"""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def default_threads() -> int:
+    """
+    Потоков на инференс в одном процессе: ядра делятся поровну
+    между процессами uvicorn, чтобы они не мешали друг другу
+    """
+    return max(1, available_cpus() // max(1, settings.web_concurrency))
+
+
+class InferenceBackend(ABC):
+    """
+    Способ запуска сети. Вызов возвращает новый экземпляр сети
+    с интерфейсом cv2.dnn.Net: setInput(blob) и forward() -> выход SSD 1x1xNx7
+    """
+
+    name: str = ""
+
+    def __init__(self, threads: int) -> None:
+        self.threads: int = threads
+
+    @abstractmethod
+    def __call__(self) -> Any: ...
+
+    def describe(self) -> dict:
+        return {"name": self.name, "threads": self.threads}
+
+
+class OpenCvDnnBackend(InferenceBackend):
+    """Caffe-модель через cv2.dnn с явным числом потоков и целевым устройством"""
+
+    name = "opencv"
+
+    def __init__(
+        self,
+        config_path: Path,
+        model_path: Path,
+        threads: int,
+        target: str = "cpu",
+    ) -> None:
+        super().__init__(threads)
+        self.target: str = target
+        self._loader = CaffeNetLoader(config_path, model_path)
+
+    def configure(self) -> None:
+        # Пул потоков OpenCV общий на процесс
+        cv2.setNumThreads(self.threads)
+
+    def __call__(self) -> cv2.dnn.Net:
+        self.configure()
+        net = self._loader()
+        net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+        net.setPreferableTarget(OPENCV_TARGETS[self.target])
+        return net
+
+    def describe(self) -> dict:
+        return {**super().describe(), "target": self.target}
+
+
+# Поля строки выхода SSD: номер изображения, класс, уверенность и рамка в долях
+SSD_ROW_SIZE = 7
+
+
+def check_onnx_outputs(session: Any, model_path: Path) -> None:
+    """
+    Проверяет, что модель отдаёт готовые детекции, как слой DetectionOutput
+    Caffe: первый выход формы [1, 1, N, 7] или [N, 7]. Экспорт без этого слоя
+    (сырые рамки и оценки классов) иначе давал бы ошибку или мусор в запросе
+    """
+    outputs: list = session.get_outputs()
+    shape: list = list(outputs[0].shape) if outputs else []
+    if len(shape) < 2 or shape[-1] != SSD_ROW_SIZE:
+        described: str = ", ".join(f"{o.name} {list(o.shape)}" for o in outputs)
+        raise RuntimeError(
+            f"Модель {model_path} не подходит для бэкенда onnxruntime: "
+            f"первый выход должен иметь форму [1, 1, N, {SSD_ROW_SIZE}] "
+            f"(выход DetectionOutput), а выходы модели: {described or 'нет'}"
+        )
+
+
+class OnnxRuntimeNet:
+    """Обёртка над сессией ONNX Runtime с интерфейсом cv2.dnn.Net"""
+
+    def __init__(self, session: Any) -> None:
+        self._session = session
+        self._input_name: str = session.get_inputs()[0].name
+        self._blob: np.ndarray | None = None
+
+    def setInput(self, blob: np.ndarray) -> None:
+        self._blob = blob
+
+    def forward(self) -> np.ndarray:
+        (output, *_) = self._session.run(None, {self._input_name: self._blob})
+        return np.asarray(output).reshape(1, 1, -1, SSD_ROW_SIZE)
+
+
+class OnnxRuntimeBackend(InferenceBackend):
+    """
+    Сконвертированная в ONNX модель через ONNX Runtime на CPU.
+    Модель должна включать постобработку SSD (см. check_onnx_outputs).
+    onnxruntime - необязательная зависимость, импортируется при первом использовании.
+    Сессия одна на процесс (run потокобезопасен), у каждого потока своя обёртка
+    """
+
+    name = "onnxruntime"
+
+    def __init__(self, model_path: Path, threads: int, inter_op_threads: int = 1) -> None:
+        super().__init__(threads)
+        self.model_path: Path = model_path
+        self.inter_op_threads: int = inter_op_threads
+        self._session: Any = None
+        self._lock = threading.Lock()
+
+    def _get_session(self) -> Any:
+        with self._lock:
+            if self._session is None:
+                try:
+                    import onnxruntime as ort
+                except ImportError as e:
+                    raise RuntimeError(
+                        "Для бэкенда onnxruntime установите пакет onnxruntime"
+                    ) from e
+                options = ort.SessionOptions()
+                options.intra_op_num_threads = self.threads
+                options.inter_op_num_threads = self.inter_op_threads
+                options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+                options.graph_optimization_level = (
+                    ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+                )
+                logger.info("Создаём сессию ONNX Runtime для %s", self.model_path)
+                session = ort.InferenceSession(
+                    str(self.model_path), options, providers=["CPUExecutionProvider"]
+                )
+                check_onnx_outputs(session, self.model_path)
+                self._session = session
+            return self._session
+
+    def __call__(self) -> OnnxRuntimeNet:
+        return OnnxRuntimeNet(self._get_session())
+
+    def describe(self) -> dict:
+        return {**super().describe(), "inter_op_threads": self.inter_op_threads}
+
+
+BACKEND_NAMES: tuple[str, ...] = (OpenCvDnnBackend.name, OnnxRuntimeBackend.name)
+
+
+def create_backend(
+    name: str, config_path: Path, model_path: Path, onnx_model_path: Path
+) -> InferenceBackend:
+    """Создаёт бэкенд по имени для файлов модели с потоками из настроек"""
+    threads: int = settings.predict_threads or default_threads()
+    if name == OpenCvDnnBackend.name:
+        return OpenCvDnnBackend(
+            config_path, model_path, threads, target=settings.predict_opencv_target
+        )
+    if name == OnnxRuntimeBackend.name:
+        return OnnxRuntimeBackend(
+            onnx_model_path,
+            threads,
+            inter_op_threads=settings.predict_onnx_inter_op_threads,
+        )
+    raise ValueError(f"Неизвестный бэкенд инференса: {name}")
+
+
+def benchmark_backend(
+    backend: InferenceBackend,
+    iterations: int,
+    batch_size: int = 1,
+    input_size: tuple[int, int] = INPUT_SIZE,
+) -> dict:
+    """Замеряет задержку forward и пропускную способность бэкенда на этом хосте"""
+    net = backend()
+    w, h = input_size
+    blob: np.ndarray = np.random.default_rng(0).random(
+        (batch_size, 3, h, w), dtype=np.float32
+    )
+    net.setInput(blob)
+    net.forward()  # прогрев
+
+    latencies: list[float] = []
+    for _ in range(iterations):
+        start: float = perf_counter()
+        net.setInput(blob)
+        net.forward()
+        latencies.append(perf_counter() - start)
+
+    p50, p95 = np.percentile(latencies, [50, 95]) * 1000
+    return {
+        **backend.describe(),
+        "batch_size": batch_size,
+        "iterations": iterations,
+        "p50_ms": float(p50),
+        "p95_ms": float(p95),
+        "images_per_second": batch_size * iterations / sum(latencies),
+    }
+
+
+def benchmark_backends(
+    backends: list[InferenceBackend], iterations: int, batch_size: int = 1
+) -> dict[str, dict]:
+    """Замеры для нескольких бэкендов; недоступный бэкенд получает описание ошибки"""
+    results: dict[str, dict] = {}
+    for backend in backends:
+        try:
+            results[backend.name] = benchmark_backend(backend, iterations, batch_size)
+        except Exception as e:
+            logger.warning("Бэкенд %s недоступен для замера: %s", backend.name, e)
+            results[backend.name] = {**backend.describe(), "error": str(e)}
+            continue
+        logger.info(
+            "Бэкенд %s: p50 %.1f мс, %.1f изображений/с",
+            backend.name,
+            results[backend.name]["p50_ms"],
+            results[backend.name]["images_per_second"],
+        )
+    return results
@@ -0,0 +1,124 @@
+import asyncio
+from collections import Counter
+from logging import Logger, getLogger
+from typing import Any, Awaitable, Callable
+
+import numpy as np
+
+from src.core.metrics import metrics
+
+logger: Logger = getLogger(__name__)
+
+BatchForward = Callable[[list[np.ndarray]], list[Any]]
+Executor = Callable[..., Awaitable[Any]]
+
+
+class MicroBatcher:
+    """
+    Собирает одновременные запросы в пакет и выполняет для него один forward.
+    Пакет отправляется, когда набрано max_batch_size изображений
+    или с момента первого запроса прошло max_wait_ms миллисекунд
+    """
+
+    def __init__(
+        self,
+        forward: BatchForward,
+        execute: Executor,
+        max_batch_size: int,
+        max_wait_ms: float,
+    ) -> None:
+        self._forward: BatchForward = forward
+        self._execute: Executor = execute
+        self.max_batch_size: int = max(1, max_batch_size)
+        self.max_wait_ms: float = max_wait_ms
+        self._queue: asyncio.Queue | None = None
+        self._collector: asyncio.Task | None = None
+        # Цикл событий хранит задачи по слабым ссылкам: без этого множества
+        # отправленный пакет мог бы быть собран сборщиком мусора
+        self._flushes: set[asyncio.Task] = set()
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._batch_sizes: Counter[int] = Counter()
+        metrics.register_collector("batching", self.status)
+
+    def _ensure_started(self) -> asyncio.Queue:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._collector is None or self._collector.done():
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._collector = loop.create_task(self._collect(self._queue))
+        return self._queue
+
+    async def detect(self, image: np.ndarray) -> Any:
+        """Возвращает выход сети для одного изображения"""
+        if self.max_batch_size == 1:
+            self._batch_sizes[1] += 1
+            results: list[Any] = await self._execute(self._forward, [image])
+            return results[0]
+
+        queue: asyncio.Queue = self._ensure_started()
+        future: asyncio.Future = asyncio.get_running_loop().create_future()
+        await queue.put((image, future))
+        return await future
+
+    async def _collect(self, queue: asyncio.Queue) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch: list[tuple[np.ndarray, asyncio.Future]] = [await queue.get()]
+            started: float = loop.time()
+            deadline: float = started + self.max_wait_ms / 1000
+            while len(batch) < self.max_batch_size:
+                timeout: float = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            metrics.observe("batch_wait", loop.time() - started)
+            # Пока пакет считается в пуле, собираем следующий
+            task: asyncio.Task = loop.create_task(self._flush(batch))
+            self._flushes.add(task)
+            task.add_done_callback(self._flushes.discard)
+
+    async def _flush(self, batch: list[tuple[np.ndarray, asyncio.Future]]) -> None:
+        batch = [(image, future) for image, future in batch if not future.cancelled()]
+        if not batch:
+            return
+        self._batch_sizes[len(batch)] += 1
+        try:
+            results: list[Any] = await self._execute(
+                self._forward, [image for image, _ in batch]
+            )
+        except Exception as e:
+            logger.error("Ошибка при обработке пакета из %d изображений: %s", len(batch), e)
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    async def stop(self) -> None:
+        """Прекращает сбор пакетов и дожидается уже отправленных"""
+        if self._collector is not None:
+            self._collector.cancel()
+            try:
+                await self._collector
+            except asyncio.CancelledError:
+                pass
+            self._collector = None
+        if self._flushes:
+            await asyncio.gather(*self._flushes, return_exceptions=True)
+
+    def status(self) -> dict:
+        batches: int = sum(self._batch_sizes.values())
+        images: int = sum(size * count for size, count in self._batch_sizes.items())
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait_ms,
+            "batches": batches,
+            "images": images,
+            "avg_batch_size": images / batches if batches else 0,
+            "batch_sizes": dict(sorted(self._batch_sizes.items())),
+        }
@@ -0,0 +1,149 @@
+import asyncio
+import hashlib
+from collections import OrderedDict
+from logging import Logger, getLogger
+from time import monotonic
+from typing import Awaitable, Callable, NamedTuple
+
+from src.api_predictions.schemas import PredictionParams, PredictionResult
+from src.core.config import settings
+from src.core.metrics import metrics
+
+logger: Logger = getLogger(__name__)
+
+# Начиная с этого размера хеш считается вне цикла событий
+HASH_IN_THREAD_BYTES = 1 << 20
+# Примерный размер одного объекта в памяти
+DETECTION_BYTES = 200
+
+
+class CacheEntry(NamedTuple):
+    result: PredictionResult
+    size: int
+    expires_at: float
+
+
+class PredictionCache:
+    """
+    LRU-кеш результатов предсказаний по хешу загруженных байтов и параметров.
+    Ограничен суммарным размером и временем жизни записей.
+    Одновременные одинаковые запросы ждут одно вычисление (single-flight).
+    Используется только из цикла событий, поэтому блокировки не нужны
+    """
+
+    def __init__(self, max_bytes: int, ttl_seconds: float) -> None:
+        self.max_bytes: int = max_bytes
+        self.ttl_seconds: float = ttl_seconds
+        self._entries: OrderedDict[str, CacheEntry] = OrderedDict()
+        self._inflight: dict[str, asyncio.Future] = {}
+        self._bytes: int = 0
+        self.hits: int = 0
+        self.misses: int = 0
+        self.coalesced: int = 0
+        self.evictions: int = 0
+        self.expirations: int = 0
+        metrics.register_collector("prediction_cache", self.status)
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0 and self.ttl_seconds > 0
+
+    @staticmethod
+    def _digest(file_content: bytes, params_key: str) -> str:
+        digest = hashlib.blake2b(file_content, digest_size=16)
+        digest.update(params_key.encode())
+        return digest.hexdigest()
+
+    async def make_key(
+        self, file_content: bytes, params: PredictionParams, model_version: str = ""
+    ) -> str:
+        params_key: str = model_version + "|" + params.model_dump_json()
+        if len(file_content) >= HASH_IN_THREAD_BYTES:
+            return await asyncio.to_thread(self._digest, file_content, params_key)
+        return self._digest(file_content, params_key)
+
+    @staticmethod
+    def _size_of(result: PredictionResult) -> int:
+        return len(result.image or b"") + DETECTION_BYTES * (len(result.detections) + 1)
+
+    def get(self, key: str) -> PredictionResult | None:
+        entry: CacheEntry | None = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires_at <= monotonic():
+            self._remove(key)
+            self.expirations += 1
+            return None
+        self._entries.move_to_end(key)
+        return entry.result
+
+    def put(self, key: str, result: PredictionResult) -> None:
+        size: int = self._size_of(result)
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = CacheEntry(result, size, monotonic() + self.ttl_seconds)
+        self._bytes += size
+        while self._bytes > self.max_bytes:
+            oldest: str = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def _remove(self, key: str) -> None:
+        entry: CacheEntry = self._entries.pop(key)
+        self._bytes -= entry.size
+
+    async def _fill(
+        self, key: str, compute: Callable[[], Awaitable[PredictionResult]]
+    ) -> PredictionResult:
+        try:
+            result: PredictionResult = await compute()
+            self.put(key, result)
+            return result
+        finally:
+            self._inflight.pop(key, None)
+
+    async def get_or_compute(
+        self, key: str, compute: Callable[[], Awaitable[PredictionResult]]
+    ) -> PredictionResult:
+        if not self.enabled:
+            return await compute()
+
+        if (result := self.get(key)) is not None:
+            self.hits += 1
+            return result
+
+        task: asyncio.Future | None = self._inflight.get(key)
+        if task is None:
+            self.misses += 1
+            task = asyncio.ensure_future(self._fill(key, compute))
+            self._inflight[key] = task
+        else:
+            self.coalesced += 1
+        # Отмена одного клиента не должна прерывать вычисление для остальных
+        return await asyncio.shield(task)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._bytes = 0
+
+    def status(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "inflight": len(self._inflight),
+        }
+
+
+prediction_cache = PredictionCache(
+    max_bytes=settings.predict_cache_max_bytes,
+    ttl_seconds=settings.predict_cache_ttl_seconds,
+)
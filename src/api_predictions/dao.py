@@ -0,0 +1,237 @@
+from datetime import datetime, timezone
+from logging import Logger, getLogger
+from typing import Any, AsyncContextManager, Callable, Sequence
+
+from fastapi import HTTPException
+from sqlalchemy import Table, bindparam, text
+from sqlalchemy.engine.row import Row
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.sql.elements import TextClause
+
+from src.api_predictions.schemas import JobAddDB
+from src.core.base_dao import BaseDao
+from src.core.models import detections_table, prediction_jobs_table
+from src.exceptions import valid_integer, valid_string
+
+logger: Logger = getLogger(__name__)
+
+SessionFactory = Callable[[], AsyncContextManager[AsyncSession]]
+
+
+def utc_now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def db_error(e: SQLAlchemyError) -> HTTPException:
+    logger.error("Ошибка %s", e)
+    return HTTPException(
+        status_code=500, detail="При обработке вашего запроса произошла ошибка"
+    )
+
+
+class PredictionJobsDao(BaseDao):
+    model: Table = prediction_jobs_table
+
+    async def add(self, model: JobAddDB) -> None:
+        model_dict: dict = model.model_dump()
+        logger.info("Будем добавлять задачу %s", model.id)
+        try:
+            stmt: TextClause = text(
+                f"INSERT INTO {self.model.name} \
+                    (id, user_id, status, filename, params, created_at, \
+                    owner, heartbeat_at) \
+                    VALUES (:id, :user_id, :status, :filename, :params, :created_at, \
+                    :owner, :heartbeat_at)"
+            )
+            stmt = stmt.bindparams(**model_dict)
+            await self._session.execute(stmt)
+        except SQLAlchemyError as e:
+            raise db_error(e)
+
+    async def mark_running(self, job_id: str, started_at: datetime) -> None:
+        valid_string(job_id)
+        try:
+            stmt: TextClause = text(
+                f"UPDATE {self.model.name} SET status = 'running', \
+                    started_at = :started_at WHERE id = :id"
+            )
+            stmt = stmt.bindparams(id=job_id, started_at=started_at)
+            await self._session.execute(stmt)
+        except SQLAlchemyError as e:
+            raise db_error(e)
+
+    async def finish(
+        self,
+        job_id: str,
+        status: str,
+        finished_at: datetime,
+        result: str | None = None,
+        status_code: int | None = None,
+        error: str | None = None,
+    ) -> None:
+        valid_string(job_id)
+        logger.info("Задача %s завершена со статусом %s", job_id, status)
+        try:
+            stmt: TextClause = text(
+                f"UPDATE {self.model.name} SET status = :status, \
+                    finished_at = :finished_at, result = :result, \
+                    status_code = :status_code, error = :error WHERE id = :id"
+            )
+            stmt = stmt.bindparams(
+                id=job_id,
+                status=status,
+                finished_at=finished_at,
+                result=result,
+                status_code=status_code,
+                error=error,
+            )
+            await self._session.execute(stmt)
+        except SQLAlchemyError as e:
+            raise db_error(e)
+
+    async def find_for_user(self, job_id: str, user_id: int) -> Row[Any] | None:
+        valid_string(job_id)
+        valid_integer(user_id)
+        try:
+            query: TextClause = text(
+                f"SELECT id, status, created_at, started_at, finished_at, \
+                    result, status_code, error FROM {self.model.name} \
+                    WHERE id = :id AND user_id = :user_id"
+            )
+            query = query.bindparams(id=job_id, user_id=user_id)
+            result = await self._session.execute(query)
+            return result.one_or_none()
+        except SQLAlchemyError as e:
+            raise db_error(e)
+
+    async def heartbeat(self, owner: str, job_ids: list[str], now: datetime) -> int:
+        """Отмечает как живые незавершённые задачи job_ids процесса owner"""
+        valid_string(owner)
+        try:
+            stmt: TextClause = text(
+                f"UPDATE {self.model.name} SET heartbeat_at = :now \
+                    WHERE owner = :owner AND id IN :ids \
+                    AND status IN ('queued', 'running')"
+            )
+            stmt = stmt.bindparams(
+                bindparam("ids", value=job_ids, expanding=True), owner=owner, now=now
+            )
+            result = await self._session.execute(stmt)
+            return result.rowcount
+        except SQLAlchemyError as e:
+            raise db_error(e)
+
+    async def fail_unfinished(
+        self, stale_before: datetime, finished_at: datetime, error: str
+    ) -> int:
+        """
+        Помечает ошибкой незавершённые задачи без отметки с stale_before:
+        процесс, в очереди которого они были, остановлен.
+        У задач, записанных до появления отметок, берётся время создания
+        """
+        try:
+            stmt: TextClause = text(
+                f"UPDATE {self.model.name} SET status = 'failed', \
+                    finished_at = :finished_at, status_code = 500, error = :error \
+                    WHERE status IN ('queued', 'running') \
+                    AND COALESCE(heartbeat_at, created_at) < :stale_before"
+            )
+            stmt = stmt.bindparams(
+                stale_before=stale_before, finished_at=finished_at, error=error
+            )
+            result = await self._session.execute(stmt)
+            return result.rowcount
+        except SQLAlchemyError as e:
+            raise db_error(e)
+
+
+class DetectionsDao(BaseDao):
+    model: Table = detections_table
+
+    # Столбцы в порядке вставки
+    columns: tuple[str, ...] = (
+        "prediction_id",
+        "user_id",
+        "filename",
+        "class_name",
+        "confidence",
+        "x1",
+        "y1",
+        "x2",
+        "y2",
+        "model_version",
+        "created_at",
+    )
+
+    async def add_many(self, rows: list[dict]) -> None:
+        """
+        Вставляет много строк одной операцией: COPY для asyncpg,
+        для остальных драйверов - один INSERT с executemany
+        """
+        if not rows:
+            return
+        logger.info("Будем добавлять объектов в историю: %d", len(rows))
+        try:
+            if self._session.bind.dialect.driver == "asyncpg":
+                connection = await self._session.connection()
+                raw_connection = await connection.get_raw_connection()
+                await raw_connection.driver_connection.copy_records_to_table(
+                    self.model.name,
+                    records=[tuple(row[column] for column in self.columns) for row in rows],
+                    columns=self.columns,
+                )
+                return
+            stmt: TextClause = text(
+                f"INSERT INTO {self.model.name} ({', '.join(self.columns)}) \
+                    VALUES ({', '.join(':' + column for column in self.columns)})"
+            )
+            await self._session.execute(stmt, rows)
+        except SQLAlchemyError as e:
+            raise db_error(e)
+
+    async def find_for_user(
+        self,
+        user_id: int,
+        since: datetime,
+        until: datetime,
+        class_name: str | None = None,
+    ) -> Sequence[Row[Any]]:
+        valid_integer(user_id)
+        params: dict = {"user_id": user_id, "since": since, "until": until}
+        class_filter: str = ""
+        if class_name is not None:
+            class_filter = "AND class_name = :class_name"
+            params["class_name"] = class_name
+        try:
+            query: TextClause = text(
+                f"SELECT prediction_id, filename, class_name, confidence, \
+                    x1, y1, x2, y2, model_version, created_at FROM {self.model.name} \
+                    WHERE user_id = :user_id AND created_at >= :since \
+                    AND created_at < :until {class_filter} \
+                    ORDER BY created_at DESC"
+            )
+            query = query.bindparams(**params)
+            result = await self._session.execute(query)
+            return result.fetchall()
+        except SQLAlchemyError as e:
+            raise db_error(e)
+
+    async def find_users_with_class(
+        self, class_name: str, since: datetime, until: datetime
+    ) -> Sequence[Row[Any]]:
+        """Пользователи, загружавшие изображения с объектами класса за период"""
+        valid_string(class_name)
+        try:
+            query: TextClause = text(
+                f"SELECT user_id, COUNT(DISTINCT prediction_id) AS images \
+                    FROM {self.model.name} \
+                    WHERE class_name = :class_name AND created_at >= :since \
+                    AND created_at < :until AND user_id IS NOT NULL \
+                    GROUP BY user_id ORDER BY user_id"
+            )
+            query = query.bindparams(class_name=class_name, since=since, until=until)
+            result = await self._session.execute(query)
+            return result.fetchall()
+        except SQLAlchemyError as e:
+            raise db_error(e)
@@ -0,0 +1,156 @@
+import asyncio
+from logging import Logger, getLogger
+from time import perf_counter
+from uuid import uuid4
+
+from src.api_predictions.dao import DetectionsDao, SessionFactory, utc_now
+from src.api_predictions.schemas import PredictionResult
+from src.core.config import settings
+from src.core.db_helper import db_helper
+from src.core.metrics import metrics
+
+logger: Logger = getLogger(__name__)
+
+
+class DetectionHistoryWriter:
+    """
+    Отложенная запись истории предсказаний (write-behind).
+    Запрос только добавляет строки в буфер в памяти, фоновая задача
+    записывает их в таблицу detections одной пакетной вставкой,
+    когда набралось flush_rows строк или прошло flush_interval секунд.
+    Если база недоступна, строки остаются в буфере, но не больше max_buffer:
+    самые старые отбрасываются, чтобы не расходовать память без предела
+    """
+
+    def __init__(
+        self,
+        session_factory: SessionFactory,
+        flush_rows: int,
+        flush_interval: float,
+        max_buffer: int,
+        enabled: bool = True,
+    ) -> None:
+        self._session_factory: SessionFactory = session_factory
+        self.flush_rows: int = max(1, flush_rows)
+        self.flush_interval: float = flush_interval
+        self.max_buffer: int = max_buffer
+        self.enabled: bool = enabled
+        # Буфер меняется только из цикла событий
+        self._rows: list[dict] = []
+        self._task: asyncio.Task | None = None
+        self._wakeup: asyncio.Event | None = None
+        self._flush_lock: asyncio.Lock | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self.written: int = 0
+        self.dropped: int = 0
+        self.failures: int = 0
+        metrics.register_collector("detection_history", self.status)
+
+    def _ensure_started(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._task is None or self._task.done():
+            self._loop = loop
+            self._wakeup = asyncio.Event()
+            self._flush_lock = asyncio.Lock()
+            self._task = loop.create_task(self._run())
+
+    def record(
+        self, user_id: int | None, filename: str, result: PredictionResult
+    ) -> None:
+        """Добавляет найденные объекты в буфер, не обращаясь к базе"""
+        if not self.enabled or not result.detections:
+            return
+        prediction_id: str = uuid4().hex
+        created_at = utc_now()
+        self._rows.extend(
+            {
+                "prediction_id": prediction_id,
+                "user_id": user_id,
+                "filename": filename[:255],
+                "class_name": detection.class_name,
+                "confidence": detection.confidence,
+                "x1": detection.box[0],
+                "y1": detection.box[1],
+                "x2": detection.box[2],
+                "y2": detection.box[3],
+                "model_version": result.model_version,
+                "created_at": created_at,
+            }
+            for detection in result.detections
+        )
+        self._trim()
+        self._ensure_started()
+        if len(self._rows) >= self.flush_rows:
+            self._wakeup.set()
+
+    def _trim(self) -> None:
+        excess: int = len(self._rows) - self.max_buffer
+        if excess > 0:
+            del self._rows[:excess]
+            self.dropped += excess
+            metrics.inc("history_dropped", excess)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self) -> int:
+        """Записывает накопленные строки одной вставкой, возвращает их число"""
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        async with self._flush_lock:
+            rows, self._rows = self._rows, []
+            if not rows:
+                return 0
+            start: float = perf_counter()
+            try:
+                async with self._session_factory() as session:
+                    await DetectionsDao(session).add_many(rows)
+                    await session.commit()
+            except asyncio.CancelledError:
+                self._rows = rows + self._rows
+                raise
+            except Exception as e:
+                logger.error("Не удалось записать историю (%d строк): %s", len(rows), e)
+                self.failures += 1
+                # Новые строки остаются после возвращённых, порядок сохраняется
+                self._rows = rows + self._rows
+                self._trim()
+                return 0
+            metrics.observe("history_flush", perf_counter() - start)
+            self.written += len(rows)
+            return len(rows)
+
+    async def close(self) -> None:
+        """Останавливает фоновую запись и сбрасывает остаток буфера"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    def status(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "buffered": len(self._rows),
+            "written": self.written,
+            "dropped": self.dropped,
+            "failures": self.failures,
+        }
+
+
+history_writer = DetectionHistoryWriter(
+    session_factory=db_helper.session_factory,
+    flush_rows=settings.predict_history_flush_rows,
+    flush_interval=settings.predict_history_flush_interval,
+    max_buffer=settings.predict_history_max_buffer,
+    enabled=settings.predict_history_enabled,
+)
@@ -0,0 +1,95 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from functools import partial
+from logging import Logger, getLogger
+from typing import Any, AsyncIterator, Callable, TypeVar
+
+from fastapi import HTTPException, status
+
+from src.core.config import settings
+from src.core.metrics import metrics
+
+logger: Logger = getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class InferencePool:
+    """
+    Пул потоков для инференса с ограниченной очередью перед ним.
+    OpenCV отпускает GIL во время декодирования и forward, поэтому потоки
+    не блокируют цикл событий и работают параллельно.
+    Когда очередь заполнена, запрос сразу отклоняется с 503 и Retry-After
+    """
+
+    def __init__(self, workers: int, queue_size: int, retry_after: int = 1) -> None:
+        if workers < 1:
+            raise ValueError("Количество потоков должно быть больше нуля")
+        self.workers: int = workers
+        self.queue_size: int = queue_size
+        self.retry_after: int = retry_after
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="inference"
+        )
+        # Счётчик меняется только из цикла событий, поэтому блокировка не нужна
+        self._pending: int = 0
+        metrics.register_collector("inference_pool", self.status)
+
+    @property
+    def capacity(self) -> int:
+        return self.workers + self.queue_size
+
+    def _reject(self) -> HTTPException:
+        metrics.inc("inference_rejected")
+        logger.warning("Очередь инференса заполнена (%d задач)", self._pending)
+        return HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Сервер перегружен, повторите запрос позже",
+            headers={"Retry-After": str(self.retry_after)},
+        )
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        """
+        Резервирует место в очереди на всё время обработки запроса,
+        который может выполнить в пуле несколько шагов
+        """
+        if self._pending >= self.capacity:
+            raise self._reject()
+        self._pending += 1
+        metrics.inc("inference_submitted")
+        try:
+            yield
+        finally:
+            self._pending -= 1
+
+    async def execute(self, func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """Выполняет функцию в пуле без проверки очереди"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor, partial(func, *args, **kwargs)
+        )
+
+    async def run(self, func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """Выполняет функцию в пуле или отклоняет её, если очередь заполнена"""
+        async with self.slot():
+            return await self.execute(func, *args, **kwargs)
+
+    def status(self) -> dict:
+        return {
+            "workers": self.workers,
+            "queue_size": self.queue_size,
+            "pending": self._pending,
+            "queued": max(0, self._pending - self.workers),
+        }
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+inference_pool = InferencePool(
+    workers=settings.predict_workers,
+    queue_size=settings.predict_queue_size,
+    retry_after=settings.predict_retry_after,
+)
@@ -0,0 +1,331 @@
+import asyncio
+from datetime import datetime, timedelta
+from logging import Logger, getLogger
+from typing import NamedTuple
+from uuid import uuid4
+
+import orjson
+from fastapi import HTTPException, status
+
+from src.api_predictions.dao import PredictionJobsDao, SessionFactory, utc_now
+from src.api_predictions.schemas import (
+    JobAddDB,
+    JobInfo,
+    PredictionParams,
+    PredictionResponse,
+    PredictionResult,
+)
+from src.api_predictions.service import predict_image
+from src.core.config import settings
+from src.core.db_helper import db_helper
+from src.core.metrics import metrics
+
+logger: Logger = getLogger(__name__)
+
+
+class QueuedJob(NamedTuple):
+    """Задача в очереди планировщика вместе с загруженными байтами"""
+
+    id: str
+    file_content: bytes
+    filename: str
+    params: PredictionParams
+    user_id: int | None
+
+
+class JobScheduler:
+    """
+    Асинхронные задачи предсказания: задача записывается в базу и ставится
+    в очередь, ответ с её идентификатором возвращается сразу.
+    Фоновые обработчики выполняют не больше concurrency задач одновременно,
+    состояние и результат сохраняются в таблице prediction_jobs.
+    Очередь живёт в памяти процесса и ограничена max_pending задачами
+    и max_pending_bytes байтами загруженных изображений.
+    Задачи записываются с идентификатором процесса (owner), который раз
+    в heartbeat_interval отмечает задачи, находящиеся у него в памяти.
+    Задачи без отметки дольше STALE_HEARTBEATS интервалов остались в очереди
+    остановленного процесса или потеряны из-за ошибки записи состояния
+    и помечаются ошибкой любым живым процессом
+    """
+
+    STALE_HEARTBEATS: int = 3
+    # Попыток записать итог задачи, прежде чем оставить её проверке отметок
+    FINISH_ATTEMPTS: int = 3
+
+    def __init__(
+        self,
+        session_factory: SessionFactory,
+        concurrency: int,
+        max_pending: int,
+        max_pending_bytes: int,
+        heartbeat_interval: float,
+        retry_after: int = 1,
+    ) -> None:
+        self._session_factory: SessionFactory = session_factory
+        self.concurrency: int = max(1, concurrency)
+        self.max_pending: int = max_pending
+        self.max_pending_bytes: int = max_pending_bytes
+        self.heartbeat_interval: float = heartbeat_interval
+        self.retry_after: int = retry_after
+        self.owner: str = uuid4().hex
+        self._queue: asyncio.Queue | None = None
+        self._workers: list[asyncio.Task] = []
+        self._sweeper: asyncio.Task | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+        # Счётчики меняются только из цикла событий
+        self._pending: int = 0
+        self._pending_bytes: int = 0
+        # Задачи в очереди и в обработке: только их отмечает sweep
+        self._held: set[str] = set()
+        self._running: int = 0
+        self.completed: int = 0
+        self.failed: int = 0
+        self.abandoned: int = 0
+        metrics.register_collector("prediction_jobs", self.status)
+
+    def _ensure_started(self) -> asyncio.Queue:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._queue is None:
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._workers = [
+                loop.create_task(self._work(self._queue))
+                for _ in range(self.concurrency)
+            ]
+        return self._queue
+
+    async def submit(
+        self,
+        file_content: bytes,
+        filename: str,
+        params: PredictionParams,
+        user_id: int | None,
+    ) -> JobInfo:
+        """Сохраняет задачу и ставит её в очередь, не дожидаясь обработки"""
+        size: int = len(file_content)
+        if (
+            self._pending >= self.max_pending
+            or self._pending_bytes + size > self.max_pending_bytes
+        ):
+            metrics.inc("jobs_rejected")
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Очередь задач заполнена, повторите запрос позже",
+                headers={"Retry-After": str(self.retry_after)},
+            )
+        created_at: datetime = utc_now()
+        job = JobAddDB(
+            id=uuid4().hex,
+            user_id=user_id,
+            status="queued",
+            filename=filename,
+            params=params.model_dump_json(),
+            created_at=created_at,
+            owner=self.owner,
+            heartbeat_at=created_at,
+        )
+        self._pending += 1
+        self._pending_bytes += size
+        try:
+            async with self._session_factory() as session:
+                await PredictionJobsDao(session).add(job)
+                await session.commit()
+        except Exception:
+            self._pending -= 1
+            self._pending_bytes -= size
+            raise
+
+        self._held.add(job.id)
+        self._ensure_started().put_nowait(
+            QueuedJob(job.id, file_content, filename, params, user_id)
+        )
+        metrics.inc("jobs_submitted")
+        logger.info("Задача %s поставлена в очередь", job.id)
+        return JobInfo(id=job.id, status="queued", created_at=job.created_at)
+
+    async def get(self, job_id: str, user_id: int) -> JobInfo | None:
+        async with self._session_factory() as session:
+            row = await PredictionJobsDao(session).find_for_user(job_id, user_id)
+        if row is None:
+            return None
+        return JobInfo(
+            id=row.id,
+            status=row.status,
+            created_at=row.created_at,
+            started_at=row.started_at,
+            finished_at=row.finished_at,
+            result=(
+                PredictionResponse.model_validate_json(row.result)
+                if row.result
+                else None
+            ),
+            status_code=row.status_code,
+            error=row.error,
+        )
+
+    async def _work(self, queue: asyncio.Queue) -> None:
+        while True:
+            job: QueuedJob = await queue.get()
+            try:
+                await self._run(job)
+            except Exception as e:
+                logger.error("Не удалось сохранить состояние задачи %s: %s", job.id, e)
+                if await self._finish(
+                    job.id,
+                    None,
+                    status.HTTP_500_INTERNAL_SERVER_ERROR,
+                    "Не удалось сохранить состояние задачи",
+                ):
+                    self.failed += 1
+            finally:
+                self._pending -= 1
+                self._pending_bytes -= len(job.file_content)
+                self._held.discard(job.id)
+
+    async def _run(self, job: QueuedJob) -> None:
+        async with self._session_factory() as session:
+            await PredictionJobsDao(session).mark_running(job.id, utc_now())
+            await session.commit()
+
+        self._running += 1
+        result: PredictionResult | None = None
+        status_code: int = status.HTTP_200_OK
+        error: str | None = None
+        try:
+            result = await self._predict(job)
+        except HTTPException as e:
+            status_code, error = e.status_code, str(e.detail)
+        except Exception as e:
+            logger.error("Ошибка при обработке задачи %s: %s", job.id, e)
+            status_code, error = status.HTTP_500_INTERNAL_SERVER_ERROR, str(e)
+        finally:
+            self._running -= 1
+
+        if not await self._finish(job.id, result, status_code, error):
+            return
+        if result is not None:
+            self.completed += 1
+        else:
+            self.failed += 1
+
+    async def _finish(
+        self,
+        job_id: str,
+        result: PredictionResult | None,
+        status_code: int,
+        error: str | None,
+    ) -> bool:
+        """
+        Записывает итог задачи, повторяя запись при ошибке базы.
+        Если записать не удалось, задача перестаёт отмечаться
+        и помечается ошибкой при проверке отметок
+        """
+        for attempt in range(1, self.FINISH_ATTEMPTS + 1):
+            try:
+                async with self._session_factory() as session:
+                    await PredictionJobsDao(session).finish(
+                        job_id,
+                        "done" if result is not None else "failed",
+                        utc_now(),
+                        result=(
+                            orjson.dumps(
+                                result.as_response().model_dump(exclude_none=True)
+                            ).decode()
+                            if result is not None
+                            else None
+                        ),
+                        status_code=status_code,
+                        error=error,
+                    )
+                    await session.commit()
+                return True
+            except Exception as e:
+                logger.error(
+                    "Не удалось записать итог задачи %s (попытка %d): %s",
+                    job_id,
+                    attempt,
+                    e,
+                )
+                if attempt < self.FINISH_ATTEMPTS:
+                    await asyncio.sleep(self.retry_after)
+        return False
+
+    async def _predict(self, job: QueuedJob) -> PredictionResult:
+        while True:
+            try:
+                return await predict_image(
+                    job.file_content, job.filename, job.params, job.user_id
+                )
+            except HTTPException as e:
+                if e.status_code != status.HTTP_503_SERVICE_UNAVAILABLE:
+                    raise
+            # Пул занят синхронными запросами: задача ждёт, а не завершается ошибкой
+            await asyncio.sleep(self.retry_after)
+
+    async def sweep(self) -> int:
+        """
+        Отмечает свои незавершённые задачи и помечает ошибкой чужие,
+        давно оставшиеся без отметки: очередь в памяти теряется
+        при остановке процесса
+        """
+        now: datetime = utc_now()
+        async with self._session_factory() as session:
+            dao = PredictionJobsDao(session)
+            if self._held:
+                await dao.heartbeat(self.owner, list(self._held), now)
+            count: int = await dao.fail_unfinished(
+                stale_before=now
+                - timedelta(seconds=self.heartbeat_interval * self.STALE_HEARTBEATS),
+                finished_at=now,
+                error="Обработка прервана остановкой процесса",
+            )
+            await session.commit()
+        if count:
+            self.abandoned += count
+            logger.warning("Помечено прерванных задач: %d", count)
+        return count
+
+    def start(self) -> None:
+        """Запускает периодическую отметку задач, первая проверка сразу"""
+        if self._sweeper is None or self._sweeper.done():
+            self._sweeper = asyncio.get_running_loop().create_task(self._run_sweeps())
+
+    async def _run_sweeps(self) -> None:
+        while True:
+            try:
+                await self.sweep()
+            except Exception as e:
+                logger.error("Не удалось проверить незавершённые задачи: %s", e)
+            await asyncio.sleep(self.heartbeat_interval)
+
+    def stop(self) -> None:
+        for worker in self._workers:
+            worker.cancel()
+        self._workers = []
+        self._queue = None
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            self._sweeper = None
+
+    def status(self) -> dict:
+        return {
+            "pending": self._pending,
+            "running": self._running,
+            "max_pending": self.max_pending,
+            "pending_bytes": self._pending_bytes,
+            "max_pending_bytes": self.max_pending_bytes,
+            "held": len(self._held),
+            "completed": self.completed,
+            "failed": self.failed,
+            "abandoned": self.abandoned,
+        }
+
+
+job_scheduler = JobScheduler(
+    session_factory=db_helper.session_factory,
+    concurrency=settings.predict_jobs_concurrency,
+    max_pending=settings.predict_jobs_max_pending,
+    max_pending_bytes=settings.predict_jobs_max_pending_bytes,
+    heartbeat_interval=settings.predict_jobs_heartbeat_seconds,
+    retry_after=settings.predict_retry_after,
+)
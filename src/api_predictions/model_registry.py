@@ -0,0 +1,201 @@
+import threading
+from logging import Logger, getLogger
+from pathlib import Path
+from time import perf_counter
+from typing import Any, Callable, NamedTuple
+
+import cv2
+import numpy as np
+
+from src.core.metrics import metrics
+
+logger: Logger = getLogger(__name__)
+
+# Размер входа MobileNet-SSD
+INPUT_SIZE: tuple[int, int] = (300, 300)
+
+NetLoader = Callable[[], Any]
+
+
+class CaffeNetLoader:
+    """
+    Читает файлы модели с диска один раз и затем собирает
+    новые экземпляры сети из буферов в памяти
+    """
+
+    def __init__(self, config_path: Path, model_path: Path) -> None:
+        self.config_path: Path = config_path
+        self.model_path: Path = model_path
+        self._proto: np.ndarray | None = None
+        self._weights: np.ndarray | None = None
+        self._lock = threading.Lock()
+
+    def _read_buffers(self) -> tuple[np.ndarray, np.ndarray]:
+        with self._lock:
+            if self._proto is None or self._weights is None:
+                logger.info("Читаем файлы модели %s", self.model_path)
+                self._proto = np.frombuffer(self.config_path.read_bytes(), np.uint8)
+                self._weights = np.frombuffer(self.model_path.read_bytes(), np.uint8)
+            return self._proto, self._weights
+
+    def __call__(self) -> cv2.dnn.Net:
+        proto, weights = self._read_buffers()
+        return cv2.dnn.readNetFromCaffe(proto, weights)
+
+
+class LoadedModel(NamedTuple):
+    """Экземпляр сети и версия модели, из которой он создан"""
+
+    version: str
+    net: Any
+
+
+class ModelRegistry:
+    """
+    Реестр модели: загружает сеть один раз (при старте или первом обращении),
+    прогревает её и выдаёт каждому потоку-обработчику собственный экземпляр.
+    При старте сети заранее создаются для всех потоков пула, поэтому
+    первые запросы не тратят время на загрузку и прогрев.
+    Новую версию можно загрузить в фоне и атомарно переключить на неё трафик:
+    начатые forward доработают на старой сети, после чего она освобождается
+    """
+
+    def __init__(
+        self,
+        loader: NetLoader,
+        input_size: tuple[int, int] = INPUT_SIZE,
+        version: str = "default",
+    ) -> None:
+        self._loader: NetLoader = loader
+        self.version: str = version
+        self.input_size: tuple[int, int] = input_size
+        self._lock = threading.Lock()
+        # Сети текущей версии по идентификатору потока
+        self._nets: dict[int, LoadedModel] = {}
+        # Прогретые сети активной версии, ещё не выданные потокам
+        self._spares: list[Any] = []
+        self._warm: bool = False
+        self._reloading: str | None = None
+        self.load_seconds: float | None = None
+        metrics.register_collector("model", self.status)
+
+    @property
+    def is_warm(self) -> bool:
+        return self._warm
+
+    @property
+    def loader(self) -> NetLoader:
+        return self._loader
+
+    @property
+    def reloading(self) -> str | None:
+        return self._reloading
+
+    def _create_net(self, loader: NetLoader) -> Any:
+        net = loader()
+        self._warmup(net)
+        return net
+
+    def _warmup(self, net: Any) -> None:
+        """Прогоняет пустое изображение, чтобы первый запрос не платил за инициализацию"""
+        w, h = self.input_size
+        net.setInput(np.zeros((1, 3, h, w), dtype=np.float32))
+        net.forward()
+
+    def load(self, workers: int = 1) -> None:
+        """
+        Загружает и прогревает модель, если она ещё не загружена:
+        по сети на каждый из workers потоков, потоки заберут их при
+        первом обращении. Загружающий поток сеть за собой не закрепляет
+        """
+        with self._lock:
+            if self._warm:
+                return
+            start: float = perf_counter()
+            self._spares = [
+                self._create_net(self._loader) for _ in range(max(1, workers))
+            ]
+            self.load_seconds = perf_counter() - start
+            self._warm = True
+        metrics.set_gauge("model_load_seconds", self.load_seconds)
+        logger.info(
+            "Модель %s загружена и прогрета за %.3f с", self.version, self.load_seconds
+        )
+
+    def acquire(self) -> LoadedModel:
+        """Возвращает экземпляр сети активной версии, принадлежащий текущему потоку"""
+        ident: int = threading.get_ident()
+        if (model := self._nets.get(ident)) is not None:
+            return model
+        if not self._warm:
+            self.load()
+
+        with self._lock:
+            loader, version = self._loader, self.version
+            net = self._spares.pop() if self._spares else None
+        if net is None:
+            start: float = perf_counter()
+            net = self._create_net(loader)
+            metrics.observe("model_worker_init", perf_counter() - start)
+            logger.info(
+                "Создан экземпляр сети %s для потока %s",
+                version,
+                threading.current_thread().name,
+            )
+
+        model = LoadedModel(version, net)
+        with self._lock:
+            # Пока сеть создавалась, могла включиться новая версия
+            if version == self.version:
+                self._nets[ident] = model
+        return model
+
+    def get_net(self) -> Any:
+        return self.acquire().net
+
+    def reload(self, loader: NetLoader, version: str, workers: int = 1) -> None:
+        """
+        Загружает и прогревает версию version (по сети на каждый из workers потоков),
+        затем атомарно делает её активной. Выполняется вне цикла событий
+        """
+        with self._lock:
+            if self._reloading is not None:
+                raise RuntimeError(f"Уже загружается версия {self._reloading}")
+            self._reloading = version
+        try:
+            start: float = perf_counter()
+            spares: list[Any] = [
+                self._create_net(loader) for _ in range(max(1, workers))
+            ]
+            load_seconds: float = perf_counter() - start
+            with self._lock:
+                previous: str = self.version
+                self._loader = loader
+                self.version = version
+                self._spares = spares
+                # Потоки получат новые сети при следующем обращении,
+                # старые освободятся после завершения начатых forward
+                self._nets = {}
+                self._warm = True
+                self.load_seconds = load_seconds
+        finally:
+            with self._lock:
+                self._reloading = None
+        metrics.inc("model_reloads")
+        metrics.set_gauge("model_load_seconds", load_seconds)
+        logger.info(
+            "Модель переключена с %s на %s, загрузка заняла %.3f с",
+            previous,
+            version,
+            load_seconds,
+        )
+
+    def status(self) -> dict:
+        return {
+            "state": "warm" if self._warm else "cold",
+            "version": self.version,
+            "load_seconds": self.load_seconds,
+            "workers": len(self._nets),
+            "spares": len(self._spares),
+            "reloading": self._reloading,
+        }
@@ -0,0 +1,97 @@
+from typing import NamedTuple
+
+import cv2
+import numpy as np
+
+# Метки классов PASCAL VOC
+VOC_LABELS = [
+    "background", "aeroplane", "bicycle", "bird", "boat", "bottle",
+    "bus", "car", "cat", "chair", "cow", "diningtable",
+    "dog", "horse", "motorbike", "person", "pottedplant",
+    "sheep", "sofa", "train", "tvmonitor"
+]
+
+
+class SelectedDetections(NamedTuple):
+    """Отобранные объекты: рамки [x1, y1, x2, y2] в пикселях, оценки и классы"""
+
+    boxes: np.ndarray
+    scores: np.ndarray
+    class_ids: np.ndarray
+
+
+def class_ids_for(class_names: list[str] | None) -> np.ndarray | None:
+    if class_names is None:
+        return None
+    return np.array([VOC_LABELS.index(name) for name in class_names], dtype=np.int64)
+
+
+def select_detections(
+    detections: np.ndarray,
+    width: int,
+    height: int,
+    confidence: float = 0.6,
+    class_ids: np.ndarray | None = None,
+    max_detections: int | None = None,
+    nms_threshold: float | None = None,
+) -> SelectedDetections:
+    """
+    Векторно отбирает объекты из выхода SSD (1x1xNx7):
+    порог уверенности, фильтр по классам, масштабирование и обрезка рамок,
+    необязательный NMS по классам и ограничение количества
+    """
+    rows: np.ndarray = detections.reshape(-1, 7)
+    mask: np.ndarray = rows[:, 2] > confidence
+    if class_ids is not None:
+        mask &= np.isin(rows[:, 1].astype(np.int64), class_ids)
+    rows = rows[mask]
+
+    scores: np.ndarray = rows[:, 2]
+    labels: np.ndarray = rows[:, 1].astype(np.int64)
+    scale = np.array([width, height, width, height], dtype=np.float32)
+    boxes: np.ndarray = rows[:, 3:7] * scale
+    np.clip(boxes, 0, scale - 1, out=boxes)
+    boxes = boxes.astype(np.int32)
+
+    if nms_threshold is not None and len(scores):
+        rects: np.ndarray = np.column_stack((boxes[:, :2], boxes[:, 2:] - boxes[:, :2]))
+        keep = np.asarray(
+            cv2.dnn.NMSBoxesBatched(rects, scores, labels, confidence, nms_threshold),
+            dtype=np.int64,
+        ).reshape(-1)
+        boxes, scores, labels = boxes[keep], scores[keep], labels[keep]
+
+    # Сначала самые уверенные, затем отсекаем лишнее
+    order: np.ndarray = np.argsort(-scores, kind="stable")[:max_detections]
+    return SelectedDetections(boxes[order], scores[order], labels[order])
+
+
+def draw_detections(img: np.ndarray, selected: SelectedDetections) -> None:
+    """Рисует рамки и подписи на изображении"""
+    for (x1, y1, x2, y2), score, class_id in zip(
+        selected.boxes.tolist(), selected.scores.tolist(), selected.class_ids.tolist()
+    ):
+        cv2.rectangle(img, (x1, y1), (x2, y2), (0, 255, 0), 2)
+        label = f"{VOC_LABELS[class_id]}: {score:.2f}"
+        cv2.putText(img, label, (x1 + 5, y1 + 15),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
+
+
+def render_image(
+    img: np.ndarray,
+    selected: SelectedDetections,
+    quality: int,
+    max_dimension: int | None = None,
+) -> bytes:
+    """
+    Уменьшает изображение до max_dimension по большей стороне,
+    рисует на нём объекты и кодирует в JPEG с заданным качеством
+    """
+    h, w = img.shape[:2]
+    if max_dimension and max(h, w) > max_dimension:
+        scale: float = max_dimension / max(h, w)
+        img = cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        selected = selected._replace(boxes=(selected.boxes * scale).astype(np.int32))
+    draw_detections(img, selected)
+    _, buffer = cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    return buffer.tobytes()
@@ -1,111 +1,323 @@
-import os
-import base64
+import sys
 from logging import Logger, getLogger
+from time import perf_counter
+from typing import NamedTuple
 
 import cv2
 import numpy as np
 from pathlib import Path
 from fastapi import HTTPException, status
 
-from src.api_predictions.schemas import PredictionResponse, Detection
+from src.api_predictions.backends import (
+    BACKEND_NAMES,
+    InferenceBackend,
+    benchmark_backends,
+    create_backend,
+)
+from src.api_predictions.model_registry import INPUT_SIZE, LoadedModel, ModelRegistry
+from src.api_predictions.postprocess import (
+    VOC_LABELS,
+    SelectedDetections,
+    class_ids_for,
+    render_image,
+    select_detections,
+)
+from src.api_predictions.schemas import (
+    Detection,
+    DetectionParams,
+    PredictionParams,
+    PredictionResult,
+)
+from src.api_predictions.tiling import (
+    Tile,
+    crop_tiles,
+    merge_tile_detections,
+    plan_tiles,
+)
+from src.api_predictions.uploads import (
+    ImageHeader,
+    read_image_header,
+    reduced_decode_flag,
+)
+from src.core.config import settings
+from src.core.metrics import metrics
 
 # Настройка логгера
 logger: Logger = getLogger(__name__)
 
 # Константы
 BASE_DIR = Path(__file__).parent.parent.parent
-TEMP_DIR = BASE_DIR / "src" / "api_predictions" / "temp"
 MODEL_PATH = BASE_DIR / "src" / "api_predictions" / "mobilenet_iter_73000.caffemodel"
 CONFIG_PATH = BASE_DIR / "src" / "api_predictions" / "mobilenet_ssd_deploy.prototxt"
 
-# Создаем временную директорию, если она не существует
-os.makedirs(TEMP_DIR, exist_ok=True)
-
-# Метки классов PASCAL VOC
-VOC_LABELS = [
-    "background", "aeroplane", "bicycle", "bird", "boat", "bottle",
-    "bus", "car", "cat", "chair", "cow", "diningtable",
-    "dog", "horse", "motorbike", "person", "pottedplant",
-    "sheep", "sofa", "train", "tvmonitor"
-]
-
-def process_image_prediction(file_content: bytes, filename: str) -> PredictionResponse:
-    """Обрабатывает предсказание для изображения"""
-    try:
-        logger.info("Запросил предсказание для файла %s", filename)
-
-        # Сохраняем загруженный файл во временную директорию
-        temp_file_path: Path = TEMP_DIR / filename
-        with open(temp_file_path, "wb") as buffer:
-            buffer.write(file_content)
-
-        # Загружаем модель
-        net = cv2.dnn.readNetFromCaffe(str(CONFIG_PATH), str(MODEL_PATH))
-
-        # Читаем изображение
-        img = cv2.imread(str(temp_file_path))
-        if img is None:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Не удалось загрузить изображение"
-            )
-
-        h, w = img.shape[:2]
-        blob = cv2.dnn.blobFromImage(img, 0.007843, (300, 300), 127.5)
-
-        # Делаем предсказание
-        net.setInput(blob)
-        detections = net.forward()
-
-        # Обрабатываем все найденные объекты
-        found_detections = []
-        for i in range(detections.shape[2]):
-            confidence = detections[0, 0, i, 2]
-            if confidence > 0.6:
-                class_id = int(detections[0, 0, i, 1])
-                class_label = VOC_LABELS[class_id]
-                
-                # Получаем координаты рамки
-                box = detections[0, 0, i, 3:7] * np.array([w, h, w, h])
-                (startX, startY, endX, endY) = box.astype("int")
-                
-                # Рисуем рамку и подпись
-                cv2.rectangle(img, (startX, startY), (endX, endY), (0, 255, 0), 2)
-                label = f"{class_label}: {confidence:.2f}"
-                cv2.putText(img, label, (startX + 5, startY + 15), 
-                           cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
-                
-                found_detections.append(Detection(
-                    class_name=class_label,
-                    confidence=float(confidence),
-                    box=[int(startX), int(startY), int(endX), int(endY)]
-                ))
-
-        if not found_detections:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Не удалось определить объекты на изображении"
-            )
-
-        # Кодируем обработанное изображение в base64
-        _, buffer = cv2.imencode('.jpg', img)
-        processed_image = base64.b64encode(buffer).decode('utf-8')
-
-        # Удаляем временный файл
-        if os.path.exists(temp_file_path):
-            os.remove(temp_file_path)
-
-        logger.info("Найдено объектов: %d", len(found_detections))
-        return PredictionResponse(
-            detections=found_detections,
-            processed_image=processed_image
+# Параметры нормализации входа MobileNet-SSD
+BLOB_SCALE = 0.007843
+BLOB_MEAN = 127.5
+
+
+class ModelFiles(NamedTuple):
+    """Файлы одной версии модели для разных бэкендов"""
+
+    config_path: Path
+    model_path: Path
+    onnx_model_path: Path
+
+
+def model_files(version: str) -> ModelFiles:
+    """
+    Файлы версии модели: начальная версия лежит рядом с модулем,
+    остальные - в одноимённых каталогах внутри predict_models_dir
+    """
+    if version == settings.predict_model_version:
+        return ModelFiles(CONFIG_PATH, MODEL_PATH, settings.predict_onnx_model_path)
+    if not version or version in (".", "..") or Path(version).name != version:
+        raise ValueError(f"Некорректная версия модели: {version!r}")
+    version_dir: Path = settings.predict_models_dir / version
+    return ModelFiles(
+        version_dir / CONFIG_PATH.name,
+        version_dir / MODEL_PATH.name,
+        version_dir / settings.predict_onnx_model_path.name,
+    )
+
+
+def backend_for_version(version: str) -> InferenceBackend:
+    return create_backend(settings.predict_backend, *model_files(version))
+
+
+# Модель загружается один раз на процесс, а не на каждый запрос
+model_registry = ModelRegistry(
+    backend_for_version(settings.predict_model_version),
+    version=settings.predict_model_version,
+)
+
+
+def backend_status() -> dict:
+    loader = model_registry.loader
+    return loader.describe() if isinstance(loader, InferenceBackend) else {}
+
+
+metrics.register_collector("inference_backend", backend_status)
+
+
+class ModelOutput(NamedTuple):
+    """Выход сети для одного изображения и версия модели, которая его дала"""
+
+    detections: np.ndarray
+    model_version: str
+
+
+class DecodedImage(NamedTuple):
+    """Декодированное изображение и размеры исходного файла"""
+
+    image: np.ndarray
+    width: int
+    height: int
+
+
+def decode_image(file_content: bytes, flags: int = cv2.IMREAD_COLOR) -> np.ndarray:
+    """Декодирует загруженный файл в изображение BGR прямо из памяти"""
+    # np.frombuffer не копирует байты, imdecode читает их напрямую
+    buffer: np.ndarray = np.frombuffer(file_content, dtype=np.uint8)
+    img = cv2.imdecode(buffer, flags) if buffer.size else None
+    if img is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Не удалось загрузить изображение"
         )
+    return img
+
+
+def decode_target_side(params: PredictionParams) -> int:
+    """Какой большой стороны достаточно для ответа в запрошенном формате"""
+    if params.tiled:
+        # Фрагментам нужно полное разрешение
+        return sys.maxsize
+    if params.output == "json":
+        return settings.predict_decode_min_side
+    output_side: int = (
+        params.max_dimension
+        or settings.predict_max_dimension
+        or settings.predict_decode_max_side
+    )
+    return max(output_side, settings.predict_decode_min_side)
+
 
-    except Exception as e:
-        logger.error("Ошибка при обработке запроса: %s", e)
-        if os.path.exists(temp_file_path):
-            os.remove(temp_file_path)
+def decode_upload(file_content: bytes, target_side: int) -> DecodedImage:
+    """
+    Декодирует изображение не крупнее, чем нужно: по размерам из заголовка
+    выбирается уменьшенное декодирование (для JPEG оно ещё и быстрее),
+    при котором большая сторона остаётся не меньше target_side
+    """
+    header: ImageHeader | None = read_image_header(file_content)
+    flags, factor = reduced_decode_flag(header, target_side)
+    img: np.ndarray = decode_image(file_content, flags)
+    h, w = img.shape[:2]
+    if factor == 1:
+        return DecodedImage(img, w, h)
+
+    metrics.inc("decode_reduced")
+    width, height = header.width, header.height
+    # Ориентация из EXIF могла повернуть изображение при декодировании
+    if (w > h) != (width > height):
+        width, height = height, width
+    return DecodedImage(img, width, height)
+
+
+def benchmark_inference_backends() -> dict[str, dict]:
+    """Замеряет бэкенды активной версии модели на этом хосте"""
+    files: ModelFiles = model_files(model_registry.version)
+    backends: list[InferenceBackend] = [
+        create_backend(name, *files) for name in BACKEND_NAMES
+    ]
+    results = benchmark_backends(
+        backends,
+        iterations=settings.predict_benchmark_iterations,
+        batch_size=max(1, settings.predict_batch_max_size),
+    )
+    metrics.set_gauge("backend_benchmark", results)
+    return results
+
+
+def split_detections(detections: np.ndarray, batch_size: int) -> list[np.ndarray]:
+    """
+    Разбивает выход сети для пакета изображений по исходным изображениям.
+    Первый столбец каждой строки SSD - номер изображения в пакете
+    """
+    if batch_size == 1:
+        return [detections]
+    rows: np.ndarray = detections[0, 0]
+    image_ids: np.ndarray = rows[:, 0].astype(np.int64)
+    return [rows[image_ids == i][np.newaxis, np.newaxis] for i in range(batch_size)]
+
+
+def detect_objects(images: list[np.ndarray]) -> list[ModelOutput]:
+    """Прогоняет пакет изображений через сеть одним вызовом forward"""
+    model: LoadedModel = model_registry.acquire()
+    blob = cv2.dnn.blobFromImages(images, BLOB_SCALE, INPUT_SIZE, BLOB_MEAN)
+    model.net.setInput(blob)
+    start: float = perf_counter()
+    detections = model.net.forward()
+    elapsed: float = perf_counter() - start
+    metrics.observe("forward", elapsed)
+    # Отдельно по версиям, чтобы связывать изменения задержки с моделью
+    metrics.observe(f"forward[{model.version}]", elapsed)
+    return [
+        ModelOutput(image_detections, model.version)
+        for image_detections in split_detections(detections, len(images))
+    ]
+
+
+def detect_tiled(img: np.ndarray) -> ModelOutput:
+    """
+    Ищет объекты на перекрывающихся фрагментах изображения и на нём целиком
+    (для крупных объектов) за один forward и сводит рамки в координаты изображения
+    """
+    h, w = img.shape[:2]
+    tiles: list[Tile] = plan_tiles(
+        w,
+        h,
+        settings.predict_tile_size,
+        settings.predict_tile_overlap,
+        settings.predict_max_tiles,
+    )
+    if not tiles:
+        return detect_objects([img])[0]
+    tiles.append(Tile(0, 0, w, h))
+    outputs: list[ModelOutput] = detect_objects(crop_tiles(img, tiles))
+    metrics.inc("tiled_predictions")
+    metrics.inc("tiles", len(tiles))
+    detections: np.ndarray = merge_tile_detections(
+        [output.detections for output in outputs], tiles, w, h
+    )
+    return ModelOutput(detections, outputs[0].model_version)
+
+
+def select_for_params(
+    detections: np.ndarray,
+    width: int,
+    height: int,
+    params: DetectionParams,
+    tiled: bool = False,
+) -> SelectedDetections:
+    nms_threshold: float | None = params.nms_threshold
+    if nms_threshold is None and tiled:
+        # Объекты на перекрытиях фрагментов найдены несколько раз
+        nms_threshold = settings.predict_tile_nms_threshold
+    return select_detections(
+        detections,
+        width=width,
+        height=height,
+        confidence=params.confidence,
+        class_ids=class_ids_for(params.classes),
+        max_detections=params.max_detections,
+        nms_threshold=nms_threshold,
+    )
+
+
+def to_detections(selected: SelectedDetections) -> list[Detection]:
+    return [
+        Detection(class_name=VOC_LABELS[class_id], confidence=score, box=box)
+        for box, score, class_id in zip(
+            selected.boxes.tolist(),
+            selected.scores.tolist(),
+            selected.class_ids.tolist(),
+        )
+    ]
+
+
+def build_prediction(
+    img: np.ndarray,
+    detections: np.ndarray,
+    params: PredictionParams | None = None,
+    original_size: tuple[int, int] | None = None,
+    model_version: str | None = None,
+) -> PredictionResult:
+    """
+    Отбирает найденные объекты и, если клиенту нужно изображение,
+    рисует рамки и кодирует его в JPEG.
+    Рамки возвращаются в координатах исходного изображения original_size,
+    даже если оно было декодировано в уменьшенном виде
+    """
+    params = params or PredictionParams()
+    h, w = img.shape[:2]
+    width, height = original_size or (w, h)
+
+    selected = select_for_params(detections, width, height, params, params.tiled)
+    if not selected.scores.size:
         raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Ошибка при обработке запроса: {str(e)}"
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Не удалось определить объекты на изображении"
+        )
+
+    found_detections: list[Detection] = to_detections(selected)
+    logger.info("Найдено объектов: %d", len(found_detections))
+    if params.output == "json":
+        return PredictionResult(
+            detections=found_detections, model_version=model_version
+        )
+
+    if width != w:
+        # Рисуем на уменьшенном изображении в его координатах
+        scale = np.array([w / width, h / height, w / width, h / height])
+        selected = selected._replace(
+            boxes=(selected.boxes * scale).astype(np.int32)
         )
+    with metrics.timer("render"):
+        image: bytes = render_image(
+            img,
+            selected,
+            quality=params.jpeg_quality or settings.predict_jpeg_quality,
+            max_dimension=params.max_dimension or settings.predict_max_dimension,
+        )
+    return PredictionResult(
+        detections=found_detections, image=image, model_version=model_version
+    )
+
+
+def processing_error(e: Exception) -> HTTPException:
+    """Преобразует непредвиденную ошибку обработки в ответ 500"""
+    logger.error("Ошибка при обработке запроса: %s", e)
+    return HTTPException(
+        status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+        detail=f"Ошибка при обработке запроса: {str(e)}"
+    )
@@ -1,5 +1,10 @@
-from pydantic import BaseModel
-from typing import List
+import base64
+from datetime import datetime
+
+from pydantic import BaseModel, Field, field_validator
+from typing import List, Literal
+
+from src.api_predictions.postprocess import VOC_LABELS
 
 
 class Detection(BaseModel):
@@ -11,4 +16,117 @@ class Detection(BaseModel):
 class PredictionResponse(BaseModel):
     """Модель ответа для предсказания изображения"""
     detections: List[Detection]
-    processed_image: bytes  # base64 encoded image
+    processed_image: str | None = None  # base64 encoded image
+    model_version: str | None = None  # версия модели, сделавшая предсказание
+
+
+class PredictionResult(BaseModel):
+    """Результат обработки изображения до формирования HTTP-ответа"""
+    detections: List[Detection]
+    image: bytes | None = None  # JPEG с нарисованными рамками
+    model_version: str | None = None
+
+    def as_response(self) -> PredictionResponse:
+        processed_image: str | None = (
+            base64.b64encode(self.image).decode("utf-8") if self.image else None
+        )
+        return PredictionResponse(
+            detections=self.detections,
+            processed_image=processed_image,
+            model_version=self.model_version,
+        )
+
+
+class DetectionParams(BaseModel):
+    """Параметры отбора объектов, передаются в строке запроса"""
+    confidence: float = Field(
+        default=0.6, ge=0, le=1, description="Минимальная уверенность"
+    )
+    classes: List[str] | None = Field(
+        default=None, description="Оставить только эти классы VOC"
+    )
+    max_detections: int | None = Field(
+        default=None, ge=1, description="Максимум объектов в ответе"
+    )
+    nms_threshold: float | None = Field(
+        default=None, gt=0, le=1, description="Порог IoU для NMS (без NMS, если пусто)"
+    )
+
+    @field_validator("classes")
+    @classmethod
+    def check_classes(cls, value: List[str] | None) -> List[str] | None:
+        if value is None:
+            return value
+        unknown: list[str] = [name for name in value if name not in VOC_LABELS[1:]]
+        if unknown:
+            raise ValueError(f"Неизвестные классы: {', '.join(unknown)}")
+        return value
+
+
+class PredictionParams(DetectionParams):
+    """Параметры предсказания для изображения и формат ответа"""
+    output: Literal["base64", "json", "jpeg"] = Field(
+        default="base64",
+        description=(
+            "base64 - JSON с изображением в base64, json - только объекты, "
+            "jpeg - изображение image/jpeg, объекты в заголовке X-Detections"
+        ),
+    )
+    jpeg_quality: int | None = Field(
+        default=None, ge=1, le=100, description="Качество JPEG"
+    )
+    max_dimension: int | None = Field(
+        default=None, ge=16, description="Максимальная сторона возвращаемого изображения"
+    )
+    tiled: bool = Field(
+        default=False,
+        description="Искать объекты по перекрывающимся фрагментам крупного изображения",
+    )
+
+
+class VideoParams(DetectionParams):
+    """Параметры обработки видео"""
+    frame_stride: int | None = Field(
+        default=None, ge=1, description="Обрабатывать каждый N-й кадр"
+    )
+    target_fps: float | None = Field(
+        default=None, gt=0, description="Желаемая частота обрабатываемых кадров"
+    )
+    max_frames: int | None = Field(
+        default=None, ge=1, description="Максимум обрабатываемых кадров"
+    )
+    format: Literal["ndjson", "sse"] = Field(
+        default="ndjson", description="Формат потока результатов"
+    )
+
+
+class FrameDetections(BaseModel):
+    """Объекты, найденные на кадре видео"""
+    frame: int
+    timestamp_ms: float
+    detections: List[Detection]
+    model_version: str | None = None
+
+
+class JobAddDB(BaseModel):
+    """Новая задача предсказания для записи в базу"""
+    id: str
+    user_id: int | None
+    status: str
+    filename: str | None
+    params: str  # PredictionParams в JSON
+    created_at: datetime
+    owner: str | None = None  # процесс, в очереди которого задача
+    heartbeat_at: datetime | None = None
+
+
+class JobInfo(BaseModel):
+    """Состояние асинхронной задачи предсказания"""
+    id: str
+    status: Literal["queued", "running", "done", "failed"]
+    created_at: datetime
+    started_at: datetime | None = None
+    finished_at: datetime | None = None
+    result: PredictionResponse | None = None
+    status_code: int | None = None
+    error: str | None = None
@@ -0,0 +1,295 @@
+import asyncio
+import zipfile
+import zlib
+from functools import partial
+from logging import Logger, getLogger
+from time import perf_counter
+from typing import AsyncIterator, Awaitable, Callable, Iterable, Iterator, NamedTuple
+
+import orjson
+from fastapi import HTTPException, UploadFile, status
+
+from src.api_predictions.batching import MicroBatcher
+from src.api_predictions.cache import prediction_cache
+from src.api_predictions.history import history_writer
+from src.api_predictions.inference_pool import inference_pool
+from src.api_predictions.predictions_img import (
+    DecodedImage,
+    ModelFiles,
+    ModelOutput,
+    backend_for_version,
+    build_prediction,
+    decode_target_side,
+    decode_upload,
+    detect_objects,
+    detect_tiled,
+    model_files,
+    model_registry,
+    processing_error,
+)
+from src.api_predictions.schemas import PredictionParams, PredictionResult
+from src.api_predictions.uploads import (
+    check_image_content,
+    read_image_upload,
+    too_large,
+)
+from src.core.config import settings
+from src.core.metrics import metrics
+
+logger: Logger = getLogger(__name__)
+
+ZIP_CONTENT_TYPES = {"application/zip", "application/x-zip-compressed"}
+# Повреждённый, зашифрованный или сжатый неподдерживаемым методом файл архива
+ZIP_ENTRY_ERRORS = (
+    zipfile.BadZipFile,
+    zlib.error,
+    EOFError,
+    RuntimeError,
+    NotImplementedError,
+    OSError,
+)
+
+# Одновременные запросы объединяются в пакеты для одного forward
+micro_batcher = MicroBatcher(
+    forward=detect_objects,
+    execute=inference_pool.execute,
+    max_batch_size=settings.predict_batch_max_size,
+    max_wait_ms=settings.predict_batch_wait_ms,
+)
+
+# Фоновая загрузка новой версии модели
+_reload_task: asyncio.Task | None = None
+
+
+def start_model_reload(version: str) -> None:
+    """
+    Запускает в фоне загрузку и прогрев версии модели с последующим
+    переключением на неё. Запросы продолжают обслуживаться текущей версией
+    """
+    global _reload_task
+    if _reload_task is not None and not _reload_task.done():
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Уже загружается версия {model_registry.reloading}",
+        )
+    try:
+        files: ModelFiles = model_files(version)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    required = (
+        [files.onnx_model_path]
+        if settings.predict_backend == "onnxruntime"
+        else [files.config_path, files.model_path]
+    )
+    if not all(path.is_file() for path in required):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Не найдены файлы модели версии {version}",
+        )
+
+    # Сеть нужна каждому потоку пула инференса
+    _reload_task = asyncio.ensure_future(
+        asyncio.to_thread(
+            model_registry.reload,
+            backend_for_version(version),
+            version,
+            settings.predict_workers,
+        )
+    )
+    _reload_task.add_done_callback(_log_reload_result)
+
+
+def _log_reload_result(task: asyncio.Task) -> None:
+    if not task.cancelled() and (error := task.exception()) is not None:
+        logger.error("Не удалось загрузить новую версию модели: %s", error)
+
+
+async def run_prediction(
+    file_content: bytes, params: PredictionParams
+) -> PredictionResult:
+    """
+    Выполняет предсказание без кеша:
+    декодирование и отрисовка выполняются в пуле, forward - пакетами
+    """
+    async with inference_pool.slot():
+        try:
+            decoded: DecodedImage = await inference_pool.execute(
+                decode_upload, file_content, decode_target_side(params)
+            )
+            if params.tiled:
+                # Фрагменты уже составляют пакет для одного forward
+                output: ModelOutput = await inference_pool.execute(
+                    detect_tiled, decoded.image
+                )
+            else:
+                output = await micro_batcher.detect(decoded.image)
+            result = await inference_pool.execute(
+                build_prediction,
+                decoded.image,
+                output.detections,
+                params,
+                (decoded.width, decoded.height),
+                output.model_version,
+            )
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise processing_error(e)
+    return result
+
+
+async def predict_image(
+    file_content: bytes,
+    filename: str,
+    params: PredictionParams | None = None,
+    user_id: int | None = None,
+) -> PredictionResult:
+    """
+    Асинхронно обрабатывает предсказание для изображения.
+    Повторные загрузки тех же байтов с теми же параметрами берутся из кеша,
+    пока не сменилась версия модели.
+    Найденные объекты попадают в историю пользователя в фоне
+    """
+    params = params or PredictionParams()
+    start: float = perf_counter()
+    cold: bool = not model_registry.is_warm
+    logger.info("Запросил предсказание для файла %s", filename)
+    key: str = await prediction_cache.make_key(
+        file_content, params, model_registry.version
+    )
+    result: PredictionResult = await prediction_cache.get_or_compute(
+        key, lambda: run_prediction(file_content, params)
+    )
+
+    # Холодные запросы учитываем отдельно, чтобы не искажать обычную задержку
+    metrics.observe("predict_cold" if cold else "predict", perf_counter() - start)
+    history_writer.record(user_id, filename, result)
+    return result
+
+
+class BatchSource(NamedTuple):
+    """Изображение пакета: имя и функция, читающая его байты по требованию"""
+
+    filename: str
+    read: Callable[[], Awaitable[bytes]]
+
+
+def is_zip_upload(upload: UploadFile) -> bool:
+    return upload.content_type in ZIP_CONTENT_TYPES or (
+        upload.filename or ""
+    ).lower().endswith(".zip")
+
+
+def read_zip_member(archive: zipfile.ZipFile, info: zipfile.ZipInfo, limit: int) -> bytes:
+    with archive.open(info) as member:
+        return member.read(limit)
+
+
+async def read_zip_entry(
+    archive: zipfile.ZipFile, info: zipfile.ZipInfo, max_bytes: int
+) -> bytes:
+    # Размер из каталога архива проверяем до распаковки
+    if info.file_size > max_bytes:
+        raise too_large(max_bytes)
+    # Размер в каталоге можно подделать, поэтому распаковка тоже ограничена
+    data: bytes = await asyncio.to_thread(read_zip_member, archive, info, max_bytes + 1)
+    check_image_content(data, max_bytes)
+    return data
+
+
+def batch_sources(
+    uploads: Iterable[UploadFile], max_bytes: int
+) -> list[BatchSource]:
+    """
+    Перечисляет изображения пакета, не читая их содержимое:
+    обычные файлы берутся как есть, из zip-архивов - каждый файл отдельно
+    """
+    sources: list[BatchSource] = []
+    for upload in uploads:
+        if not is_zip_upload(upload):
+            sources.append(
+                BatchSource(
+                    upload.filename or "", partial(read_image_upload, upload, max_bytes)
+                )
+            )
+            continue
+        try:
+            archive = zipfile.ZipFile(upload.file)
+        except zipfile.BadZipFile:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Повреждённый zip-архив {upload.filename}",
+            )
+        sources.extend(
+            BatchSource(
+                info.filename, partial(read_zip_entry, archive, info, max_bytes)
+            )
+            for info in archive.infolist()
+            if not info.is_dir()
+        )
+    return sources
+
+
+async def predict_batch_item(
+    index: int, source: BatchSource, params: PredictionParams, user_id: int | None
+) -> dict:
+    try:
+        try:
+            file_content: bytes = await source.read()
+        except ZIP_ENTRY_ERRORS as e:
+            # Ошибка одного файла архива не прерывает ответ по остальным
+            logger.error("Не удалось прочитать %s: %s", source.filename, e)
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Не удалось прочитать файл",
+            )
+        result: PredictionResult = await predict_image(
+            file_content, source.filename, params, user_id
+        )
+    except HTTPException as e:
+        return {
+            "index": index,
+            "filename": source.filename,
+            "status_code": e.status_code,
+            "error": e.detail,
+        }
+    return {
+        "index": index,
+        "filename": source.filename,
+        "status_code": 200,
+        **result.as_response().model_dump(exclude_none=True),
+    }
+
+
+async def stream_batch_predictions(
+    sources: list[BatchSource],
+    params: PredictionParams,
+    concurrency: int,
+    user_id: int | None = None,
+) -> AsyncIterator[bytes]:
+    """
+    Обрабатывает изображения пакета, держа в работе не более concurrency штук,
+    и отдаёт каждый результат строкой NDJSON сразу по готовности
+    """
+    source_iter: Iterator[tuple[int, BatchSource]] = enumerate(sources)
+    pending: set[asyncio.Task] = set()
+
+    def start_next() -> None:
+        try:
+            index, source = next(source_iter)
+        except StopIteration:
+            return
+        pending.add(asyncio.ensure_future(predict_batch_item(index, source, params, user_id)))
+
+    try:
+        for _ in range(max(1, concurrency)):
+            start_next()
+        while pending:
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                pending.discard(task)
+                yield orjson.dumps(task.result()) + b"\n"
+                start_next()
+    finally:
+        for task in pending:
+            task.cancel()
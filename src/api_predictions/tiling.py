@@ -0,0 +1,68 @@
+from typing import NamedTuple
+
+import numpy as np
+
+
+class Tile(NamedTuple):
+    """Фрагмент изображения в пикселях исходного изображения"""
+
+    x: int
+    y: int
+    width: int
+    height: int
+
+
+def _positions(length: int, size: int, step: int) -> list[int]:
+    if length <= size:
+        return [0]
+    # Последний фрагмент прижат к краю, чтобы покрыть изображение целиком
+    return list(range(0, length - size, step)) + [length - size]
+
+
+def plan_tiles(
+    width: int, height: int, tile_size: int, overlap: float, max_tiles: int
+) -> list[Tile]:
+    """
+    Разбивает изображение на квадратные фрагменты со стороной tile_size,
+    перекрывающиеся на долю overlap. Если фрагментов получается больше
+    max_tiles, их сторона увеличивается, поэтому стоимость запроса ограничена.
+    Изображение, которое помещается в один фрагмент, не разбивается
+    """
+    if max(width, height) <= tile_size or max_tiles < 2:
+        return []
+    size: int = tile_size
+    while True:
+        step: int = max(1, int(size * (1 - overlap)))
+        xs: list[int] = _positions(width, size, step)
+        ys: list[int] = _positions(height, size, step)
+        if len(xs) * len(ys) <= max_tiles:
+            break
+        size = int(size * 1.25) + 1
+    return [
+        Tile(x, y, min(size, width), min(size, height)) for y in ys for x in xs
+    ]
+
+
+def crop_tiles(img: np.ndarray, tiles: list[Tile]) -> list[np.ndarray]:
+    """Фрагменты как представления исходного массива, без копирования"""
+    return [img[t.y : t.y + t.height, t.x : t.x + t.width] for t in tiles]
+
+
+def merge_tile_detections(
+    outputs: list[np.ndarray], tiles: list[Tile], width: int, height: int
+) -> np.ndarray:
+    """
+    Переводит рамки из координат фрагментов (доли стороны фрагмента)
+    в доли сторон всего изображения и объединяет выходы в один 1x1xNx7.
+    Дубликаты на перекрытиях убирает последующий NMS
+    """
+    merged: list[np.ndarray] = []
+    for detections, tile in zip(outputs, tiles):
+        rows: np.ndarray = detections.reshape(-1, 7).copy()
+        rows[:, 0] = 0
+        rows[:, [3, 5]] = (tile.x + rows[:, [3, 5]] * tile.width) / width
+        rows[:, [4, 6]] = (tile.y + rows[:, [4, 6]] * tile.height) / height
+        merged.append(rows)
+    if not merged:
+        return np.zeros((1, 1, 0, 7), dtype=np.float32)
+    return np.concatenate(merged)[np.newaxis, np.newaxis]
@@ -0,0 +1,168 @@
+import struct
+from logging import Logger, getLogger
+from typing import NamedTuple
+
+import cv2
+from fastapi import HTTPException, UploadFile, status
+
+from src.core.metrics import metrics
+
+logger: Logger = getLogger(__name__)
+
+# Размер блока при чтении загрузки
+READ_CHUNK_SIZE = 64 * 1024
+
+# Типы, которые принимаем от клиентов; octet-stream проверяется по сигнатуре
+IMAGE_CONTENT_TYPES = {
+    "image/jpeg",
+    "image/jpg",
+    "image/png",
+    "image/webp",
+    "image/bmp",
+    "image/x-ms-bmp",
+    "image/tiff",
+    "application/octet-stream",
+}
+
+# Флаги уменьшенного декодирования и соответствующий коэффициент
+REDUCED_DECODE_FLAGS: tuple[tuple[int, int], ...] = (
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+)
+
+# Маркеры JPEG SOF, содержащие размеры кадра
+JPEG_SOF_MARKERS = {
+    0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF
+}
+
+
+class ImageHeader(NamedTuple):
+    format: str
+    width: int | None = None
+    height: int | None = None
+
+
+def sniff_image_format(data: bytes) -> str | None:
+    """Определяет формат изображения по первым байтам"""
+    if data.startswith(b"\xff\xd8\xff"):
+        return "jpeg"
+    if data.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "png"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "webp"
+    if data.startswith(b"BM"):
+        return "bmp"
+    if data[:4] in (b"II*\x00", b"MM\x00*"):
+        return "tiff"
+    return None
+
+
+def _jpeg_size(data: bytes) -> tuple[int, int] | None:
+    offset: int = 2
+    while offset + 9 <= len(data):
+        if data[offset] != 0xFF:
+            return None
+        marker: int = data[offset + 1]
+        if marker == 0xFF:
+            offset += 1
+            continue
+        if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:
+            offset += 2
+            continue
+        (length,) = struct.unpack(">H", data[offset + 2 : offset + 4])
+        if marker in JPEG_SOF_MARKERS:
+            height, width = struct.unpack(">HH", data[offset + 5 : offset + 9])
+            return width, height
+        offset += 2 + length
+    return None
+
+
+def read_image_header(data: bytes) -> ImageHeader | None:
+    """Определяет формат и, если возможно, размеры изображения без декодирования"""
+    image_format: str | None = sniff_image_format(data)
+    if image_format is None:
+        return None
+    size: tuple[int, int] | None = None
+    try:
+        if image_format == "jpeg":
+            size = _jpeg_size(data)
+        elif image_format == "png" and len(data) >= 24:
+            size = struct.unpack(">II", data[16:24])
+        elif image_format == "bmp" and len(data) >= 26:
+            width, height = struct.unpack("<ii", data[18:26])
+            size = (width, abs(height))
+    except struct.error:
+        size = None
+    if size is None:
+        return ImageHeader(image_format)
+    return ImageHeader(image_format, *size)
+
+
+def reduced_decode_flag(header: ImageHeader | None, target_side: int) -> tuple[int, int]:
+    """
+    Выбирает самый сильный уровень уменьшения при декодировании,
+    при котором большая сторона изображения остаётся не меньше target_side.
+    Возвращает флаг imdecode и коэффициент уменьшения
+    """
+    if header is None or not header.width or not header.height:
+        return cv2.IMREAD_COLOR, 1
+    longest: int = max(header.width, header.height)
+    for factor, flag in REDUCED_DECODE_FLAGS:
+        if longest // factor >= target_side:
+            return flag, factor
+    return cv2.IMREAD_COLOR, 1
+
+
+def unsupported_media_type() -> HTTPException:
+    metrics.inc("upload_rejected_type")
+    return HTTPException(
+        status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+        detail="Поддерживаются изображения JPEG, PNG, WebP, BMP и TIFF",
+    )
+
+
+def too_large(max_bytes: int) -> HTTPException:
+    metrics.inc("upload_rejected_size")
+    return HTTPException(
+        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        detail=f"Размер файла превышает {max_bytes} байт",
+    )
+
+
+def check_image_content(data: bytes, max_bytes: int) -> None:
+    """Проверка уже прочитанных байтов, например файла из архива"""
+    if len(data) > max_bytes:
+        raise too_large(max_bytes)
+    if sniff_image_format(data[:16]) is None:
+        raise unsupported_media_type()
+
+
+async def read_image_upload(upload: UploadFile, max_bytes: int) -> bytes:
+    """
+    Читает загруженное изображение блоками.
+    Отклоняет файл по заявленному типу и размеру ещё до чтения,
+    по сигнатуре - после первого блока, по фактическому размеру - как только
+    он превышен, не дочитывая остаток
+    """
+    content_type: str = (upload.content_type or "").split(";")[0].strip().lower()
+    if content_type and content_type not in IMAGE_CONTENT_TYPES:
+        raise unsupported_media_type()
+    if upload.size is not None and upload.size > max_bytes:
+        raise too_large(max_bytes)
+
+    first: bytes = await upload.read(READ_CHUNK_SIZE)
+    if sniff_image_format(first) is None:
+        raise unsupported_media_type()
+
+    chunks: list[bytes] = [first]
+    total: int = len(first)
+    # Размер может быть неизвестен заранее, а лимит - меньше первого блока
+    if total > max_bytes:
+        raise too_large(max_bytes)
+    while chunk := await upload.read(READ_CHUNK_SIZE):
+        total += len(chunk)
+        if total > max_bytes:
+            raise too_large(max_bytes)
+        chunks.append(chunk)
+    return b"".join(chunks)
@@ -0,0 +1,203 @@
+import asyncio
+import os
+import tempfile
+from logging import Logger, getLogger
+from pathlib import Path
+from typing import IO, AsyncIterator, NamedTuple
+
+import cv2
+import numpy as np
+import orjson
+from fastapi import HTTPException, status
+
+from src.api_predictions.inference_pool import inference_pool
+from src.api_predictions.predictions_img import (
+    ModelOutput,
+    detect_objects,
+    select_for_params,
+    to_detections,
+)
+from src.api_predictions.schemas import FrameDetections, VideoParams
+from src.api_predictions.uploads import too_large
+from src.core.config import settings
+from src.core.metrics import metrics
+
+logger: Logger = getLogger(__name__)
+
+# Размер блока при копировании загрузки во временный файл
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+class FrameSampler(NamedTuple):
+    """Какие кадры обрабатывать: каждый stride-й, не больше max_frames"""
+
+    stride: int
+    fps: float
+    max_frames: int | None
+
+
+def spool_to_file(upload: IO[bytes], suffix: str, max_bytes: int) -> Path:
+    """
+    Копирует загрузку блоками во временный файл на диске:
+    VideoCapture умеет читать только из файла или потока по адресу.
+    Копирование прерывается, как только превышен max_bytes
+    """
+    upload.seek(0)
+    with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as target:
+        path = Path(target.name)
+        copied: int = 0
+        while chunk := upload.read(COPY_CHUNK_SIZE):
+            copied += len(chunk)
+            if copied > max_bytes:
+                break
+            target.write(chunk)
+    if copied > max_bytes:
+        remove_file(path)
+        raise too_large(max_bytes)
+    return path
+
+
+def open_capture(path: Path) -> cv2.VideoCapture:
+    capture = cv2.VideoCapture(str(path))
+    if not capture.isOpened():
+        capture.release()
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Не удалось открыть видео",
+        )
+    return capture
+
+
+def make_sampler(capture: cv2.VideoCapture, params: VideoParams) -> FrameSampler:
+    fps: float = capture.get(cv2.CAP_PROP_FPS) or 0.0
+    stride: int = params.frame_stride or 1
+    if params.frame_stride is None and params.target_fps and fps > params.target_fps:
+        stride = max(1, round(fps / params.target_fps))
+    return FrameSampler(stride=stride, fps=fps, max_frames=params.max_frames)
+
+
+def read_sampled_frames(
+    capture: cv2.VideoCapture,
+    sampler: FrameSampler,
+    next_index: int,
+    count: int,
+) -> tuple[list[tuple[int, np.ndarray]], int, bool]:
+    """
+    Читает до count отобранных кадров, начиная с кадра next_index.
+    Пропускаемые кадры только захватываются (grab) без декодирования.
+    Возвращает кадры с номерами, номер следующего кадра и признак конца видео
+    """
+    frames: list[tuple[int, np.ndarray]] = []
+    index: int = next_index
+    while len(frames) < count:
+        if not capture.grab():
+            return frames, index, True
+        if index % sampler.stride == 0:
+            ok, frame = capture.retrieve()
+            if ok:
+                frames.append((index, frame))
+        index += 1
+    return frames, index, False
+
+
+def detect_frames(
+    frames: list[tuple[int, np.ndarray]], sampler: FrameSampler, params: VideoParams
+) -> list[FrameDetections]:
+    """Прогоняет кадры через сеть одним пакетом и отбирает объекты на каждом"""
+    if not frames:
+        return []
+    outputs: list[ModelOutput] = detect_objects([frame for _, frame in frames])
+    results: list[FrameDetections] = []
+    for (index, frame), output in zip(frames, outputs):
+        h, w = frame.shape[:2]
+        selected = select_for_params(output.detections, w, h, params)
+        results.append(
+            FrameDetections(
+                frame=index,
+                timestamp_ms=index * 1000 / sampler.fps if sampler.fps else 0.0,
+                detections=to_detections(selected),
+                model_version=output.model_version,
+            )
+        )
+    return results
+
+
+def process_next_frames(
+    capture: cv2.VideoCapture,
+    sampler: FrameSampler,
+    params: VideoParams,
+    next_index: int,
+    count: int,
+) -> tuple[list[FrameDetections], int, bool]:
+    frames, next_index, finished = read_sampled_frames(
+        capture, sampler, next_index, count
+    )
+    return detect_frames(frames, sampler, params), next_index, finished
+
+
+def encode_event(event: str, data: dict, fmt: str) -> bytes:
+    payload: bytes = orjson.dumps(data)
+    if fmt == "sse":
+        return b"event: " + event.encode() + b"\ndata: " + payload + b"\n\n"
+    return payload + b"\n"
+
+
+async def stream_video_predictions(
+    capture: cv2.VideoCapture, path: Path, params: VideoParams
+) -> AsyncIterator[bytes]:
+    """
+    Читает видео по частям и отдаёт объекты по кадрам по мере обработки.
+    В памяти одновременно находится не больше одного пакета кадров,
+    поток занимает одно место в очереди инференса.
+    Ошибки после начала ответа передаются отдельным событием
+    """
+    batch_size: int = max(1, settings.predict_batch_max_size)
+    # Чтение кадров в пуле, которое нужно дождаться до освобождения capture
+    in_flight: asyncio.Future | None = None
+    try:
+        async with inference_pool.slot():
+            sampler: FrameSampler = make_sampler(capture, params)
+            next_index: int = 0
+            processed: int = 0
+            finished: bool = False
+            while not finished:
+                count: int = batch_size
+                if sampler.max_frames is not None:
+                    count = min(count, sampler.max_frames - processed)
+                    if count <= 0:
+                        break
+                in_flight = asyncio.ensure_future(
+                    inference_pool.execute(
+                        process_next_frames, capture, sampler, params, next_index, count
+                    )
+                )
+                # При отключении клиента отменяется ожидание, а не чтение в потоке
+                results, next_index, finished = await asyncio.shield(in_flight)
+                processed += len(results)
+                metrics.inc("video_frames", len(results))
+                for result in results:
+                    yield encode_event("frame", result.model_dump(), params.format)
+        if params.format == "sse":
+            yield encode_event("end", {"frames": processed}, params.format)
+    except HTTPException as e:
+        yield encode_event(
+            "error", {"status_code": e.status_code, "error": e.detail}, params.format
+        )
+    finally:
+        # VideoCapture не потокобезопасен: освобождаем его и удаляем файл
+        # только после того, как поток пула закончил с ним работать
+        if in_flight is not None:
+            await asyncio.wait([in_flight])
+        await asyncio.to_thread(close_capture, capture, path)
+
+
+def close_capture(capture: cv2.VideoCapture, path: Path) -> None:
+    capture.release()
+    remove_file(path)
+
+
+def remove_file(path: Path) -> None:
+    try:
+        os.remove(path)
+    except OSError as e:
+        logger.error("Не удалось удалить временный файл %s: %s", path, e)
@@ -1,20 +1,269 @@
-from fastapi import APIRouter, UploadFile, File, Depends, status
+import asyncio
+from pathlib import Path
+from typing import Annotated
 
-from src.api_predictions.schemas import PredictionResponse
-from src.auth.dependencies import get_current_token_payload
+import orjson
+from fastapi import (
+    APIRouter,
+    Depends,
+    File,
+    HTTPException,
+    Query,
+    Request,
+    Response,
+    UploadFile,
+    status,
+)
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.background import BackgroundTask
+from starlette.datastructures import FormData, UploadFile as StarletteUploadFile
+
+from src.api_predictions.jobs import job_scheduler
+from src.api_predictions.schemas import (
+    JobInfo,
+    PredictionParams,
+    PredictionResponse,
+    PredictionResult,
+    VideoParams,
+)
+from src.auth.dependencies import get_current_admin_user, get_current_token_payload
 
-from src.api_predictions.predictions_img import process_image_prediction
+from src.api_predictions.service import (
+    BatchSource,
+    batch_sources,
+    predict_image,
+    start_model_reload,
+    stream_batch_predictions,
+)
+from src.api_predictions.predictions_img import model_registry
+from src.api_predictions.inference_pool import inference_pool
+from src.api_predictions.uploads import read_image_upload, too_large
+from src.api_predictions.video import (
+    open_capture,
+    remove_file,
+    spool_to_file,
+    stream_video_predictions,
+)
+from src.core.config import settings
+from src.core.db_helper import db_helper
 
 router = APIRouter(prefix="/predictions", tags=["predictions"])
 
+# Тело пакетного запроса разбирается вручную, поэтому описываем его для OpenAPI
+BATCH_REQUEST_BODY: dict = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "required": ["files"],
+                    "properties": {
+                        "files": {
+                            "type": "array",
+                            "items": {"type": "string", "format": "binary"},
+                            "description": "Изображения или zip-архивы с изображениями",
+                        }
+                    },
+                }
+            }
+        },
+    }
+}
+
+
+def prediction_http_response(
+    result: PredictionResult, params: PredictionParams
+) -> PredictionResponse | Response:
+    """Формирует ответ в запрошенном клиентом формате"""
+    if params.output == "jpeg":
+        detections: bytes = orjson.dumps(
+            [detection.model_dump() for detection in result.detections]
+        )
+        headers: dict[str, str] = {"X-Detections": detections.decode()}
+        if result.model_version:
+            headers["X-Model-Version"] = result.model_version
+        return Response(content=result.image, media_type="image/jpeg", headers=headers)
+    return result.as_response()
+
 
 @router.post(
-    "/predict/", response_model=PredictionResponse, status_code=status.HTTP_200_OK
+    "/predict/",
+    response_model=PredictionResponse,
+    response_model_exclude_none=True,
+    status_code=status.HTTP_200_OK,
+    responses={200: {"content": {"image/jpeg": {}}}},
 )
 async def predict_endpoint(
+    params: Annotated[PredictionParams, Query()],
     file: UploadFile = File(...),
     payload: dict = Depends(get_current_token_payload),
-) -> PredictionResponse:
-    file_content: bytes = await file.read()
+) -> PredictionResponse | Response:
+    file_content: bytes = await read_image_upload(
+        file, settings.predict_max_upload_bytes
+    )
     fail_name: str = file.filename
-    return process_image_prediction(file_content, fail_name)
+    # Инференс выполняется в пуле потоков, не блокируя цикл событий
+    result: PredictionResult = await predict_image(
+        file_content, fail_name, params, int(payload.get("sub"))
+    )
+    return prediction_http_response(result, params)
+
+
+@router.post(
+    "/predict_batch/",
+    response_class=StreamingResponse,
+    openapi_extra=BATCH_REQUEST_BODY,
+    responses={200: {"content": {"application/x-ndjson": {}}}},
+)
+async def predict_batch_endpoint(
+    request: Request,
+    params: Annotated[PredictionParams, Query()],
+    payload: dict = Depends(get_current_token_payload),
+) -> StreamingResponse:
+    """
+    Пакетное предсказание: принимает много файлов или zip-архив
+    и возвращает результат каждого изображения строкой NDJSON по готовности
+    """
+    if params.output == "jpeg":
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Формат jpeg не поддерживается для пакетной обработки",
+        )
+    # Форму закрываем сами после отправки ответа: загруженные файлы
+    # читаются по мере обработки, пока ответ уже передаётся клиенту
+    form: FormData = await request.form(max_files=settings.predict_batch_max_files)
+    try:
+        uploads: list[StarletteUploadFile] = [
+            item for item in form.getlist("files") if isinstance(item, StarletteUploadFile)
+        ]
+        if not uploads:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST, detail="Не переданы файлы"
+            )
+        sources: list[BatchSource] = batch_sources(
+            uploads, settings.predict_max_upload_bytes
+        )
+    except Exception:
+        await form.close()
+        raise
+
+    return StreamingResponse(
+        stream_batch_predictions(
+            sources,
+            params,
+            settings.predict_batch_concurrency,
+            int(payload.get("sub")),
+        ),
+        media_type="application/x-ndjson",
+        background=BackgroundTask(form.close),
+    )
+
+
+@router.post(
+    "/jobs/",
+    response_model=JobInfo,
+    response_model_exclude_none=True,
+    status_code=status.HTTP_202_ACCEPTED,
+)
+async def create_job_endpoint(
+    params: Annotated[PredictionParams, Query()],
+    file: UploadFile = File(...),
+    payload: dict = Depends(get_current_token_payload),
+) -> JobInfo:
+    """
+    Ставит предсказание в очередь и сразу возвращает идентификатор задачи,
+    результат забирается через GET /predictions/jobs/{job_id}
+    """
+    if params.output == "jpeg":
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Формат jpeg не поддерживается для задач",
+        )
+    file_content: bytes = await read_image_upload(
+        file, settings.predict_max_upload_bytes
+    )
+    return await job_scheduler.submit(
+        file_content, file.filename or "", params, int(payload.get("sub"))
+    )
+
+
+@router.get(
+    "/jobs/{job_id}",
+    response_model=JobInfo,
+    response_model_exclude_none=True,
+)
+async def get_job_endpoint(
+    job_id: str,
+    payload: dict = Depends(get_current_token_payload),
+) -> JobInfo:
+    """Состояние задачи и, когда она выполнена, результат предсказания"""
+    job: JobInfo | None = await job_scheduler.get(job_id, int(payload.get("sub")))
+    if job is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Задача не найдена"
+        )
+    return job
+
+
+@router.post(
+    "/predict_video/",
+    response_class=StreamingResponse,
+    responses={
+        200: {"content": {"application/x-ndjson": {}, "text/event-stream": {}}}
+    },
+)
+async def predict_video_endpoint(
+    params: Annotated[VideoParams, Query()],
+    file: UploadFile = File(...),
+    payload: dict = Depends(get_current_token_payload),
+) -> StreamingResponse:
+    """
+    Поиск объектов на кадрах видео или MJPEG-потока:
+    результаты по кадрам передаются в формате NDJSON или SSE по мере обработки
+    """
+    if file.size is not None and file.size > settings.predict_max_video_bytes:
+        raise too_large(settings.predict_max_video_bytes)
+    # Загрузка закрывается до начала ответа, поэтому переносим её в свой файл
+    path: Path = await asyncio.to_thread(
+        spool_to_file,
+        file.file,
+        Path(file.filename or "").suffix,
+        settings.predict_max_video_bytes,
+    )
+    try:
+        capture = await inference_pool.run(open_capture, path)
+    except Exception:
+        await asyncio.to_thread(remove_file, path)
+        raise
+
+    media_type: str = (
+        "text/event-stream" if params.format == "sse" else "application/x-ndjson"
+    )
+    return StreamingResponse(
+        stream_video_predictions(capture, path, params), media_type=media_type
+    )
+
+
+@router.get("/model/")
+async def model_status_endpoint(
+    payload: dict = Depends(get_current_token_payload),
+) -> dict:
+    """Активная версия модели и состояние загрузки"""
+    return model_registry.status()
+
+
+@router.post("/model/reload/", status_code=status.HTTP_202_ACCEPTED)
+async def model_reload_endpoint(
+    version: str = Query(..., description="Версия: каталог в predict_models_dir"),
+    session: AsyncSession = Depends(db_helper.get_session_without_commit),
+    payload: dict = Depends(get_current_token_payload),
+) -> dict:
+    """
+    Загружает новую версию модели в фоне и переключает на неё трафик
+    без остановки сервиса. Доступно только администратору
+    """
+    await get_current_admin_user(session=session, payload=payload)
+    start_model_reload(version)
+    return {"version": version, "state": "loading"}
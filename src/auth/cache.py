@@ -0,0 +1,168 @@
+from collections import OrderedDict
+from logging import Logger, getLogger
+from time import monotonic
+from typing import NamedTuple
+from uuid import uuid4
+
+from src.auth.schemas import UserBase
+from src.core.config import settings
+from src.core.metrics import metrics
+
+logger: Logger = getLogger(__name__)
+
+
+class ProfileEntry(NamedTuple):
+    profile: UserBase
+    expires_at: float
+
+
+class ProfileCache:
+    """
+    LRU-кеш профилей (имя и почта) по идентификатору пользователя
+    для /auth/user/me/. AuthDao.update сбрасывает запись при изменении,
+    время жизни ограничивает устаревание, если запись изменили в обход.
+    Используется только из цикла событий, поэтому блокировки не нужны
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float) -> None:
+        self.max_entries: int = max_entries
+        self.ttl_seconds: float = ttl_seconds
+        self._entries: OrderedDict[int, ProfileEntry] = OrderedDict()
+        self.hits: int = 0
+        self.misses: int = 0
+        self.invalidations: int = 0
+        metrics.register_collector("profile_cache", self.status)
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0 and self.ttl_seconds > 0
+
+    def get(self, user_id: int) -> UserBase | None:
+        entry: ProfileEntry | None = self._entries.get(user_id)
+        if entry is not None and entry.expires_at <= monotonic():
+            del self._entries[user_id]
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(user_id)
+        self.hits += 1
+        return entry.profile.model_copy()
+
+    def put(self, user_id: int, profile: UserBase) -> None:
+        if not self.enabled:
+            return
+        self._entries[user_id] = ProfileEntry(
+            profile.model_copy(), monotonic() + self.ttl_seconds
+        )
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, user_id: int) -> None:
+        if self._entries.pop(user_id, None) is not None:
+            self.invalidations += 1
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def status(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+        }
+
+
+class RoleEntry(NamedTuple):
+    role: str | None
+    version: int
+    expires_at: float
+
+
+class RoleCache:
+    """
+    Роли пользователей по идентификатору и версии таблицы ролей.
+    Изменение ролей (RolesDao.add/delete, смена roles_id пользователя)
+    увеличивает версию сразу и ещё раз после коммита, и все записи
+    прежней версии перестают действовать.
+    Роль из access-токена принимается, если в токене та же версия ролей
+    этого процесса, иначе роль берётся из кеша или базы.
+    Используется только из цикла событий, поэтому блокировки не нужны
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float) -> None:
+        self.max_entries: int = max_entries
+        self.ttl_seconds: float = ttl_seconds
+        self.version: int = 0
+        # Токены, выпущенные до запуска или другим процессом, проверяются по базе
+        self._epoch: str = uuid4().hex[:8]
+        self._entries: OrderedDict[int, RoleEntry] = OrderedDict()
+        self.hits: int = 0
+        self.misses: int = 0
+        self.claims: int = 0
+        metrics.register_collector("role_cache", self.status)
+
+    @property
+    def token_version(self) -> str:
+        """Версия ролей для поля rv access-токена"""
+        return f"{self._epoch}:{self.version}"
+
+    def from_claims(self, payload: dict) -> str | None:
+        """Роль из токена, если после его выпуска роли не менялись"""
+        role = payload.get("role")
+        if not isinstance(role, str) or payload.get("rv") != self.token_version:
+            return None
+        self.claims += 1
+        return role
+
+    def get(self, user_id: int) -> RoleEntry | None:
+        entry: RoleEntry | None = self._entries.get(user_id)
+        if entry is not None and (
+            entry.version != self.version or entry.expires_at <= monotonic()
+        ):
+            del self._entries[user_id]
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(user_id)
+        self.hits += 1
+        return entry
+
+    def put(self, user_id: int, role: str | None, version: int) -> None:
+        """version - версия на момент запроса к базе: устаревший ответ не сохраняется"""
+        if self.max_entries <= 0 or version != self.version:
+            return
+        self._entries[user_id] = RoleEntry(
+            role, version, monotonic() + self.ttl_seconds
+        )
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def bump(self) -> None:
+        """Роли изменились: записи и роли из выпущенных ранее токенов не принимаются"""
+        self.version += 1
+        self._entries.clear()
+
+    def status(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "version": self.version,
+            "hits": self.hits,
+            "misses": self.misses,
+            "claims": self.claims,
+        }
+
+
+profile_cache = ProfileCache(
+    max_entries=settings.profile_cache_max_entries,
+    ttl_seconds=settings.profile_cache_ttl_seconds,
+)
+role_cache = RoleCache(
+    max_entries=settings.role_cache_max_entries,
+    ttl_seconds=settings.role_cache_ttl_seconds,
+)
@@ -1,22 +1,36 @@
+from datetime import datetime
 from logging import Logger, getLogger
 import asyncio
-from typing import Any, Sequence
+from typing import Any, AsyncIterator, Sequence
 
 from fastapi import HTTPException
 
-from sqlalchemy import Table, text
+from sqlalchemy import DateTime, String, Table, text
 from sqlalchemy.engine.row import Row
-from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.sql.elements import TextClause
 
 
 from src.core.base_dao import BaseDao
-from src.core.models import user_table, roles_table
+from src.core.db_helper import after_commit
+from src.core.models import user_table, roles_table, revoked_tokens_table
+from src.auth.cache import profile_cache, role_cache
 from src.auth.schemas import UserAddDB, UserUpdateInfo
 from src.exceptions import valid_integer, valid_string
 
 logger: Logger = getLogger(__name__)
 
+
+def bump_roles(session: AsyncSession) -> None:
+    """
+    Сбрасывает кеш ролей сразу и ещё раз после коммита:
+    роль, прочитанная до коммита, иначе осталась бы в кеше с новой версией
+    """
+    role_cache.bump()
+    after_commit(session, role_cache.bump)
+
+
 class RolesDao(BaseDao):
     model: Table = roles_table
 
@@ -35,6 +49,7 @@ class RolesDao(BaseDao):
             raise HTTPException(
                 status_code=500, detail="При обработке вашего запроса произошла ошибка"
             )
+        bump_roles(self._session)
 
     async def delete(self, id_roles: int) -> None:
         valid_integer(id_roles)
@@ -45,6 +60,8 @@ class RolesDao(BaseDao):
             await self._session.execute(query)
         except SQLAlchemyError as e:
             logger.error("Ошибка %s", e)
+            return
+        bump_roles(self._session)
             
 
 class AuthDao(BaseDao):
@@ -86,6 +103,37 @@ class AuthDao(BaseDao):
                 status_code=500, detail="При обработке вашего запроса произошла ошибка"
             )
 
+    async def update_role(self, user_id: int, roles_id: int) -> None:
+        valid_integer(user_id)
+        valid_integer(roles_id)
+        logger.info("Будем менять роль пользователя %s на %s", user_id, roles_id)
+        try:
+            stmt: TextClause = text(
+                "UPDATE users SET roles_id = :roles_id WHERE id = :user_id"
+            )
+            stmt = stmt.bindparams(user_id=user_id, roles_id=roles_id)
+            await self._session.execute(stmt)
+        except SQLAlchemyError as e:
+            logger.error("Ошибка %s", e)
+            raise HTTPException(
+                status_code=500, detail="При обработке вашего запроса произошла ошибка"
+            )
+        bump_roles(self._session)
+
+    async def get_profile(self, user_id: int) -> Row[Any] | None:
+        """Только имя и почта, без хеша пароля"""
+        valid_integer(user_id)
+        try:
+            query: TextClause = text("SELECT name, email FROM users WHERE id = :id")
+            query = query.bindparams(id=user_id)
+            result = await self._session.execute(query)
+            return result.one_or_none()
+        except SQLAlchemyError as e:
+            logger.error("Ошибка %s при поиске профиля %s", e, user_id)
+            raise HTTPException(
+                status_code=500, detail="При обработке вашего запроса произошла ошибка"
+            )
+
     async def find_all(self) -> Sequence[Row[Any]] | None:
         try:
             query: TextClause = text(
@@ -94,11 +142,83 @@ class AuthDao(BaseDao):
             )
             result = await self._session.execute(query)
             res: Sequence[Row[Any]] = result.fetchall()
-            logger.info("Найдены записи %s", res)
+            logger.info("Найдено записей: %d", len(res))
             return res
         except SQLAlchemyError as e:
             logger.error("Ошибка %s", e)
 
+    # Столбцы списка пользователей для администратора по именам полей
+    page_columns: dict[str, str] = {
+        "id": "users.id",
+        "name": "users.name",
+        "email": "users.email",
+        "roles_name": "roles.name AS roles_name",
+    }
+
+    async def find_page(
+        self,
+        after_id: int | None,
+        limit: int,
+        role: str | None = None,
+        fields: Sequence[str] = ("id", "name", "email", "roles_name"),
+    ) -> Sequence[Row[Any]]:
+        """
+        Страница пользователей по возрастанию id начиная после after_id
+        (keyset по первичному ключу, без OFFSET). id выбирается всегда
+        """
+        valid_integer(limit)
+        columns: list[str] = ["users.id"] + [
+            self.page_columns[name] for name in fields if name != "id"
+        ]
+        params: dict = {"after_id": after_id or 0, "limit": limit}
+        role_filter: str = ""
+        if role is not None:
+            role_filter = "AND roles.name = :role"
+            params["role"] = role
+        try:
+            query: TextClause = text(
+                f"SELECT {', '.join(columns)} FROM users \
+                    JOIN roles ON roles.id = users.roles_id \
+                    WHERE users.id > :after_id {role_filter} \
+                    ORDER BY users.id LIMIT :limit"
+            )
+            result = await self._session.execute(query.bindparams(**params))
+            return result.fetchall()
+        except SQLAlchemyError as e:
+            logger.error("Ошибка %s", e)
+            raise HTTPException(
+                status_code=500, detail="При обработке вашего запроса произошла ошибка"
+            )
+
+    async def stream_all(
+        self, yield_per: int, role: str | None = None
+    ) -> AsyncIterator[Row[Any]]:
+        """
+        Все пользователи по возрастанию id без загрузки в память:
+        на asyncpg строки читаются серверным курсором по yield_per
+        """
+        params: dict = {}
+        role_filter: str = ""
+        if role is not None:
+            role_filter = "WHERE roles.name = :role"
+            params["role"] = role
+        query: TextClause = text(
+            f"SELECT users.id, users.name, users.email, roles.name AS roles_name \
+                FROM users JOIN roles ON roles.id = users.roles_id \
+                {role_filter} ORDER BY users.id"
+        )
+        try:
+            result = await self._session.stream(
+                query.bindparams(**params).execution_options(yield_per=yield_per)
+            )
+            async for partition in result.partitions():
+                for row in partition:
+                    yield row
+        except SQLAlchemyError as e:
+            # Заголовки ответа уже отправлены, остаётся прервать выгрузку
+            logger.error("Ошибка %s при выгрузке пользователей", e)
+            raise
+
     async def update(self, model: UserUpdateInfo) -> None:
         model_dict: dict = model.model_dump()
         logger.info("Будем обновлять записи %s", model_dict)
@@ -116,7 +236,74 @@ class AuthDao(BaseDao):
             raise HTTPException(
                 status_code=500, detail="При обработке вашего запроса произошла ошибка"
             )
-        await self._session.execute(stmt)
+        # сразу и ещё раз после коммита: между ними могли прочитать старый профиль
+        profile_cache.invalidate(model.user_id)
+        after_commit(self._session, lambda: profile_cache.invalidate(model.user_id))
+
+
+class RevokedTokensDao(BaseDao):
+    model: Table = revoked_tokens_table
+
+    async def add(
+        self,
+        jti: str,
+        user_id: int | None,
+        expires_at: datetime,
+        revoked_at: datetime,
+    ) -> bool:
+        """Возвращает False, если токен уже отозван (в том числе другим процессом)"""
+        valid_string(jti)
+        try:
+            stmt: TextClause = text(
+                f"INSERT INTO {self.model.name} (jti, user_id, expires_at, revoked_at) \
+                    VALUES (:jti, :user_id, :expires_at, :revoked_at)"
+            )
+            stmt = stmt.bindparams(
+                jti=jti, user_id=user_id, expires_at=expires_at, revoked_at=revoked_at
+            )
+            # Точка сохранения: после ошибки ключа транзакция запроса остаётся рабочей
+            async with self._session.begin_nested():
+                await self._session.execute(stmt)
+            return True
+        except IntegrityError:
+            return False
+        except SQLAlchemyError as e:
+            logger.error("Ошибка %s", e)
+            raise HTTPException(
+                status_code=500, detail="При обработке вашего запроса произошла ошибка"
+            )
+
+    async def find_active(self, now: datetime) -> Sequence[Row[Any]]:
+        """Отзывы токенов, срок действия которых ещё не истёк"""
+        try:
+            query = (
+                text(
+                    f"SELECT jti, expires_at FROM {self.model.name} \
+                        WHERE expires_at > :now"
+                )
+                .bindparams(now=now)
+                .columns(jti=String, expires_at=DateTime(timezone=True))
+            )
+            result = await self._session.execute(query)
+            return result.fetchall()
+        except SQLAlchemyError as e:
+            logger.error("Ошибка %s", e)
+            raise HTTPException(
+                status_code=500, detail="При обработке вашего запроса произошла ошибка"
+            )
+
+    async def delete_expired(self, now: datetime) -> int:
+        try:
+            stmt: TextClause = text(
+                f"DELETE FROM {self.model.name} WHERE expires_at <= :now"
+            )
+            result = await self._session.execute(stmt.bindparams(now=now))
+            return result.rowcount
+        except SQLAlchemyError as e:
+            logger.error("Ошибка %s", e)
+            raise HTTPException(
+                status_code=500, detail="При обработке вашего запроса произошла ошибка"
+            )
 
 
 if __name__ == "__main__":
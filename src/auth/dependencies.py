@@ -1,5 +1,7 @@
+from datetime import datetime, timezone
 from logging import Logger, getLogger
 from typing import Any
+from uuid import uuid4
 
 from sqlalchemy import Row
 from sqlalchemy.ext.asyncio import AsyncSession
@@ -7,14 +9,26 @@ from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from jwt import InvalidTokenError
 
-from src.auth.schemas import UserInfo, UserBase, UserInfoForAdmin, UserUpdateInfo
+from src.auth.schemas import (
+    ADMIN_USER_FIELDS,
+    UserInfo,
+    UserBase,
+    UserUpdateInfo,
+    UsersPage,
+    UsersPageParams,
+)
 from src.auth import utils
 from src.auth.dao import AuthDao
+from src.auth.cache import profile_cache, role_cache
+from src.auth.revocation import revocation_store
+from src.core.metrics import metrics
 
 logger: Logger = getLogger(__name__)
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login/")
 
+ADMIN_ROLE = "adminishe"
+
 
 def create_jwt(
     token_data: dict,
@@ -29,11 +43,12 @@ def create_jwt(
     )
 
 
-def create_access_token(user: UserInfo) -> str:
+def create_access_token(user: UserInfo, role_claims: dict | None = None) -> str:
     jwt_payload: dict = {
         "sub": str(user.id),
         "email": user.email,
     }
+    jwt_payload.update(role_claims or {})
 
     logger.info("Создание аксесс для %s", user.email)
     return create_jwt(
@@ -45,6 +60,7 @@ def create_access_token(user: UserInfo) -> str:
 def create_refresh_token(user: UserInfo) -> str:
     jwt_payload: dict = {
         "sub": str(user.id),
+        "jti": uuid4().hex,  # идентификатор для отзыва при ротации
     }
     logger.info("Создание рефреш для %s", user.email)
     return create_jwt(
@@ -79,9 +95,14 @@ async def get_user_by_token_sub(
     session: AsyncSession,
     payload: dict,
 ) -> UserBase:
+    user_id: int = int(payload.get("sub"))
+    if profile := profile_cache.get(user_id):
+        return profile
     dao = AuthDao(session)
-    if user := await dao.find_one_or_none_by_id(int(payload.get("sub"))):
-        return UserBase(email=user[2], name=user[1])
+    if user := await dao.get_profile(user_id):
+        profile = UserBase(email=user.email, name=user.name)
+        profile_cache.put(user_id, profile)
+        return profile
     raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
 
 
@@ -102,16 +123,36 @@ async def update_user(
     
     dao = AuthDao(session)
     logger.info("Обновляемые данные: %s", user)
-    await dao.update(model=user)
+    await dao.update(model=user)  # сбрасывает профиль в кеше
+
+
+async def get_user_role(session: AsyncSession, user_id: int) -> str | None:
+    if entry := role_cache.get(user_id):
+        return entry.role
+    version: int = role_cache.version
+    role: str | None = await AuthDao(session).get_roles_user(user_id)
+    role_cache.put(user_id, role, version)
+    return role
+
+
+async def get_role_claims(session: AsyncSession, user_id: int) -> dict:
+    """Роль для access-токена с версией ролей, при которой она прочитана"""
+    token_version: str = role_cache.token_version
+    role: str | None = await get_user_role(session, user_id)
+    if role is None:
+        return {}
+    return {"role": role, "rv": token_version}
 
 
 async def get_current_admin_user(
     session: AsyncSession,
     payload: dict,
 ) -> bool:
-    dao = AuthDao(session)
-    user_roles: str | None = await dao.get_roles_user(int(payload.get("sub")))
-    if user_roles == "adminishe":
+    # роль из токена или кеша, база - только после изменения ролей
+    user_roles: str | None = role_cache.from_claims(payload)
+    if user_roles is None:
+        user_roles = await get_user_role(session, int(payload.get("sub")))
+    if user_roles == ADMIN_ROLE:
         return True
     raise HTTPException(
         status_code=status.HTTP_403_FORBIDDEN, detail="У вас недостаточно прав"
@@ -119,10 +160,25 @@ async def get_current_admin_user(
 
 async def get_all_users_for_admin(
     session: AsyncSession,
-) -> list[UserInfoForAdmin]:
+    params: UsersPageParams,
+) -> UsersPage:
     dao = AuthDao(session)
-    users = await dao.find_all()
-    return [UserInfoForAdmin(id=user[0], email=user[2], name=user[1], roles_name=user[3]) for user in users]
+    fields: list[str] = params.fields or list(ADMIN_USER_FIELDS)
+    # на одну строку больше, чтобы узнать, есть ли следующая страница
+    rows = await dao.find_page(
+        after_id=params.cursor,
+        limit=params.limit + 1,
+        role=params.role,
+        fields=fields,
+    )
+    has_next: bool = len(rows) > params.limit
+    rows = rows[: params.limit]
+    items: list[dict] = [
+        {name: row._mapping[name] for name in fields} for row in rows
+    ]
+    return UsersPage(
+        items=items, next_cursor=rows[-1].id if has_next and rows else None
+    )
 
 
 # юзер для рефреша с проверкой типа токена
@@ -136,6 +192,30 @@ async def get_current_auth_user_for_refresh(
     return user
 
 
+async def retire_refresh_token(session: AsyncSession, payload: dict) -> None:
+    """
+    Ротация: использованный refresh-токен отзывается по jti, повторно
+    предъявленный (отозванный) или выпущенный без jti отклоняется
+    """
+    jti = payload.get("jti")
+    if not isinstance(jti, str):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED, detail="token without jti"
+        )
+    if not await revocation_store.revoke(
+        session,
+        jti,
+        int(payload.get("sub")),
+        datetime.fromtimestamp(payload["exp"], timezone.utc),
+    ):
+        metrics.inc("refresh_reuse_rejected")
+        logger.warning("Повторное использование refresh-токена %s", jti)
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED, detail="token revoked"
+        )
+    metrics.inc("refresh_rotated")
+
+
 async def validate_auth_user(
     session: AsyncSession,
     email: str,
@@ -151,7 +231,7 @@ async def validate_auth_user(
 
     if not user:
         raise unauthed_exc
-    if not utils.validate_password(password, user[3]):
+    if not await utils.validate_password_async(password, user[3]):
         raise unauthed_exc
 
     logger.info("Пользователь найден %s", user)
@@ -0,0 +1,98 @@
+import csv
+import io
+from logging import Logger, getLogger
+from typing import AsyncContextManager, AsyncIterator, Callable
+
+import orjson
+from sqlalchemy import Row
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.auth.dao import AuthDao
+from src.core.config import settings
+from src.core.db_helper import db_helper
+from src.core.metrics import metrics
+
+logger: Logger = getLogger(__name__)
+
+SessionFactory = Callable[[], AsyncContextManager[AsyncSession]]
+
+# Столбцы выгрузки в порядке вывода
+EXPORT_COLUMNS: tuple[str, ...] = ("id", "name", "email", "roles_name")
+# Строки копятся до этого размера и отдаются клиенту одним фрагментом
+EXPORT_CHUNK_BYTES = 64 * 1024
+
+# С этих символов табличные редакторы начинают формулу
+FORMULA_PREFIXES: tuple[str, ...] = ("=", "+", "-", "@", "\t", "\r")
+
+MEDIA_TYPES: dict[str, str] = {
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson",
+}
+
+
+def escape_csv_cell(value: object) -> object:
+    """
+    Имя и почту задаёт пользователь: ячейка, похожая на формулу,
+    экранируется апострофом, чтобы редактор показал её как текст
+    """
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+class UserExporter:
+    """
+    Выгрузка всех пользователей потоком. Строки читаются курсором
+    на сервере базы порциями по yield_per и сразу пишутся в ответ,
+    поэтому память не растёт с числом пользователей.
+    Сессия своя: сессия зависимости закрывается до отправки тела ответа
+    """
+
+    def __init__(self, session_factory: SessionFactory, yield_per: int) -> None:
+        self._session_factory: SessionFactory = session_factory
+        self.yield_per: int = yield_per
+
+    async def _rows(self, role: str | None) -> AsyncIterator[Row]:
+        count: int = 0
+        async with self._session_factory() as session:
+            async for row in AuthDao(session).stream_all(self.yield_per, role):
+                count += 1
+                yield row
+        metrics.inc("users_exported", count)
+        logger.info("Выгружено пользователей: %d", count)
+
+    async def csv(self, role: str | None = None) -> AsyncIterator[bytes]:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(EXPORT_COLUMNS)
+        async for row in self._rows(role):
+            writer.writerow([escape_csv_cell(value) for value in row])
+            if buffer.tell() >= EXPORT_CHUNK_BYTES:
+                yield buffer.getvalue().encode()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue().encode()
+
+    async def ndjson(self, role: str | None = None) -> AsyncIterator[bytes]:
+        chunk = bytearray()
+        async for row in self._rows(role):
+            chunk += orjson.dumps(dict(zip(EXPORT_COLUMNS, row)))
+            chunk += b"\n"
+            if len(chunk) >= EXPORT_CHUNK_BYTES:
+                yield bytes(chunk)
+                chunk.clear()
+        if chunk:
+            yield bytes(chunk)
+
+    def stream(self, export_format: str, role: str | None = None) -> AsyncIterator[bytes]:
+        if export_format == "csv":
+            return self.csv(role)
+        if export_format == "ndjson":
+            return self.ndjson(role)
+        raise ValueError(f"Неизвестный формат выгрузки: {export_format}")
+
+
+user_exporter = UserExporter(
+    session_factory=db_helper.session_factory,
+    yield_per=settings.admin_export_yield_per,
+)
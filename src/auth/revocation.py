@@ -0,0 +1,144 @@
+import asyncio
+from datetime import datetime, timezone
+from logging import Logger, getLogger
+from time import time
+from typing import AsyncContextManager, Callable
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.auth.dao import RevokedTokensDao
+from src.core.config import settings
+from src.core.db_helper import db_helper
+from src.core.metrics import metrics
+
+logger: Logger = getLogger(__name__)
+
+SessionFactory = Callable[[], AsyncContextManager[AsyncSession]]
+
+
+class RevocationStore:
+    """
+    Отозванные refresh-токены по jti. Отзывы хранятся в таблице
+    revoked_tokens, а проверка идёт по множеству в памяти, которое
+    заполняется из таблицы при старте, поэтому обычный (не отозванный)
+    токен проверяется без обращения к базе.
+    Истёкшие отзывы периодически удаляются из таблицы и из памяти.
+    Используется только из цикла событий, поэтому блокировки не нужны
+    """
+
+    def __init__(
+        self,
+        session_factory: SessionFactory,
+        compact_interval: float,
+        load_attempts: int = 1,
+        load_retry_delay: float = 0.0,
+    ) -> None:
+        self._session_factory: SessionFactory = session_factory
+        self.compact_interval: float = compact_interval
+        self.load_attempts: int = max(1, load_attempts)
+        self.load_retry_delay: float = load_retry_delay
+        # jti -> время истечения токена (timestamp)
+        self._revoked: dict[str, float] = {}
+        # jti, запись отзыва которых ещё идёт
+        self._inflight: set[str] = set()
+        self._task: asyncio.Task | None = None
+        self.compacted: int = 0
+        metrics.register_collector("token_revocation", self.status)
+
+    def is_revoked(self, jti: str) -> bool:
+        return jti in self._revoked
+
+    async def revoke(
+        self,
+        session: AsyncSession,
+        jti: str,
+        user_id: int | None,
+        expires_at: datetime,
+    ) -> bool:
+        """
+        Отзывает токен в сессии запроса. Возвращает False, если он уже отозван:
+        в этом процессе повтор отсекается множеством записываемых jti,
+        между процессами - первичным ключом таблицы.
+        В память отзыв попадает только после успешной записи в базу
+        """
+        if self.is_revoked(jti) or jti in self._inflight:
+            return False
+        self._inflight.add(jti)
+        try:
+            added: bool = await RevokedTokensDao(session).add(
+                jti, user_id, expires_at, datetime.now(timezone.utc)
+            )
+        finally:
+            self._inflight.discard(jti)
+        if added:
+            self._revoked[jti] = expires_at.timestamp()
+        return added
+
+    async def load(self) -> int:
+        """
+        Заполняет множество из таблицы и запускает периодическую очистку.
+        Без отзывов отозванные токены снова принимались бы, поэтому после
+        load_attempts неудачных попыток исключение прерывает запуск
+        """
+        for attempt in range(1, self.load_attempts + 1):
+            try:
+                async with self._session_factory() as session:
+                    rows = await RevokedTokensDao(session).find_active(
+                        datetime.now(timezone.utc)
+                    )
+                break
+            except Exception as e:
+                if attempt == self.load_attempts:
+                    raise
+                logger.warning(
+                    "Не удалось загрузить отозванные токены (попытка %d): %s", attempt, e
+                )
+                await asyncio.sleep(self.load_retry_delay)
+        for jti, expires_at in rows:
+            self._revoked[jti] = expires_at.timestamp()
+        logger.info("Загружено отозванных токенов: %d", len(rows))
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        return len(rows)
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.compact_interval)
+            try:
+                await self.compact()
+            except Exception as e:
+                logger.error("Не удалось удалить истёкшие отзывы токенов: %s", e)
+
+    async def compact(self) -> int:
+        """Удаляет отзывы токенов, которые и так уже истекли"""
+        now: float = time()
+        expired: list[str] = [jti for jti, exp in self._revoked.items() if exp <= now]
+        for jti in expired:
+            del self._revoked[jti]
+        async with self._session_factory() as session:
+            deleted: int = await RevokedTokensDao(session).delete_expired(
+                datetime.fromtimestamp(now, timezone.utc)
+            )
+            await session.commit()
+        self.compacted += deleted
+        return deleted
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def status(self) -> dict:
+        return {"revoked": len(self._revoked), "compacted": self.compacted}
+
+
+revocation_store = RevocationStore(
+    session_factory=db_helper.session_factory,
+    compact_interval=settings.revocation_compact_interval_seconds,
+    load_attempts=settings.revocation_load_attempts,
+    load_retry_delay=settings.revocation_load_retry_seconds,
+)
@@ -1,8 +1,11 @@
-from typing import Self
+from typing import Any, Self
 from fastapi.exceptions import RequestValidationError
-from pydantic import BaseModel, ConfigDict, EmailStr, Field,  model_validator
+from pydantic import BaseModel, ConfigDict, EmailStr, Field, field_validator, model_validator
 
-from src.auth.utils import hash_password
+from src.core.config import settings
+
+# Поля, которые можно выбрать в списке пользователей для администратора
+ADMIN_USER_FIELDS: tuple[str, ...] = ("id", "name", "email", "roles_name")
 
 class TokenInfo(BaseModel):
     access_token: str
@@ -31,7 +34,6 @@ class UserRegister(UserBase):
     def check_password(self) -> Self:
         if self.password != self.confirm_password:
             raise RequestValidationError("Пароли не совпадают")
-        self.password = hash_password(self.password)  # хешируем пароль до сохранения в базе данных
         return self
 
 
@@ -56,3 +58,48 @@ class UserUpdate(BaseModel):
 
 class UserUpdateInfo(UserUpdate):
     user_id: int = Field(description="Идентификатор пользователя")
+
+
+class UsersPageParams(BaseModel):
+    """Параметры страницы списка пользователей, передаются в строке запроса"""
+    cursor: int | None = Field(
+        default=None, ge=0, description="id последнего пользователя предыдущей страницы"
+    )
+    limit: int = Field(
+        default=settings.admin_users_page_size,
+        ge=1,
+        le=settings.admin_users_max_page_size,
+        description="Пользователей на странице",
+    )
+    role: str | None = Field(default=None, description="Только пользователи с этой ролью")
+    fields: list[str] | None = Field(
+        default=None, description="Поля через запятую: id, name, email, roles_name"
+    )
+
+    @field_validator("fields", mode="before")
+    @classmethod
+    def split_fields(cls, value: Any) -> Any:
+        # fields=name,email и fields=name&fields=email, без повторов
+        if isinstance(value, str):
+            value = [value]
+        if isinstance(value, list):
+            names = (name.strip() for item in value for name in str(item).split(","))
+            value = list(dict.fromkeys(name for name in names if name))
+        return value
+
+    @field_validator("fields")
+    @classmethod
+    def check_fields(cls, value: list[str] | None) -> list[str] | None:
+        if value is None:
+            return value
+        unknown: list[str] = [name for name in value if name not in ADMIN_USER_FIELDS]
+        if unknown:
+            raise ValueError(f"Неизвестные поля: {', '.join(unknown)}")
+        return value
+
+
+class UsersPage(BaseModel):
+    items: list[dict[str, Any]] = Field(description="Пользователи, только выбранные поля")
+    next_cursor: int | None = Field(
+        default=None, description="cursor следующей страницы, пусто на последней"
+    )
@@ -0,0 +1,143 @@
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from logging import Logger, getLogger
+from math import ceil
+from time import monotonic
+from typing import Callable, NamedTuple
+
+from fastapi import HTTPException, status
+
+from src.core.config import settings
+from src.core.metrics import metrics
+
+logger: Logger = getLogger(__name__)
+
+
+class Bucket(NamedTuple):
+    tokens: float
+    updated_at: float
+    full_at: float  # когда корзина снова наполнится, после этого ключ не нужен
+
+
+class RateLimitBackend(ABC):
+    """
+    Хранилище корзин токенов. Интерфейс асинхронный, чтобы вместо памяти
+    процесса можно было подключить общее хранилище для всех процессов uvicorn
+    """
+
+    @abstractmethod
+    async def take(self, key: str, rate: float, capacity: int) -> float:
+        """
+        Забирает токен из корзины key, пополняемой на rate токенов в секунду.
+        Возвращает 0, если токен был, иначе секунды до появления токена
+        """
+
+    def status(self) -> dict:
+        return {}
+
+
+class MemoryRateLimitBackend(RateLimitBackend):
+    """
+    Корзины в памяти процесса, не больше max_keys ключей.
+    Ключи упорядочены по последнему обращению: наполнившиеся корзины
+    удаляются с начала при каждом обращении, а при переполнении
+    вытесняется самый давний ключ
+    """
+
+    def __init__(self, max_keys: int, clock: Callable[[], float] = monotonic) -> None:
+        self.max_keys: int = max(1, max_keys)
+        self._clock: Callable[[], float] = clock
+        # Меняется только из цикла событий
+        self._buckets: OrderedDict[str, Bucket] = OrderedDict()
+        self.evicted: int = 0
+
+    def _sweep(self, now: float) -> None:
+        while self._buckets:
+            key, bucket = next(iter(self._buckets.items()))
+            if bucket.full_at > now and len(self._buckets) <= self.max_keys:
+                break
+            del self._buckets[key]
+            if bucket.full_at > now:
+                self.evicted += 1
+
+    async def take(self, key: str, rate: float, capacity: int) -> float:
+        now: float = self._clock()
+        bucket: Bucket | None = self._buckets.pop(key, None)
+        tokens: float = (
+            min(capacity, bucket.tokens + (now - bucket.updated_at) * rate)
+            if bucket is not None
+            else capacity
+        )
+        retry_after: float = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            retry_after = (1 - tokens) / rate
+        self._buckets[key] = Bucket(tokens, now, now + (capacity - tokens) / rate)
+        self._sweep(now)
+        return retry_after
+
+    def status(self) -> dict:
+        return {"keys": len(self._buckets), "evicted": self.evicted}
+
+
+class LoginThrottle:
+    """
+    Ограничение попыток входа по IP-адресу и по учётной записи.
+    Проверка выполняется до обращения к базе и bcrypt, поэтому
+    подбор паролей отклоняется с 429, не занимая процессор
+    """
+
+    def __init__(
+        self,
+        backend: RateLimitBackend,
+        ip_per_minute: float,
+        ip_burst: int,
+        account_per_minute: float,
+        account_burst: int,
+        enabled: bool = True,
+    ) -> None:
+        self.backend: RateLimitBackend = backend
+        self.ip_rate: float = ip_per_minute / 60
+        self.ip_burst: int = ip_burst
+        self.account_rate: float = account_per_minute / 60
+        self.account_burst: int = account_burst
+        self.enabled: bool = enabled
+        metrics.register_collector("login_throttle", self.status)
+
+    def _reject(self, reason: str, retry_after: float) -> HTTPException:
+        metrics.inc(f"login_throttled_{reason}")
+        logger.warning("Слишком много попыток входа (%s)", reason)
+        return HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Слишком много попыток входа, повторите позже",
+            headers={"Retry-After": str(ceil(retry_after))},
+        )
+
+    async def check(self, ip: str | None, account: str) -> None:
+        """Расходует попытку для IP и учётной записи или отклоняет вход с 429"""
+        if not self.enabled:
+            return
+        retry_after: float = await self.backend.take(
+            f"ip:{ip}", self.ip_rate, self.ip_burst
+        )
+        if retry_after:
+            raise self._reject("ip", retry_after)
+        retry_after = await self.backend.take(
+            f"account:{account.strip().lower()}", self.account_rate, self.account_burst
+        )
+        if retry_after:
+            raise self._reject("account", retry_after)
+
+    def status(self) -> dict:
+        return {"enabled": self.enabled, **self.backend.status()}
+
+
+login_throttle = LoginThrottle(
+    backend=MemoryRateLimitBackend(max_keys=settings.login_throttle_max_keys),
+    ip_per_minute=settings.login_ip_per_minute,
+    ip_burst=settings.login_ip_burst,
+    account_per_minute=settings.login_account_per_minute,
+    account_burst=settings.login_account_burst,
+    enabled=settings.login_throttle_enabled,
+)
@@ -1,19 +1,171 @@
+import asyncio
+import hashlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone, timedelta
 from logging import Logger, getLogger
+from pathlib import Path
+from threading import Lock
+from time import perf_counter, time
+from typing import Callable, TypeVar
 
 import bcrypt
 import jwt
+from cryptography.hazmat.primitives.asymmetric.ec import (
+    EllipticCurvePrivateKey,
+    EllipticCurvePublicKey,
+)
+from cryptography.hazmat.primitives.asymmetric.ed25519 import (
+    Ed25519PrivateKey,
+    Ed25519PublicKey,
+)
+from cryptography.hazmat.primitives.asymmetric.rsa import RSAPrivateKey, RSAPublicKey
+from cryptography.hazmat.primitives.asymmetric.types import (
+    PrivateKeyTypes,
+    PublicKeyTypes,
+)
+from cryptography.hazmat.primitives.serialization import (
+    load_pem_private_key,
+    load_pem_public_key,
+)
 
 from src.core.config import settings
+from src.core.metrics import metrics
 
 logger: Logger = getLogger(__name__)
 
+T = TypeVar("T")
+
+
+def load_private_key(path: Path) -> PrivateKeyTypes:
+    return load_pem_private_key(path.read_bytes(), password=None)
+
+
+def load_public_key(path: Path) -> PublicKeyTypes:
+    return load_pem_public_key(path.read_bytes())
+
+
+# Алгоритм JWT по кривой ключа ECDSA
+EC_ALGORITHMS: dict[str, str] = {
+    "secp256r1": "ES256",
+    "secp384r1": "ES384",
+    "secp521r1": "ES512",
+}
+RSA_ALGORITHMS: tuple[str, ...] = ("RS256", "RS384", "RS512", "PS256", "PS384", "PS512")
+
+
+def algorithm_for_key(key: PrivateKeyTypes | PublicKeyTypes) -> str:
+    """Алгоритм подписи JWT по типу ключа"""
+    if isinstance(key, (Ed25519PrivateKey, Ed25519PublicKey)):
+        return "EdDSA"
+    if isinstance(key, (EllipticCurvePrivateKey, EllipticCurvePublicKey)):
+        if key.curve.name in EC_ALGORITHMS:
+            return EC_ALGORITHMS[key.curve.name]
+        raise ValueError(f"Неподдерживаемая кривая ключа: {key.curve.name}")
+    if isinstance(key, (RSAPrivateKey, RSAPublicKey)):
+        return "RS256"
+    raise ValueError(f"Неподдерживаемый тип ключа: {type(key).__name__}")
+
+
+def resolve_algorithm(
+    configured: str | None,
+    private_key: PrivateKeyTypes,
+    public_key: PublicKeyTypes,
+) -> str:
+    """
+    Алгоритм из настроек или, если он не задан, по типу ключей.
+    Для RSA можно выбрать любой RS*/PS*, для остальных ключей алгоритм однозначен
+    """
+    detected: str = algorithm_for_key(public_key)
+    if algorithm_for_key(private_key) != detected:
+        raise ValueError("Приватный и публичный ключи JWT разного типа")
+    if configured is None:
+        return detected
+    if configured != detected and not (
+        detected == "RS256" and configured in RSA_ALGORITHMS
+    ):
+        raise ValueError(f"Алгоритм {configured} не подходит для ключа {detected}")
+    return configured
+
+
+# Ключи разбираются один раз: PyJWT разбирает PEM-строку при каждом вызове,
+# для RSA это дороже самой подписи
+PRIVATE_KEY: PrivateKeyTypes = load_private_key(settings.private_key_path)
+PUBLIC_KEY: PublicKeyTypes = load_public_key(settings.public_key_path)
+ALGORITHM: str = resolve_algorithm(settings.algorithms, PRIVATE_KEY, PUBLIC_KEY)
+
+
+class VerifiedTokenCache:
+    """
+    Проверенные токены: полезная нагрузка по хешу токена до его exp.
+    Клиент, много раз приходящий с одним access-токеном, платит
+    за проверку подписи только один раз. Не больше max_entries записей,
+    при переполнении вытесняется давно не использованная
+    """
+
+    def __init__(self, max_entries: int) -> None:
+        self.max_entries: int = max_entries
+        self._entries: OrderedDict[bytes, tuple[dict, float]] = OrderedDict()
+        self._lock = Lock()
+        self.hits: int = 0
+        self.misses: int = 0
+        metrics.register_collector("jwt_cache", self.status)
+
+    @staticmethod
+    def _key(token: str | bytes) -> bytes:
+        if isinstance(token, str):
+            token = token.encode()
+        return hashlib.sha256(token).digest()
+
+    def get(self, token: str | bytes) -> dict | None:
+        key: bytes = self._key(token)
+        with self._lock:
+            entry: tuple[dict, float] | None = self._entries.get(key)
+            if entry is not None and entry[1] <= time():
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        return dict(entry[0])
+
+    def put(self, token: str | bytes, payload: dict) -> None:
+        exp = payload.get("exp")
+        if self.max_entries <= 0 or not isinstance(exp, (int, float)):
+            return
+        key: bytes = self._key(token)
+        with self._lock:
+            self._entries[key] = (dict(payload), float(exp))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def status(self) -> dict:
+        with self._lock:
+            requests: int = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / requests if requests else 0.0,
+            }
+
+
+token_cache = VerifiedTokenCache(max_entries=settings.jwt_cache_max_entries)
+
 
 def encode_jwt(
     payload: dict,
     type_token: str,
-    private_key: str = settings.private_key_path.read_text(),
-    algorithm: str = settings.algorithms,
+    private_key: PrivateKeyTypes | str = PRIVATE_KEY,
+    algorithm: str = ALGORITHM,
 ) -> str:
     now: datetime = datetime.now(timezone.utc)
     if type_token == "access":
@@ -27,22 +179,105 @@ def encode_jwt(
     to_encode: dict = payload.copy()
     to_encode.update(exp=expires, iat=now)
 
-    return jwt.encode(to_encode, private_key, algorithm=algorithm)
+    with metrics.timer("jwt_sign"):
+        return jwt.encode(to_encode, private_key, algorithm=algorithm)
 
 
 def decode_jwt(
     token: str | bytes,
-    public_key: str = settings.public_key_path.read_text(),
-    algorithm: str = settings.algorithms,
+    public_key: PublicKeyTypes | str = PUBLIC_KEY,
+    algorithm: str = ALGORITHM,
 ) -> dict:
-    return jwt.decode(token, public_key, algorithms=[algorithm])
+    # Кеш только для ключа и алгоритма приложения; остальное (например, None
+    # без cookie) проверяет jwt.decode, который отвечает InvalidTokenError
+    cached: bool = (
+        isinstance(token, (str, bytes))
+        and public_key is PUBLIC_KEY
+        and algorithm == ALGORITHM
+    )
+    if cached and (payload := token_cache.get(token)) is not None:
+        return payload
+    with metrics.timer("jwt_verify"):
+        payload = jwt.decode(token, public_key, algorithms=[algorithm])
+    if cached:
+        token_cache.put(token, payload)
+    return payload
 
 
-def hash_password(password: str) -> bytes:
-    salt: bytes = bcrypt.gensalt()
+def hash_password(password: str, rounds: int | None = None) -> bytes:
+    salt: bytes = bcrypt.gensalt(rounds=rounds or settings.bcrypt_rounds)
     password_bytes: bytes = password.encode()
     return bcrypt.hashpw(password_bytes, salt)
 
 
 def validate_password(password: str, hashed_password: bytes) -> bool:
     return bcrypt.checkpw(password.encode(), hashed_password)
+
+
+class PasswordHasher:
+    """
+    bcrypt в отдельном пуле потоков: хеширование занимает сотни миллисекунд
+    и в цикле событий останавливало бы все запросы.
+    bcrypt отпускает GIL, а размер пула ограничивает число ядер,
+    которые одновременно заняты паролями, остальные запросы ждут в очереди пула
+    """
+
+    def __init__(self, workers: int) -> None:
+        if workers < 1:
+            raise ValueError("Количество потоков должно быть больше нуля")
+        self.workers: int = workers
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="bcrypt"
+        )
+        # Счётчик меняется только из цикла событий
+        self._pending: int = 0
+        metrics.register_collector("password_hasher", self.status)
+
+    async def _run(self, name: str, func: Callable[[], T]) -> T:
+        queued_at: float = perf_counter()
+
+        def timed() -> T:
+            start: float = perf_counter()
+            metrics.observe("bcrypt_wait", start - queued_at)
+            try:
+                return func()
+            finally:
+                metrics.observe(name, perf_counter() - start)
+
+        self._pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                self._executor, timed
+            )
+        finally:
+            self._pending -= 1
+
+    async def hash(self, password: str) -> bytes:
+        return await self._run("bcrypt_hash", lambda: hash_password(password))
+
+    async def verify(self, password: str, hashed_password: bytes) -> bool:
+        return await self._run(
+            "bcrypt_verify", lambda: validate_password(password, hashed_password)
+        )
+
+    def status(self) -> dict:
+        return {
+            "workers": self.workers,
+            "rounds": settings.bcrypt_rounds,
+            "pending": self._pending,
+            "queued": max(0, self._pending - self.workers),
+        }
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+password_hasher = PasswordHasher(workers=settings.bcrypt_workers)
+
+
+async def hash_password_async(password: str) -> bytes:
+    return await password_hasher.hash(password)
+
+
+async def validate_password_async(password: str, hashed_password: bytes) -> bool:
+    return await password_hasher.verify(password, hashed_password)
@@ -1,8 +1,9 @@
-from typing import Optional
+from typing import Annotated, Literal, Optional
 from logging import Logger, getLogger
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from fastapi import APIRouter, Response, Request, Depends, HTTPException, status, Form
+from fastapi import APIRouter, Response, Request, Depends, HTTPException, status, Form, Query
+from fastapi.responses import StreamingResponse
 
 from src.auth.dependencies import (
     validate_auth_user,
@@ -13,19 +14,25 @@ from src.auth.dependencies import (
     get_current_token_payload,
     get_current_admin_user,
     get_all_users_for_admin,
+    get_role_claims,
+    retire_refresh_token,
     update_user,
 )
 from src.auth.schemas import (
     TokenInfo,
     UserBase,
-    UserInfoForAdmin,
     UserRegister,
     UserAddDB,
     UserInfo,
     UserUpdate,
     UserUpdateInfo,
+    UsersPage,
+    UsersPageParams,
 )
 from src.auth.dao import AuthDao
+from src.auth.export import MEDIA_TYPES, user_exporter
+from src.auth.throttling import login_throttle
+from src.auth.utils import hash_password_async
 from src.core.db_helper import db_helper
 
 router = APIRouter(prefix="/auth", tags=["auth"])
@@ -48,6 +55,8 @@ async def register_users(
 
     user_dict = user.model_dump()
     del user_dict["confirm_password"]
+    # хешируем пароль до сохранения в базе данных, вне цикла событий
+    user_dict["password"] = await hash_password_async(user.password)
 
     res = await dao.add(UserAddDB(**user_dict))
     logger.info("Запись %s ", res)
@@ -56,18 +65,24 @@ async def register_users(
 
 @router.post("/login/", response_model=TokenInfo)
 async def auth_user_issue_jwt(
+    request: Request,
     response: Response,
     username: str = Form(...),
     password: str = Form(...),
     # user_data: OAuth2PasswordRequestForm = Depends(),
     session=Depends(db_helper.get_session_without_commit),
 ) -> TokenInfo:
-
+    # до запроса к базе и bcrypt
+    await login_throttle.check(
+        ip=request.client.host if request.client else None, account=username
+    )
     user: UserInfo = await validate_auth_user(
         session=session, email=username, password=password
     )
 
-    access_token = create_access_token(user)
+    access_token = create_access_token(
+        user, role_claims=await get_role_claims(session=session, user_id=user.id)
+    )
     refresh_token = create_refresh_token(user)
     response.set_cookie(
         key="refresh_token",
@@ -84,23 +99,37 @@ async def auth_user_issue_jwt(
 @router.post(
     "/refresh/",
     response_model=TokenInfo,
-    response_model_exclude_none=True,  # если в есть значения none то исключаем эти поля (тут refresh_token будет none)
+    response_model_exclude_none=True,  # если в есть значения none то исключаем эти поля
 )
 async def auth_refresh_jwt(
     request: Request,
-    session: AsyncSession = Depends(db_helper.get_session_without_commit),
+    response: Response,
+    session: AsyncSession = Depends(db_helper.get_session_with_commit),
 ) -> TokenInfo:
     token: str | None = request.cookies.get("refresh_token")
     payload: dict = get_current_token_payload(token=token)
     user: UserBase = await get_current_auth_user_for_refresh(
         session=session, payload=payload
     )
+    # старый refresh-токен отзывается, вместе с access выдаётся новый
+    await retire_refresh_token(session=session, payload=payload)
     user_update = UserInfo(**user.model_dump(), id=payload["sub"])
-    print(f"{user_update=}")
-    access_token: str = create_access_token(user_update)
+    access_token: str = create_access_token(
+        user_update,
+        role_claims=await get_role_claims(session=session, user_id=user_update.id),
+    )
+    refresh_token: str = create_refresh_token(user_update)
+    response.set_cookie(
+        key="refresh_token",
+        value=refresh_token,
+        httponly=True,
+        secure=True,  # Только для HTTPS
+        samesite="strict",  # Защита от CSRF
+    )
     return TokenInfo(
         access_token=access_token,
-    ) 
+        refresh_token=refresh_token,
+    )
 
 
 @router.get("/user/me/", response_model=UserBase)
@@ -122,10 +151,27 @@ async def update_user_info(
     await update_user(session=session, user=uses)
     return {"message": "Данные успешно обновлены"}
 
-@router.get("/all_users_for_admin/", response_model=list[UserInfoForAdmin])
+@router.get("/all_users_for_admin/", response_model=UsersPage)
 async def get_all_users(
+    params: Annotated[UsersPageParams, Query()],
     session: AsyncSession = Depends(db_helper.get_session_without_commit),
     payload: dict = Depends(get_current_token_payload),
-) -> list[UserInfoForAdmin]:
+) -> UsersPage:
     if await get_current_admin_user(session=session, payload=payload):
-        return await get_all_users_for_admin(session=session)
+        return await get_all_users_for_admin(session=session, params=params)
+
+
+@router.get("/users/export/")
+async def export_users(
+    export_format: Literal["csv", "ndjson"] = Query("csv", alias="format"),
+    role: str | None = Query(None, description="Только пользователи с этой ролью"),
+    session: AsyncSession = Depends(db_helper.get_session_without_commit),
+    payload: dict = Depends(get_current_token_payload),
+) -> StreamingResponse:
+    await get_current_admin_user(session=session, payload=payload)
+    return StreamingResponse(
+        user_exporter.stream(export_format, role),
+        media_type=MEDIA_TYPES[export_format],
+        headers={"Content-Disposition": f'attachment; filename="users.{export_format}"'},
+    )
+
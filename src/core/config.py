@@ -1,4 +1,6 @@
 from pathlib import Path
+from typing import Literal
+
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 BASE_DIR = Path(__file__).parent.parent.parent
@@ -17,13 +19,73 @@ class Settings(BaseSettings):
         return f"postgresql+asyncpg://{self.DB_USER}:{self.DB_PASS}@{self.DB_HOST}:{self.DB_PORT}/{self.DB_NAME}"
 
     echo: bool = False
+    web_concurrency: int = 1  # процессов uvicorn (переменная WEB_CONCURRENCY)
     model_config = SettingsConfigDict(env_file=f"{BASE_DIR}/.env")
 
     # auth
     private_key_path: Path = BASE_DIR / "cert" / "private.pem"  
     public_key_path: Path = BASE_DIR / "cert" / "public.pem" 
-    algorithms: str = "RS256"
+    algorithms: str | None = None  # алгоритм JWT (None - по типу ключа: RS256, ES256, EdDSA)
     access_token_expire_minutes: int = 15
     refresh_token_expire_days: int = 7
+    revocation_compact_interval_seconds: float = 3600.0  # период удаления истёкших отзывов
+    revocation_load_attempts: int = 5  # попыток загрузить отзывы при старте
+    revocation_load_retry_seconds: float = 2.0  # пауза между попытками
+    admin_users_page_size: int = 100  # пользователей на странице списка по умолчанию
+    admin_users_max_page_size: int = 1000  # максимальный размер страницы списка
+    admin_export_yield_per: int = 1000  # строк за одно чтение курсора при выгрузке
+    jwt_cache_max_entries: int = 10_000  # проверенных токенов в кеше (0 - выключен)
+    profile_cache_max_entries: int = 10_000  # профилей пользователей в кеше (0 - выключен)
+    profile_cache_ttl_seconds: float = 60.0  # время жизни профиля в кеше
+    role_cache_max_entries: int = 10_000  # ролей пользователей в кеше (0 - выключен)
+    role_cache_ttl_seconds: float = 60.0  # время жизни роли в кеше
+    bcrypt_rounds: int = 12  # стоимость bcrypt (2^rounds итераций)
+    bcrypt_workers: int = 2  # потоков для хеширования и проверки паролей
+    login_throttle_enabled: bool = True  # ограничивать частоту попыток входа
+    login_ip_per_minute: float = 60  # попыток входа в минуту с одного IP
+    login_ip_burst: int = 20  # попыток с одного IP подряд
+    login_account_per_minute: float = 5  # попыток входа в минуту в одну учётную запись
+    login_account_burst: int = 10  # попыток в одну учётную запись подряд
+    login_throttle_max_keys: int = 100_000  # ключей в памяти ограничителя
+
+    # predictions
+    predict_preload_model: bool = True  # загружать модель при старте приложения
+    predict_workers: int = 2  # потоков инференса
+    predict_queue_size: int = 8  # запросов, ожидающих свободный поток
+    predict_retry_after: int = 1  # секунд в заголовке Retry-After при перегрузке
+    predict_batch_max_size: int = 8  # изображений в одном forward (1 - без пакетов)
+    predict_batch_wait_ms: float = 5.0  # сколько ждать пополнения пакета
+    predict_jpeg_quality: int = 95  # качество JPEG в ответе по умолчанию
+    predict_max_dimension: int | None = None  # максимальная сторона изображения в ответе
+    predict_cache_max_bytes: int = 64 * 1024 * 1024  # объём кеша результатов (0 - выключен)
+    predict_cache_ttl_seconds: float = 300.0  # время жизни результата в кеше
+    predict_batch_concurrency: int = 4  # изображений пакета в работе одновременно
+    predict_batch_max_files: int = 1000  # файлов в одном пакетном запросе
+    predict_max_upload_bytes: int = 20 * 1024 * 1024  # максимальный размер изображения
+    predict_max_video_bytes: int = 512 * 1024 * 1024  # максимальный размер видео
+    predict_decode_min_side: int = 600  # сторона, до которой можно уменьшать при декодировании
+    predict_decode_max_side: int = 2048  # более крупные изображения декодируются уменьшенными
+    predict_backend: Literal["opencv", "onnxruntime"] = "opencv"  # бэкенд инференса
+    predict_threads: int | None = None  # потоков инференса на процесс (None - ядра / процессы)
+    predict_opencv_target: Literal["cpu", "opencl"] = "cpu"  # устройство для cv2.dnn
+    # Экспорт с постобработкой SSD: первый выход [1, 1, N, 7], как у DetectionOutput
+    predict_onnx_model_path: Path = BASE_DIR / "src" / "api_predictions" / "mobilenet_ssd.onnx"
+    predict_onnx_inter_op_threads: int = 1  # потоков между операторами ONNX Runtime
+    predict_model_version: str = "mobilenet_iter_73000"  # версия модели при старте
+    predict_models_dir: Path = BASE_DIR / "models"  # каталоги версий для горячей замены
+    predict_jobs_concurrency: int = 4  # асинхронных задач в обработке одновременно
+    predict_jobs_max_pending: int = 256  # задач в очереди процесса
+    predict_jobs_max_pending_bytes: int = 256 * 1024 * 1024  # байт изображений в очереди
+    predict_jobs_heartbeat_seconds: float = 30.0  # как часто процесс отмечает свои задачи
+    predict_history_enabled: bool = True  # сохранять найденные объекты в историю
+    predict_history_flush_rows: int = 500  # строк в одной пакетной вставке
+    predict_history_flush_interval: float = 1.0  # секунд между записями буфера
+    predict_history_max_buffer: int = 50000  # строк в буфере, если база недоступна
+    predict_tile_size: int = 640  # сторона фрагмента в пикселях исходного изображения
+    predict_tile_overlap: float = 0.2  # доля перекрытия соседних фрагментов
+    predict_max_tiles: int = 16  # фрагментов на изображение (больше - крупнее фрагменты)
+    predict_tile_nms_threshold: float = 0.45  # порог NMS для объединения фрагментов
+    predict_benchmark_on_startup: bool = False  # замерить бэкенды при старте
+    predict_benchmark_iterations: int = 20  # прогонов forward на бэкенд при замере
 
 settings = Settings()
@@ -1,9 +1,32 @@
-from typing import AsyncGenerator
-from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from typing import AsyncGenerator, Callable
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import (
+    AsyncConnection,
+    AsyncSession,
+    async_sessionmaker,
+    create_async_engine,
+)
 
 from src.core.config import settings
 
 
+def after_commit(
+    session: AsyncSession | AsyncConnection, callback: Callable[[], None]
+) -> None:
+    """
+    Вызывает callback один раз при фиксации текущей транзакции.
+    Нужен для сброса кешей: сброшенная до коммита запись может быть
+    тут же заполнена параллельным запросом ещё старыми данными
+    """
+    if isinstance(session, AsyncSession):
+        event.listen(
+            session.sync_session, "after_commit", lambda _: callback(), once=True
+        )
+    else:
+        # У соединения есть только событие непосредственно перед фиксацией
+        event.listen(session.sync_connection, "commit", lambda _: callback(), once=True)
+
+
 class DBHelper:
     def __init__(self, url: str, echo: bool = False):
         self.engine = create_async_engine(
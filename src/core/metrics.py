@@ -0,0 +1,107 @@
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from logging import Logger, getLogger
+from threading import Lock
+from time import perf_counter
+from typing import Any, Callable, Iterator
+
+logger: Logger = getLogger(__name__)
+
+# Сколько последних замеров хранить для расчёта перцентилей
+TIMINGS_WINDOW = 1024
+
+
+class Metrics:
+    """
+    Простое потокобезопасное хранилище метрик процесса:
+    счётчики, текущие значения (gauges) и замеры времени с перцентилями
+    """
+
+    def __init__(self, window: int = TIMINGS_WINDOW) -> None:
+        self._lock = Lock()
+        self._counters: dict[str, int] = defaultdict(int)
+        self._gauges: dict[str, Any] = {}
+        self._timings: dict[str, deque[float]] = defaultdict(
+            lambda: deque(maxlen=window)
+        )
+        self._timing_totals: dict[str, int] = defaultdict(int)
+        self._collectors: dict[str, Callable[[], dict]] = {}
+
+    def inc(self, name: str, value: int = 1) -> None:
+        with self._lock:
+            self._counters[name] += value
+
+    def set_gauge(self, name: str, value: Any) -> None:
+        with self._lock:
+            self._gauges[name] = value
+
+    def observe(self, name: str, seconds: float) -> None:
+        with self._lock:
+            self._timings[name].append(seconds)
+            self._timing_totals[name] += 1
+
+    @contextmanager
+    def timer(self, name: str) -> Iterator[None]:
+        start: float = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, perf_counter() - start)
+
+    def register_collector(self, name: str, collector: Callable[[], dict]) -> None:
+        """Регистрирует функцию, возвращающую метрики компонента при снимке"""
+        with self._lock:
+            self._collectors[name] = collector
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+            timings = {
+                name: (list(values), self._timing_totals[name])
+                for name, values in self._timings.items()
+            }
+            collectors = dict(self._collectors)
+
+        result: dict = {
+            "counters": counters,
+            "gauges": gauges,
+            "timings": {
+                name: _summarize(values, total)
+                for name, (values, total) in timings.items()
+            },
+        }
+        for name, collector in collectors.items():
+            try:
+                result[name] = collector()
+            except Exception as e:
+                logger.error("Ошибка при сборе метрик %s: %s", name, e)
+        return result
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._timings.clear()
+            self._timing_totals.clear()
+
+
+def _percentile(sorted_values: list[float], q: float) -> float:
+    index: int = min(len(sorted_values) - 1, int(round(q * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def _summarize(values: list[float], total: int) -> dict:
+    if not values:
+        return {"count": total}
+    values = sorted(values)
+    return {
+        "count": total,
+        "p50_ms": _percentile(values, 0.50) * 1000,
+        "p95_ms": _percentile(values, 0.95) * 1000,
+        "p99_ms": _percentile(values, 0.99) * 1000,
+        "max_ms": values[-1] * 1000,
+    }
+
+
+metrics = Metrics()
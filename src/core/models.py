@@ -6,6 +6,11 @@ from sqlalchemy import (
     String,
     LargeBinary,
     ForeignKey,
+    DateTime,
+    Text,
+    Index,
+    BigInteger,
+    Float,
 )
 
 metadata = MetaData()
@@ -27,3 +32,56 @@ roles_table = Table(
     Column("id", Integer, primary_key=True),
     Column("name", String(100)),
 )
+
+prediction_jobs_table = Table(
+    "prediction_jobs",
+    metadata,
+    Column("id", String(32), primary_key=True),
+    Column("user_id", ForeignKey("users.id", ondelete="CASCADE"), nullable=True),
+    Column("status", String(20), nullable=False),
+    Column("filename", String(255)),
+    Column("params", Text, nullable=False),
+    Column("result", Text),
+    Column("status_code", Integer),
+    Column("error", Text),
+    Column("created_at", DateTime(timezone=True), nullable=False),
+    Column("started_at", DateTime(timezone=True)),
+    Column("finished_at", DateTime(timezone=True)),
+    # Процесс, в очереди которого задача, и его последняя отметка
+    Column("owner", String(32)),
+    Column("heartbeat_at", DateTime(timezone=True)),
+    # Поиск незавершённых задач
+    Index("ix_prediction_jobs_status_created_at", "status", "created_at"),
+)
+
+detections_table = Table(
+    "detections",
+    metadata,
+    Column("id", BigInteger().with_variant(Integer, "sqlite"), primary_key=True),
+    Column("prediction_id", String(32), nullable=False),
+    Column("user_id", ForeignKey("users.id", ondelete="CASCADE"), nullable=True),
+    Column("filename", String(255)),
+    Column("class_name", String(50), nullable=False),
+    Column("confidence", Float, nullable=False),
+    Column("x1", Integer, nullable=False),
+    Column("y1", Integer, nullable=False),
+    Column("x2", Integer, nullable=False),
+    Column("y2", Integer, nullable=False),
+    Column("model_version", String(100)),
+    Column("created_at", DateTime(timezone=True), nullable=False),
+    # История пользователя за период
+    Index("ix_detections_user_id_created_at", "user_id", "created_at"),
+    # Кто загружал изображения с объектами класса за период
+    Index("ix_detections_class_name_created_at", "class_name", "created_at", "user_id"),
+)
+
+revoked_tokens_table = Table(
+    "revoked_tokens",
+    metadata,
+    Column("jti", String(32), primary_key=True),
+    Column("user_id", ForeignKey("users.id", ondelete="CASCADE"), nullable=True),
+    Column("expires_at", DateTime(timezone=True), nullable=False),
+    Column("revoked_at", DateTime(timezone=True), nullable=False),
+    # Загрузка действующих отзывов при старте и удаление истёкших
+    Index("ix_revoked_tokens_expires_at", "expires_at"),
+)
@@ -3,6 +3,7 @@ from logging import Logger, getLogger
 from typing import Any
 
 from fastapi import HTTPException, Request
+from fastapi.encoders import jsonable_encoder
 from fastapi.exceptions import RequestValidationError
 from fastapi.responses import JSONResponse
 
@@ -21,6 +22,7 @@ async def custom_http_exception_handler(
     return JSONResponse(
         status_code=exc.status_code,
         content={"error http": str(exc)},
+        headers=exc.headers,
     )
 
 
@@ -35,7 +37,7 @@ async def custom_request_validation_exception_handler(
         status_code=422,
         content={
             "message": "Собственный проверяльщик ошибок валидации",
-            "errors": exc.errors(),
+            "errors": jsonable_encoder(exc.errors()),
         },
     )
 
@@ -1,5 +1,7 @@
+from contextlib import asynccontextmanager
 from logging import Logger, getLogger, basicConfig, INFO, StreamHandler, FileHandler
 from pathlib import Path
+from typing import AsyncIterator
 
 from starlette.templating import _TemplateResponse
 import uvicorn
@@ -13,6 +15,18 @@ from fastapi import Request
 
 from src.auth.views import router as auth_router
 from src.api_predictions.views import router as predictions_router
+from src.api_predictions.predictions_img import (
+    benchmark_inference_backends,
+    model_registry,
+)
+from src.api_predictions.inference_pool import inference_pool
+from src.api_predictions.history import history_writer
+from src.api_predictions.jobs import job_scheduler
+from src.api_predictions.service import micro_batcher
+from src.auth.revocation import revocation_store
+from src.auth.utils import password_hasher
+from src.core.config import settings
+from src.core.metrics import metrics
 from src.exceptions import (
     custom_http_exception_handler,
     custom_request_validation_exception_handler,
@@ -24,12 +38,39 @@ TEMPLATES_DIR: Path = BASE_DIR / "templates"
 STATIC_DIR: Path = BASE_DIR / "static"
 LOG_FILE: Path = BASE_DIR / "logs.log"
 
-# Создание экземпляра FastAPI приложения
-app = FastAPI()
-
 # Настройка логгера
 logger: Logger = getLogger(__name__)
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    """
+    Запуск и остановка приложения
+    Заранее загружает модель, чтобы первый запрос не платил за холодный старт,
+    и при необходимости замеряет бэкенды инференса на этом хосте
+    """
+    if settings.predict_preload_model:
+        try:
+            model_registry.load(settings.predict_workers)
+        except Exception as e:
+            logger.error("Не удалось загрузить модель при старте: %s", e)
+    if settings.predict_benchmark_on_startup:
+        benchmark_inference_backends()
+    job_scheduler.start()
+    # Без списка отзывов сервис не запускается
+    await revocation_store.load()
+    yield
+    await revocation_store.close()
+    job_scheduler.stop()
+    await history_writer.close()
+    await micro_batcher.stop()
+    inference_pool.shutdown()
+    password_hasher.shutdown()
+
+
+# Создание экземпляра FastAPI приложения
+app = FastAPI(lifespan=lifespan)
+
 # Формат логов
 FORMAT = "%(asctime)s:%(levelname)s:%(name)s:%(message)s"
 
@@ -71,6 +112,14 @@ async def home_page(request: Request) -> _TemplateResponse:
     return templates.TemplateResponse("index.html", {"request": request})
 
 
+@app.get("/metrics/")
+async def get_metrics() -> dict:
+    """
+    Метрики процесса: задержки, счётчики и состояние модели
+    """
+    return metrics.snapshot()
+
+
 if __name__ == "__main__":
     # Запуск сервера разработки
     logger.info("Запуск сервера разработки")
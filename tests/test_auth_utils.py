@@ -2,7 +2,20 @@ from calendar import timegm
 from contextlib import nullcontext
 from datetime import datetime, timedelta, timezone
 import pytest
-from src.auth.utils import encode_jwt, decode_jwt, hash_password, validate_password
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519, rsa
+from src.auth.throttling import MemoryRateLimitBackend
+from src.auth.utils import (
+    VerifiedTokenCache,
+    algorithm_for_key,
+    encode_jwt,
+    decode_jwt,
+    hash_password,
+    hash_password_async,
+    resolve_algorithm,
+    validate_password,
+    validate_password_async,
+)
+from src.core.metrics import metrics
 
 
 @pytest.mark.parametrize(
@@ -65,6 +78,60 @@ def test_encode_jwt_refresh_token(user_id, user_name, type_token, expectation) -
         assert decode_payload["iat"] == timegm((now).utctimetuple())
 
 
+@pytest.mark.parametrize(
+    "private_key, algorithm",
+    (
+        (ed25519.Ed25519PrivateKey.generate(), "EdDSA"),
+        (ec.generate_private_key(ec.SECP256R1()), "ES256"),
+        (ec.generate_private_key(ec.SECP384R1()), "ES384"),
+    ),
+)
+def test_jwt_with_detected_algorithm(private_key, algorithm) -> None:
+    public_key = private_key.public_key()
+    assert resolve_algorithm(None, private_key, public_key) == algorithm
+
+    token: str = encode_jwt({"sub": "1"}, "access", private_key, algorithm)
+    assert decode_jwt(token, public_key, algorithm)["sub"] == "1"
+
+
+def test_resolve_algorithm_checks_key_type() -> None:
+    rsa_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    ed_key = ed25519.Ed25519PrivateKey.generate()
+
+    assert algorithm_for_key(rsa_key.public_key()) == "RS256"
+    assert resolve_algorithm("PS256", rsa_key, rsa_key.public_key()) == "PS256"
+    with pytest.raises(ValueError, match="не подходит"):
+        resolve_algorithm("RS256", ed_key, ed_key.public_key())
+    with pytest.raises(ValueError, match="разного типа"):
+        resolve_algorithm(None, rsa_key, ed_key.public_key())
+
+
+def test_decode_jwt_uses_verified_token_cache() -> None:
+    token: str = encode_jwt({"sub": "7"}, "access")
+    hits: int = metrics.snapshot()["jwt_cache"]["hits"]
+
+    assert decode_jwt(token)["sub"] == "7"
+    payload: dict = decode_jwt(token)
+    payload["sub"] = "changed"  # копия не портит запись в кеше
+
+    assert decode_jwt(token)["sub"] == "7"
+    assert metrics.snapshot()["jwt_cache"]["hits"] == hits + 2
+
+
+def test_verified_token_cache_expiry_and_eviction() -> None:
+    cache = VerifiedTokenCache(max_entries=2)
+    now: float = datetime.now(timezone.utc).timestamp()
+    cache.put("expired", {"exp": now - 1})
+    cache.put("a", {"exp": now + 60})
+
+    assert cache.get("expired") is None
+    cache.put("b", {"exp": now + 60})
+    assert cache.get("a") == {"exp": now + 60}
+    cache.put("c", {"exp": now + 60})  # вытесняет b, к которому не обращались
+    assert cache.get("b") is None
+    assert cache.status()["entries"] == 2
+
+
 def test_validate_password() -> None:
     password = "test_password"
     hashed_password: bytes = hash_password(password)
@@ -73,4 +140,36 @@ def test_validate_password() -> None:
     assert validate_password(password, hashed_password) is True
 
 
-    
\ No newline at end of file
+@pytest.mark.asyncio
+async def test_password_async_helpers() -> None:
+    password = "test_password"
+    hashed_password: bytes = await hash_password_async(password)
+
+    assert hashed_password.startswith(b"$2b$")
+    assert await validate_password_async(password, hashed_password) is True
+    assert await validate_password_async("wrong_password", hashed_password) is False
+    timings: dict = metrics.snapshot()["timings"]
+    assert timings["bcrypt_hash"]["count"] >= 1
+    assert timings["bcrypt_verify"]["count"] >= 2
+
+
+@pytest.mark.asyncio
+async def test_memory_rate_limit_backend() -> None:
+    now: list[float] = [0.0]
+    backend = MemoryRateLimitBackend(max_keys=2, clock=lambda: now[0])
+
+    assert await backend.take("a", rate=1.0, capacity=2) == 0
+    assert await backend.take("a", rate=1.0, capacity=2) == 0
+    assert await backend.take("a", rate=1.0, capacity=2) == pytest.approx(1.0)
+    now[0] = 1.5
+    assert await backend.take("a", rate=1.0, capacity=2) == 0
+
+    # при переполнении вытесняется давно не использованный ключ
+    await backend.take("b", rate=1.0, capacity=2)
+    await backend.take("c", rate=1.0, capacity=2)
+    assert backend.status() == {"keys": 2, "evicted": 1}
+
+    # наполнившиеся корзины удаляются без вытеснения
+    now[0] = 10.0
+    await backend.take("d", rate=1.0, capacity=2)
+    assert backend.status() == {"keys": 1, "evicted": 1}
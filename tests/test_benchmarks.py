@@ -0,0 +1,64 @@
+import numpy as np
+
+from benchmarks import jwt_signing
+from benchmarks import predictions as bench
+from src.api_predictions import predictions_img, service
+from src.api_predictions.cache import prediction_cache
+from src.api_predictions.history import history_writer
+
+
+def test_stand_in_net_is_deterministic() -> None:
+    blob: np.ndarray = np.random.default_rng(1).random((2, 3, 300, 300), dtype=np.float32)
+    net = bench.StandInNet()
+    net.setInput(blob)
+    first: np.ndarray = net.forward()
+    net.setInput(blob.copy())
+
+    assert first.shape == (1, 1, 2 * bench.StandInNet.per_image, 7)
+    assert np.array_equal(first, net.forward())
+    assert bench.synthetic_image(64, 48) == bench.synthetic_image(64, 48)
+
+
+def test_run_benchmarks_reports_all_stages(monkeypatch) -> None:
+    # Подмены модели и кеша откатываются после теста
+    monkeypatch.setattr(predictions_img, "model_registry", predictions_img.model_registry)
+    monkeypatch.setattr(service, "model_registry", service.model_registry)
+    monkeypatch.setattr(prediction_cache, "max_bytes", prediction_cache.max_bytes)
+    monkeypatch.setattr(history_writer, "enabled", history_writer.enabled)
+
+    report: dict = bench.run_benchmarks(iterations=2, sizes=((320, 240),))
+
+    stages: dict = report["320x240"]
+    assert set(stages) == {
+        "decode", "blob", "forward", "postprocess", "draw", "jpeg_encode", "base64",
+        "endpoint_json", "endpoint_base64",
+    }
+    for result in stages.values():
+        assert result["p50_ms"] <= result["p95_ms"] <= result["p99_ms"]
+        assert result["images_per_second"] > 0
+
+
+def test_compare_with_baseline() -> None:
+    baseline: dict = {"640x480": {"decode": {"p50_ms": 10.0}, "forward": {"p50_ms": 0.1}}}
+    report: dict = {
+        "640x480": {
+            "decode": {"p50_ms": 25.0},
+            "forward": {"p50_ms": 0.5},  # в пределах шума
+            "draw": {"p50_ms": 1.0},  # нет в базовой линии
+        }
+    }
+
+    regressions: list[str] = bench.compare_with_baseline(report, baseline, tolerance=1.0)
+    assert len(regressions) == 1
+    assert regressions[0].startswith("640x480 decode")
+    assert not bench.compare_with_baseline(report, baseline, tolerance=2.0)
+
+
+def test_jwt_signing_benchmark_reports_all_algorithms() -> None:
+    report: dict = jwt_signing.run_benchmarks(iterations=3)
+
+    assert set(report) == {"RS256", "ES256", "EdDSA"}
+    for result in report.values():
+        assert result["sign"]["per_second"] > 0
+        assert result["verify"]["per_second"] > 0
+        assert result["token_bytes"] > 0
@@ -7,7 +7,8 @@ import pytest_asyncio
 from pydantic import ValidationError
 from sqlalchemy.engine.row import Row
 
-from src.auth.schemas import UserAddDB, UserUpdateInfo
+from src.auth.cache import profile_cache
+from src.auth.schemas import UserAddDB, UserBase, UserUpdateInfo
 from src.auth.dao import AuthDao, RolesDao
 from src.core.config import settings
 from src.core.models import metadata
@@ -173,3 +174,13 @@ async def test_update(user_update_data, expectation) -> None:
                 assert result[1] == user_update.new_name
             if user_update.new_email:
                 assert result[2] == user_update.new_email
+
+
+@pytest.mark.asyncio
+async def test_update_invalidates_profile_after_commit() -> None:
+    async with db_helper.session_factory() as session:
+        await AuthDao(session).update(UserUpdateInfo(user_id=1, new_name="after_commit"))
+        # Параллельный запрос успел закешировать профиль до коммита
+        profile_cache.put(1, UserBase(name="new_test1", email="test1@test.com"))
+        await session.commit()
+    assert profile_cache.get(1) is None
@@ -1,12 +1,20 @@
+import orjson
 import pytest
 import pytest_asyncio
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
 from httpx import AsyncClient, ASGITransport
+from sqlalchemy import text
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.main import app
 from src.core.models import metadata
-from src.auth.dao import RolesDao
+from src.auth.cache import profile_cache, role_cache
+from src.auth.dao import AuthDao, RevokedTokensDao, RolesDao
+from src.auth.export import user_exporter
+from src.auth.revocation import RevocationStore
+from src.auth.utils import decode_jwt
+from src.auth.throttling import LoginThrottle, MemoryRateLimitBackend
 from src.core.db_helper import DBHelper, db_helper
 
 # Тестовые данные
@@ -74,6 +82,8 @@ async def clear_database():
         await conn.run_sync(metadata.drop_all)
     async with test_db_helper.engine.begin() as conn:
         await conn.run_sync(metadata.create_all)
+    # идентификаторы пользователей в новой базе начинаются заново
+    profile_cache.clear()
 
 
 @pytest.mark.asyncio
@@ -110,6 +120,43 @@ async def test_user_token(async_client):
     return data["access_token"]
 
 
+async def set_role(email: str, role: str) -> int:
+    """Назначает пользователю роль по названию, возвращает его идентификатор"""
+    async with test_db_helper.session_factory() as session:
+        user = await AuthDao(session).find_one_or_none(email)
+        result = await session.execute(
+            text("SELECT id FROM roles WHERE name = :name").bindparams(name=role)
+        )
+        await AuthDao(session).update_role(user_id=user.id, roles_id=result.scalar_one())
+        await session.commit()
+    return user.id
+
+
+async def register_user(async_client, email: str, role: str | None = None) -> None:
+    """Регистрирует пользователя с данными TEST_USER и указанной почтой"""
+    response = await async_client.post("/auth/register/", json={**TEST_USER, "email": email})
+    assert response.status_code == 201
+    if role is not None:
+        await set_role(email, role)
+
+
+@pytest_asyncio.fixture
+async def admin_headers(async_client):
+    """Роли adminishe и user, администратор TEST_USER и заголовок с его токеном"""
+    async with test_db_helper.session_factory() as session:
+        dao = RolesDao(session)
+        await dao.add("adminishe")
+        await dao.add("user")
+        await session.commit()
+    await register_user(async_client, TEST_USER["email"], role="adminishe")
+    response = await async_client.post(
+        "/auth/login/",
+        data={"username": TEST_USER["email"], "password": TEST_USER["password"]},
+    )
+    assert response.status_code == 200
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
 @pytest.mark.asyncio
 async def test_register_user(async_client):
     """Тест регистрации пользователя"""
@@ -153,6 +200,33 @@ async def test_login(async_client):
     assert response.status_code == 401
 
 
+@pytest.mark.asyncio
+async def test_login_throttled(async_client, monkeypatch):
+    """Лишние попытки входа отклоняются с 429 до проверки пароля"""
+    throttle = LoginThrottle(
+        backend=MemoryRateLimitBackend(max_keys=100),
+        ip_per_minute=60,
+        ip_burst=10,
+        account_per_minute=1,
+        account_burst=2,
+    )
+    monkeypatch.setattr("src.auth.views.login_throttle", throttle)
+    form = {"username": TEST_USER["email"], "password": "wrong_password"}
+
+    for _ in range(2):
+        response = await async_client.post("/auth/login/", data=form)
+        assert response.status_code == 401
+    response = await async_client.post("/auth/login/", data=form)
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) > 0
+
+    # другая учётная запись с того же IP не заблокирована
+    response = await async_client.post(
+        "/auth/login/", data={**form, "username": "other@example.com"}
+    )
+    assert response.status_code == 401
+
+
 @pytest.mark.asyncio
 async def test_get_user_info(async_client, test_user_token):
     """Тест получения информации о пользователе"""
@@ -163,12 +237,20 @@ async def test_get_user_info(async_client, test_user_token):
     assert user_data["email"] == TEST_USER["email"]
     assert user_data["name"] == TEST_USER["name"]
 
+    # Повторный запрос отвечает из кеша профилей
+    hits: int = profile_cache.hits
+    response = await async_client.get("/auth/user/me/", headers=headers)
+    assert response.json() == user_data
+    assert profile_cache.hits == hits + 1
+
 
 @pytest.mark.asyncio
 async def test_update_user(async_client, test_user_token):
     """Тест обновления данных пользователя"""
     headers = {"Authorization": f"Bearer {test_user_token}"}
     update_data = {"new_name": "updated_name", "new_email": "updated@example.com"}
+    response = await async_client.get("/auth/user/me/", headers=headers)
+    assert response.json()["name"] == TEST_USER["name"]
 
     # Обновление данных
     response = await async_client.put(
@@ -177,14 +259,121 @@ async def test_update_user(async_client, test_user_token):
     assert response.status_code == 200
     assert response.json() == {"message": "Данные успешно обновлены"}
 
-    # Проверка обновленных данных
+    # Проверка обновленных данных: профиль в кеше сброшен при обновлении
+    hits: int = profile_cache.hits
     response = await async_client.get("/auth/user/me/", headers=headers)
+    assert profile_cache.hits == hits
     assert response.status_code == 200
     user_data = response.json()
     assert user_data["email"] == update_data["new_email"]
     assert user_data["name"] == update_data["new_name"]
 
 
+@pytest.mark.asyncio
+async def test_admin_role_from_token(async_client, admin_headers, monkeypatch):
+    """Роль в access-токене: проверка прав администратора без запроса к базе"""
+    headers: dict = admin_headers
+    payload: dict = decode_jwt(headers["Authorization"].removeprefix("Bearer "))
+    assert payload["role"] == "adminishe"
+    user_id: int = int(payload["sub"])
+
+    async def fail(*args, **kwargs):
+        raise AssertionError("роль не должна запрашиваться из базы")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(AuthDao, "get_roles_user", fail)
+        response = await async_client.get("/auth/all_users_for_admin/", headers=headers)
+    assert response.status_code == 200
+
+    # После смены роли токен больше не даёт прав администратора
+    version: int = role_cache.version
+    async with test_db_helper.session_factory() as session:
+        await AuthDao(session).update_role(user_id=user_id, roles_id=2)
+        # Параллельный запрос успел закешировать старую роль до коммита
+        role_cache.put(user_id, "adminishe", role_cache.version)
+        await session.commit()
+    assert role_cache.version > version
+    assert role_cache.get(user_id) is None
+    response = await async_client.get("/auth/all_users_for_admin/", headers=headers)
+    assert response.status_code == 403
+
+
+@pytest.mark.asyncio
+async def test_users_for_admin_pages(async_client, admin_headers):
+    """Список пользователей по страницам с фильтром по роли и выбором полей"""
+    headers: dict = admin_headers
+    for i in range(1, 5):
+        await register_user(async_client, f"user{i}@example.com", role="user")
+
+    ids: list[int] = []
+    params: dict = {"limit": 2}
+    while True:
+        response = await async_client.get(
+            "/auth/all_users_for_admin/", params=params, headers=headers
+        )
+        assert response.status_code == 200
+        page = response.json()
+        assert len(page["items"]) <= 2
+        ids += [item["id"] for item in page["items"]]
+        if page["next_cursor"] is None:
+            break
+        params["cursor"] = page["next_cursor"]
+    assert ids == [1, 2, 3, 4, 5]
+    assert page["items"][-1] == {
+        "id": 5, "name": TEST_USER["name"], "email": "user4@example.com", "roles_name": "user"
+    }
+
+    response = await async_client.get(
+        "/auth/all_users_for_admin/",
+        params={"role": "adminishe", "fields": "email"},
+        headers=headers,
+    )
+    assert response.json() == {
+        "items": [{"email": TEST_USER["email"]}], "next_cursor": None
+    }
+
+    for params in ({"fields": "password"}, {"limit": 100000}):
+        response = await async_client.get(
+            "/auth/all_users_for_admin/", params=params, headers=headers
+        )
+        assert response.status_code == 422
+
+
+@pytest.mark.asyncio
+async def test_export_users(async_client, admin_headers, monkeypatch):
+    """Выгрузка пользователей потоком в CSV и NDJSON"""
+    monkeypatch.setattr(user_exporter, "_session_factory", test_db_helper.session_factory)
+    monkeypatch.setattr(user_exporter, "yield_per", 2)
+    headers: dict = admin_headers
+    await register_user(async_client, "user1@example.com", role="adminishe")
+    await register_user(async_client, "user2@example.com", role="user")
+    response = await async_client.post(
+        "/auth/register/",
+        json={**TEST_USER, "name": "=HYPERLINK(1)", "email": "user3@example.com"},
+    )
+    assert response.status_code == 201
+
+    response = await async_client.get("/auth/users/export/", headers=headers)
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/csv")
+    assert response.text.splitlines() == [
+        "id,name,email,roles_name",
+        "1,testuser,test@example.com,adminishe",
+        "2,testuser,user1@example.com,adminishe",
+        "3,testuser,user2@example.com,user",
+        # Имя, похожее на формулу, выгружается текстом
+        "4,'=HYPERLINK(1),user3@example.com,adminishe",
+    ]
+
+    response = await async_client.get(
+        "/auth/users/export/", params={"format": "ndjson", "role": "user"}, headers=headers
+    )
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert [orjson.loads(line) for line in response.text.splitlines()] == [
+        {"id": 3, "name": "testuser", "email": "user2@example.com", "roles_name": "user"}
+    ]
+
+
 @pytest.mark.asyncio
 async def test_refresh_token(async_client):
     """Тест обновления токена"""
@@ -206,6 +395,101 @@ async def test_refresh_token(async_client):
     assert response.status_code == 200
     assert "access_token" in response.json()
 
+    # Ротация: выдан новый refresh-токен, старый отозван
+    new_refresh_token = response.json()["refresh_token"]
+    assert new_refresh_token != refresh_token
+    assert decode_jwt(new_refresh_token)["jti"] != decode_jwt(refresh_token)["jti"]
+    response = await async_client.post(
+        "/auth/refresh/", cookies={"refresh_token": refresh_token}
+    )
+    assert response.status_code == 401
+    response = await async_client.post(
+        "/auth/refresh/", cookies={"refresh_token": new_refresh_token}
+    )
+    assert response.status_code == 200
+
+
+@pytest.mark.asyncio
+async def test_refresh_without_cookie(async_client):
+    """Без refresh-токена в cookie - 401, а не ошибка сервера"""
+    response = await async_client.post("/auth/refresh/")
+    assert response.status_code == 401
+
+
+@pytest.mark.asyncio
+async def test_revocation_store_load_and_compact():
+    """Отзывы восстанавливаются из таблицы, истёкшие удаляются"""
+    now = datetime.now(timezone.utc)
+    async with test_db_helper.session_factory() as session:
+        dao = RevokedTokensDao(session)
+        assert await dao.add("active", None, now + timedelta(days=1), now)
+        assert not await dao.add("active", None, now + timedelta(days=1), now)
+        # После повтора транзакция сессии продолжает работать
+        assert await dao.add("expired", None, now - timedelta(seconds=1), now)
+        await session.commit()
+
+    store = RevocationStore(test_db_helper.session_factory, compact_interval=3600)
+    try:
+        assert await store.load() == 1
+    finally:
+        await store.close()
+    assert store.is_revoked("active")
+    assert not store.is_revoked("expired")
+    assert await store.compact() == 1
+
+
+@pytest.mark.asyncio
+async def test_revoke_marks_memory_after_db_write(monkeypatch):
+    """Отзыв, не записанный в базу, не остаётся в памяти"""
+    now = datetime.now(timezone.utc)
+    store = RevocationStore(test_db_helper.session_factory, compact_interval=3600)
+
+    async def fail(*args, **kwargs):
+        raise ConnectionError("база недоступна")
+
+    async with test_db_helper.session_factory() as session:
+        with monkeypatch.context() as patch:
+            patch.setattr(RevokedTokensDao, "add", fail)
+            with pytest.raises(ConnectionError):
+                await store.revoke(session, "lost", None, now + timedelta(days=1))
+        assert not store.is_revoked("lost")
+        assert await store.revoke(session, "lost", None, now + timedelta(days=1))
+        assert store.is_revoked("lost")
+        assert not await store.revoke(session, "lost", None, now + timedelta(days=1))
+        await session.commit()
+
+
+@pytest.mark.asyncio
+async def test_revocation_store_load_retries():
+    """Загрузка повторяется, а после последней неудачи прерывает запуск"""
+    calls: list[int] = []
+
+    def flaky_factory(failures: int):
+        def factory():
+            calls.append(1)
+            if len(calls) <= failures:
+                raise ConnectionError("база недоступна")
+            return test_db_helper.session_factory()
+
+        return factory
+
+    store = RevocationStore(
+        flaky_factory(2), compact_interval=3600, load_attempts=3, load_retry_delay=0
+    )
+    try:
+        await store.load()
+    finally:
+        await store.close()
+    assert len(calls) == 3
+
+    calls.clear()
+    store = RevocationStore(
+        flaky_factory(3), compact_interval=3600, load_attempts=3, load_retry_delay=0
+    )
+    with pytest.raises(ConnectionError):
+        await store.load()
+    assert store.status()["revoked"] == 0
+
 
 if __name__ == "__main__":
     pytest.main(["-v"])
@@ -0,0 +1,1103 @@
+import asyncio
+import io
+import sys
+import threading
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from types import SimpleNamespace
+
+import cv2
+import numpy as np
+import orjson
+import pytest
+import pytest_asyncio
+from fastapi import HTTPException, UploadFile
+from httpx import ASGITransport, AsyncClient
+
+from src.api_predictions import predictions_img, service, video
+from src.api_predictions.backends import (
+    InferenceBackend,
+    OnnxRuntimeBackend,
+    OnnxRuntimeNet,
+    OpenCvDnnBackend,
+    benchmark_backends,
+    default_threads,
+)
+from src.api_predictions.batching import MicroBatcher
+from src.api_predictions.cache import PredictionCache, prediction_cache
+from src.api_predictions.inference_pool import InferencePool
+from src.api_predictions.dao import DetectionsDao, PredictionJobsDao
+from src.api_predictions.history import DetectionHistoryWriter, history_writer
+from src.api_predictions.jobs import job_scheduler
+from src.api_predictions.postprocess import class_ids_for, select_detections
+from src.api_predictions.model_registry import ModelRegistry
+from src.api_predictions.schemas import (
+    Detection,
+    JobAddDB,
+    PredictionParams,
+    PredictionResponse,
+    PredictionResult,
+    VideoParams,
+)
+from src.api_predictions.tiling import Tile, merge_tile_detections, plan_tiles
+from src.api_predictions.uploads import (
+    read_image_header,
+    read_image_upload,
+    reduced_decode_flag,
+)
+from src.auth.utils import encode_jwt
+from src.core.config import settings
+from src.core.db_helper import DBHelper
+from src.core.metrics import metrics
+from src.core.models import metadata
+from src.main import app
+
+
+class FakeNet:
+    """Детерминированная замена MobileNet-SSD: на каждое изображение два объекта"""
+
+    def __init__(self) -> None:
+        self.batch: int = 1
+        self.forward_calls: int = 0
+
+    def setInput(self, blob: np.ndarray) -> None:
+        self.batch = blob.shape[0]
+
+    def forward(self) -> np.ndarray:
+        self.forward_calls += 1
+        rows: list[list[float]] = []
+        for image_id in range(self.batch):
+            rows.append([image_id, 15, 0.9, 0.1, 0.1, 0.5, 0.5])  # person
+            rows.append([image_id, 7, 0.3, 0.6, 0.6, 0.9, 0.9])  # car
+        return np.array(rows, dtype=np.float32).reshape(1, 1, len(rows), 7)
+
+
+class CountingLoader:
+    def __init__(self) -> None:
+        self.calls: int = 0
+
+    def __call__(self) -> FakeNet:
+        self.calls += 1
+        return FakeNet()
+
+
+def make_image(width: int = 640, height: int = 480) -> bytes:
+    img = np.full((height, width, 3), 127, dtype=np.uint8)
+    _, buffer = cv2.imencode(".jpg", img)
+    return buffer.tobytes()
+
+
+@pytest.fixture
+def fake_registry(monkeypatch) -> ModelRegistry:
+    registry = ModelRegistry(CountingLoader(), version="v1")
+    monkeypatch.setattr(predictions_img, "model_registry", registry)
+    monkeypatch.setattr(service, "model_registry", registry)
+    monkeypatch.setattr(history_writer, "enabled", False)
+    prediction_cache.clear()
+    return registry
+
+
+def test_registry_loads_once_and_warms_up() -> None:
+    loader = CountingLoader()
+    registry = ModelRegistry(loader)
+    assert registry.status()["state"] == "cold"
+
+    first = registry.get_net()
+    second = registry.get_net()
+
+    assert first is second
+    assert loader.calls == 1
+    assert first.forward_calls == 1  # прогрев
+    status: dict = registry.status()
+    assert status["state"] == "warm"
+    assert status["load_seconds"] is not None
+
+
+def test_registry_gives_each_worker_own_net() -> None:
+    loader = CountingLoader()
+    registry = ModelRegistry(loader)
+    # Сети для потоков пула создаются и прогреваются при загрузке
+    registry.load(workers=2)
+    assert loader.calls == 2
+    assert registry.status()["workers"] == 0
+    barrier = threading.Barrier(2)
+
+    def worker_net(_) -> FakeNet:
+        barrier.wait(5)  # оба обращения из разных потоков
+        return registry.get_net()
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        nets = list(pool.map(worker_net, range(2)))
+    assert nets[0] is not nets[1]
+    assert all(net.forward_calls == 1 for net in nets)
+    assert loader.calls == 2
+    assert registry.status()["spares"] == 0
+
+    main_net = registry.get_net()
+    assert main_net is not nets[0] and main_net is not nets[1]
+    assert main_net is registry.get_net()
+    assert loader.calls == 3
+    assert registry.status()["workers"] == 3
+
+
+@pytest.mark.asyncio
+async def test_run_prediction_uses_registry(fake_registry) -> None:
+    result: PredictionResult = await service.run_prediction(
+        make_image(), PredictionParams()
+    )
+
+    assert [d.class_name for d in result.detections] == ["person"]
+    assert result.detections[0].box == [64, 48, 320, 240]
+    assert fake_registry.status()["state"] == "warm"
+    await service.run_prediction(make_image(), PredictionParams())
+    # сеть загружается один раз на каждый поток инференса
+    assert fake_registry._loader.calls == fake_registry.status()["workers"]
+    assert fake_registry._loader.calls <= settings.predict_workers
+
+
+@pytest.mark.asyncio
+async def test_inference_pool_rejects_when_queue_is_full() -> None:
+    pool = InferencePool(workers=1, queue_size=1, retry_after=3)
+    release = threading.Event()
+    try:
+        running = asyncio.ensure_future(pool.run(release.wait))
+        queued = asyncio.ensure_future(pool.run(lambda: "done"))
+        await asyncio.sleep(0)
+
+        with pytest.raises(HTTPException) as exc_info:
+            await pool.run(lambda: "rejected")
+        assert exc_info.value.status_code == 503
+        assert exc_info.value.headers == {"Retry-After": "3"}
+
+        release.set()
+        assert await running is True
+        assert await queued == "done"
+        assert pool.status()["pending"] == 0
+    finally:
+        release.set()
+        pool.shutdown()
+
+
+@pytest.mark.parametrize("content", (b"", b"not an image"))
+def test_decode_image_rejects_invalid_bytes(content: bytes) -> None:
+    with pytest.raises(HTTPException) as exc_info:
+        predictions_img.decode_image(content)
+    assert exc_info.value.status_code == 400
+
+
+def test_decode_image_from_memory() -> None:
+    img: np.ndarray = predictions_img.decode_image(make_image(320, 200))
+    assert img.shape == (200, 320, 3)
+
+
+def test_detect_objects_splits_batch_per_image(fake_registry) -> None:
+    images = [np.zeros((100, 200, 3), np.uint8), np.zeros((50, 50, 3), np.uint8)]
+    results = predictions_img.detect_objects(images)
+
+    assert len(results) == 2
+    for image_id, (detections, version) in enumerate(results):
+        assert version == "v1"
+        assert detections.shape == (1, 1, 2, 7)
+        assert (detections[0, 0, :, 0] == image_id).all()
+
+
+async def run_inline(func, *args):
+    return func(*args)
+
+
+@pytest.mark.asyncio
+async def test_micro_batcher_groups_concurrent_requests() -> None:
+    batch_sizes: list[int] = []
+
+    def forward(images: list[np.ndarray]) -> list[np.ndarray]:
+        batch_sizes.append(len(images))
+        return [image * 2 for image in images]
+
+    batcher = MicroBatcher(forward, run_inline, max_batch_size=3, max_wait_ms=50)
+    results = await asyncio.gather(
+        *(batcher.detect(np.array([i])) for i in range(5))
+    )
+
+    assert [int(r[0]) for r in results] == [0, 2, 4, 6, 8]
+    assert batch_sizes == [3, 2]
+    status: dict = batcher.status()
+    assert status["batches"] == 2
+    assert status["images"] == 5
+    assert not batcher._flushes
+    await batcher.stop()
+
+
+@pytest.mark.asyncio
+async def test_micro_batcher_stop_waits_for_flushes() -> None:
+    release = asyncio.Event()
+
+    async def slow_execute(func, *args):
+        await release.wait()
+        return func(*args)
+
+    batcher = MicroBatcher(
+        lambda images: images, slow_execute, max_batch_size=2, max_wait_ms=1
+    )
+    detections = asyncio.gather(*(batcher.detect(np.array([i])) for i in range(2)))
+    for _ in range(100):
+        if batcher._flushes:
+            break
+        await asyncio.sleep(0.001)
+    assert len(batcher._flushes) == 1
+
+    stopping = asyncio.ensure_future(batcher.stop())
+    await asyncio.sleep(0.01)
+    assert not stopping.done()
+    release.set()
+    await stopping
+    assert [int(r[0]) for r in await detections] == [0, 1]
+    assert not batcher._flushes
+
+
+@pytest.mark.asyncio
+async def test_micro_batcher_propagates_errors() -> None:
+    def forward(images: list[np.ndarray]) -> list[np.ndarray]:
+        raise RuntimeError("forward failed")
+
+    batcher = MicroBatcher(forward, run_inline, max_batch_size=2, max_wait_ms=1)
+    with pytest.raises(RuntimeError, match="forward failed"):
+        await batcher.detect(np.zeros(1))
+
+
+def make_detections(rows: list[list[float]]) -> np.ndarray:
+    return np.array(rows, dtype=np.float32).reshape(1, 1, len(rows), 7)
+
+
+def test_select_detections_threshold_classes_and_top_k() -> None:
+    detections = make_detections(
+        [
+            [0, 15, 0.7, 0.0, 0.0, 0.5, 0.5],
+            [0, 7, 0.95, 0.5, 0.5, 1.2, 1.1],  # выходит за границы
+            [0, 15, 0.9, 0.1, 0.1, 0.2, 0.2],
+            [0, 12, 0.4, 0.1, 0.1, 0.2, 0.2],
+        ]
+    )
+
+    selected = select_detections(detections, width=100, height=50)
+    assert selected.class_ids.tolist() == [7, 15, 15]
+    assert selected.boxes[0].tolist() == [50, 25, 99, 49]
+
+    selected = select_detections(
+        detections, 100, 50, class_ids=class_ids_for(["person"]), max_detections=1
+    )
+    assert selected.class_ids.tolist() == [15]
+    assert selected.scores.tolist() == pytest.approx([0.9])
+
+    selected = select_detections(detections, 100, 50, confidence=0.3)
+    assert selected.scores.size == 4
+
+
+def test_select_detections_nms_is_per_class() -> None:
+    detections = make_detections(
+        [
+            [0, 15, 0.9, 0.1, 0.1, 0.5, 0.5],
+            [0, 15, 0.8, 0.11, 0.11, 0.5, 0.5],
+            [0, 7, 0.85, 0.1, 0.1, 0.5, 0.5],
+        ]
+    )
+    selected = select_detections(detections, 100, 100, nms_threshold=0.5)
+    assert selected.class_ids.tolist() == [15, 7]
+
+
+@pytest.mark.asyncio
+async def test_predict_endpoint_applies_params(fake_registry) -> None:
+    token: str = encode_jwt({"sub": "1"}, "access")
+    async with AsyncClient(
+        transport=ASGITransport(app=app), base_url="http://testserver"
+    ) as client:
+        response = await client.post(
+            "/predictions/predict/",
+            params={"confidence": 0.2, "classes": ["car", "dog"]},
+            files={"file": ("test.jpg", make_image(), "image/jpeg")},
+            headers={"Authorization": f"Bearer {token}"},
+        )
+        assert response.status_code == 200
+        assert [d["class_name"] for d in response.json()["detections"]] == ["car"]
+
+        response = await client.post(
+            "/predictions/predict/",
+            params={"classes": ["unicorn"]},
+            files={"file": ("test.jpg", make_image(), "image/jpeg")},
+            headers={"Authorization": f"Bearer {token}"},
+        )
+        assert response.status_code == 422
+
+
+@pytest.mark.asyncio
+async def test_predict_endpoint_response_modes(fake_registry) -> None:
+    token: str = encode_jwt({"sub": "1"}, "access")
+    headers: dict = {"Authorization": f"Bearer {token}"}
+    files: dict = {"file": ("test.jpg", make_image(), "image/jpeg")}
+    async with AsyncClient(
+        transport=ASGITransport(app=app), base_url="http://testserver"
+    ) as client:
+        response = await client.post(
+            "/predictions/predict/", params={"output": "json"}, files=files, headers=headers
+        )
+        assert response.status_code == 200
+        assert response.json() == {
+            "detections": [
+                {"class_name": "person", "confidence": pytest.approx(0.9), "box": [64, 48, 320, 240]}
+            ],
+            "model_version": "v1",
+        }
+
+        response = await client.post(
+            "/predictions/predict/",
+            params={"output": "jpeg", "max_dimension": 320, "jpeg_quality": 50},
+            files=files,
+            headers=headers,
+        )
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "image/jpeg"
+        assert '"class_name":"person"' in response.headers["x-detections"]
+        img: np.ndarray = predictions_img.decode_image(response.content)
+        assert img.shape == (240, 320, 3)
+
+        response = await client.post("/predictions/predict/", files=files, headers=headers)
+        assert response.status_code == 200
+        assert response.json()["processed_image"]
+
+
+def make_result(image_size: int = 0) -> PredictionResult:
+    return PredictionResult(
+        detections=[Detection(class_name="person", confidence=0.9, box=[0, 0, 1, 1])],
+        image=b"x" * image_size or None,
+    )
+
+
+@pytest.mark.asyncio
+async def test_prediction_cache_key_depends_on_bytes_and_params() -> None:
+    cache = PredictionCache(max_bytes=1000, ttl_seconds=60)
+    key: str = await cache.make_key(b"image", PredictionParams())
+    assert key == await cache.make_key(b"image", PredictionParams())
+    assert key != await cache.make_key(b"image2", PredictionParams())
+    assert key != await cache.make_key(b"image", PredictionParams(output="json"))
+
+
+def test_prediction_cache_evicts_least_recently_used_by_size() -> None:
+    cache = PredictionCache(max_bytes=2000, ttl_seconds=60)
+    cache.put("a", make_result(500))
+    cache.put("b", make_result(500))
+    assert cache.get("a") is not None  # "b" становится самым старым
+    cache.put("c", make_result(500))
+
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.get("c") is not None
+    assert cache.status()["evictions"] == 1
+    assert cache.status()["bytes"] <= 2000
+
+
+def test_prediction_cache_expires_entries(monkeypatch) -> None:
+    cache = PredictionCache(max_bytes=2000, ttl_seconds=10)
+    now: list[float] = [100.0]
+    monkeypatch.setattr("src.api_predictions.cache.monotonic", lambda: now[0])
+    cache.put("a", make_result())
+    now[0] = 111.0
+
+    assert cache.get("a") is None
+    assert cache.status()["expirations"] == 1
+
+
+@pytest.mark.asyncio
+async def test_prediction_cache_single_flight() -> None:
+    cache = PredictionCache(max_bytes=10_000, ttl_seconds=60)
+    calls: list[int] = []
+
+    async def compute() -> PredictionResult:
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return make_result()
+
+    results = await asyncio.gather(*(cache.get_or_compute("k", compute) for _ in range(5)))
+    assert len(calls) == 1
+    assert all(result is results[0] for result in results)
+    assert await cache.get_or_compute("k", compute) is results[0]
+    status: dict = cache.status()
+    assert (status["misses"], status["coalesced"], status["hits"]) == (1, 4, 1)
+
+
+@pytest.mark.asyncio
+async def test_prediction_cache_does_not_store_errors() -> None:
+    cache = PredictionCache(max_bytes=10_000, ttl_seconds=60)
+
+    async def fail() -> PredictionResult:
+        raise HTTPException(status_code=400, detail="no objects")
+
+    for _ in range(2):
+        with pytest.raises(HTTPException):
+            await cache.get_or_compute("k", fail)
+    assert cache.status()["misses"] == 2
+
+
+def make_zip(files: dict[str, bytes]) -> bytes:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        for name, content in files.items():
+            archive.writestr(name, content)
+    return buffer.getvalue()
+
+
+def corrupt_zip_entry(data: bytes, name: str) -> bytes:
+    """Портит сжатые данные файла архива, не трогая каталог"""
+    info: zipfile.ZipInfo = zipfile.ZipFile(io.BytesIO(data)).getinfo(name)
+    start: int = info.header_offset + 30 + len(info.filename.encode()) + len(info.extra)
+    corrupted = bytearray(data)
+    corrupted[start : start + info.compress_size] = b"\xff" * info.compress_size
+    return bytes(corrupted)
+
+
+@pytest.mark.asyncio
+async def test_predict_batch_endpoint_streams_ndjson(fake_registry) -> None:
+    token: str = encode_jwt({"sub": "1"}, "access")
+    headers: dict = {"Authorization": f"Bearer {token}"}
+    async with AsyncClient(
+        transport=ASGITransport(app=app), base_url="http://testserver"
+    ) as client:
+        response = await client.post(
+            "/predictions/predict_batch/",
+            params={"output": "json"},
+            files=[
+                ("files", ("a.jpg", make_image(), "image/jpeg")),
+                ("files", ("broken.jpg", b"broken", "image/jpeg")),
+                (
+                    "files",
+                    (
+                        "images.zip",
+                        make_zip({"b.jpg": make_image(320, 240), "c.jpg": make_image()}),
+                        "application/zip",
+                    ),
+                ),
+            ],
+            headers=headers,
+        )
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "application/x-ndjson"
+        lines: list[dict] = [orjson.loads(line) for line in response.text.splitlines()]
+
+        by_name: dict = {line["filename"]: line for line in lines}
+        assert sorted(line["index"] for line in lines) == [0, 1, 2, 3]
+        assert by_name["broken.jpg"]["status_code"] == 415
+        assert by_name["b.jpg"]["detections"][0]["box"] == [32, 24, 160, 120]
+        assert "processed_image" not in by_name["c.jpg"]
+
+        response = await client.post(
+            "/predictions/predict_batch/",
+            files=[("files", ("bad.zip", b"not a zip", "application/zip"))],
+            headers=headers,
+        )
+        assert response.status_code == 400
+
+        # Повреждённый файл архива даёт строку с ошибкой, остальные обрабатываются
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+            archive.writestr("ok.jpg", make_image())
+            archive.writestr("corrupt.jpg", make_image())
+        response = await client.post(
+            "/predictions/predict_batch/",
+            params={"output": "json"},
+            files=[
+                (
+                    "files",
+                    (
+                        "images.zip",
+                        corrupt_zip_entry(buffer.getvalue(), "corrupt.jpg"),
+                        "application/zip",
+                    ),
+                )
+            ],
+            headers=headers,
+        )
+        assert response.status_code == 200
+        by_name = {
+            line["filename"]: line
+            for line in map(orjson.loads, response.text.splitlines())
+        }
+        assert by_name["corrupt.jpg"]["status_code"] == 400
+        assert by_name["ok.jpg"]["status_code"] == 200
+
+
+def make_video(path, frames: int = 25, fps: float = 10.0) -> bytes:
+    writer = cv2.VideoWriter(str(path), cv2.VideoWriter_fourcc(*"MJPG"), fps, (64, 48))
+    for i in range(frames):
+        writer.write(np.full((48, 64, 3), i * 10 % 255, dtype=np.uint8))
+    writer.release()
+    return path.read_bytes()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "params, expected_frames",
+    (
+        ({"frame_stride": 5}, [0, 5, 10, 15, 20]),
+        ({"target_fps": 2}, [0, 5, 10, 15, 20]),
+        ({"frame_stride": 3, "max_frames": 2}, [0, 3]),
+    ),
+)
+async def test_predict_video_endpoint_samples_frames(
+    fake_registry, tmp_path, params, expected_frames
+) -> None:
+    video: bytes = make_video(tmp_path / "clip.avi")
+    token: str = encode_jwt({"sub": "1"}, "access")
+    async with AsyncClient(
+        transport=ASGITransport(app=app), base_url="http://testserver"
+    ) as client:
+        response = await client.post(
+            "/predictions/predict_video/",
+            params=params,
+            files={"file": ("clip.avi", video, "video/x-msvideo")},
+            headers={"Authorization": f"Bearer {token}"},
+        )
+    assert response.status_code == 200
+    lines: list[dict] = [orjson.loads(line) for line in response.text.splitlines()]
+    assert [line["frame"] for line in lines] == expected_frames
+    assert lines[1]["timestamp_ms"] == pytest.approx(expected_frames[1] * 100)
+    assert lines[0]["detections"][0]["class_name"] == "person"
+
+
+@pytest.mark.asyncio
+async def test_predict_video_endpoint_sse_and_errors(fake_registry, tmp_path) -> None:
+    video: bytes = make_video(tmp_path / "clip.avi", frames=3)
+    token: str = encode_jwt({"sub": "1"}, "access")
+    headers: dict = {"Authorization": f"Bearer {token}"}
+    async with AsyncClient(
+        transport=ASGITransport(app=app), base_url="http://testserver"
+    ) as client:
+        response = await client.post(
+            "/predictions/predict_video/",
+            params={"format": "sse"},
+            files={"file": ("clip.avi", video, "video/x-msvideo")},
+            headers=headers,
+        )
+        assert response.headers["content-type"].startswith("text/event-stream")
+        events: list[str] = [
+            block.split("\n")[0] for block in response.text.strip().split("\n\n")
+        ]
+        assert events == ["event: frame"] * 3 + ["event: end"]
+
+        response = await client.post(
+            "/predictions/predict_video/",
+            files={"file": ("clip.avi", b"not a video", "video/x-msvideo")},
+            headers=headers,
+        )
+        assert response.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_video_stream_releases_capture_after_frames(monkeypatch, tmp_path) -> None:
+    """При отключении клиента capture освобождается только после чтения кадров"""
+    started, proceed = threading.Event(), threading.Event()
+    events: list[str] = []
+
+    def slow_frames(capture, sampler, params, next_index, count):
+        started.set()
+        proceed.wait(5)
+        events.append("frames")
+        return [], next_index, True
+
+    class FakeCapture:
+        def get(self, prop) -> float:
+            return 10.0
+
+        def release(self) -> None:
+            events.append("release")
+
+    monkeypatch.setattr(video, "process_next_frames", slow_frames)
+    path: Path = tmp_path / "clip.avi"
+    path.write_bytes(b"video")
+    stream = video.stream_video_predictions(FakeCapture(), path, VideoParams())
+    task = asyncio.ensure_future(anext(stream))
+    await asyncio.to_thread(started.wait, 5)
+
+    task.cancel()
+    await asyncio.sleep(0.05)
+    assert events == []
+    assert path.exists()
+    proceed.set()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    assert events == ["frames", "release"]
+    assert not path.exists()
+
+
+def test_read_image_header_sizes() -> None:
+    _, png = cv2.imencode(".png", np.zeros((30, 40, 3), np.uint8))
+
+    assert read_image_header(make_image(640, 480))[:] == ("jpeg", 640, 480)
+    assert read_image_header(png.tobytes())[:] == ("png", 40, 30)
+    assert read_image_header(b"GIF89a...") is None
+
+
+@pytest.mark.parametrize(
+    "width, target, factor",
+    ((4000, 600, 4), (4000, 2048, 1), (5000, 600, 8), (640, 600, 1), (1300, 600, 2)),
+)
+def test_reduced_decode_flag(width: int, target: int, factor: int) -> None:
+    header = read_image_header(make_image(width, 100))
+    assert reduced_decode_flag(header, target)[1] == factor
+
+
+def test_decode_upload_reduces_large_jpeg() -> None:
+    decoded = predictions_img.decode_upload(make_image(4000, 3000), 600)
+
+    assert decoded.image.shape == (750, 1000, 3)
+    assert (decoded.width, decoded.height) == (4000, 3000)
+
+
+@pytest.mark.asyncio
+async def test_predict_endpoint_upload_limits(fake_registry, monkeypatch) -> None:
+    token: str = encode_jwt({"sub": "1"}, "access")
+    headers: dict = {"Authorization": f"Bearer {token}"}
+    async with AsyncClient(
+        transport=ASGITransport(app=app), base_url="http://testserver"
+    ) as client:
+        response = await client.post(
+            "/predictions/predict/",
+            params={"output": "json"},
+            files={"file": ("big.jpg", make_image(4000, 3000), "image/jpeg")},
+            headers=headers,
+        )
+        assert response.status_code == 200
+        # Рамки в координатах исходного изображения
+        assert response.json()["detections"][0]["box"] == [400, 300, 2000, 1500]
+
+        response = await client.post(
+            "/predictions/predict/",
+            files={"file": ("a.txt", b"hello", "text/plain")},
+            headers=headers,
+        )
+        assert response.status_code == 415
+
+        response = await client.post(
+            "/predictions/predict/",
+            files={"file": ("a.bin", b"hello", "application/octet-stream")},
+            headers=headers,
+        )
+        assert response.status_code == 415
+
+        monkeypatch.setattr(settings, "predict_max_upload_bytes", 1000)
+        response = await client.post(
+            "/predictions/predict/",
+            files={"file": ("a.jpg", make_image(), "image/jpeg")},
+            headers=headers,
+        )
+        assert response.status_code == 413
+
+
+@pytest.mark.asyncio
+async def test_read_image_upload_checks_first_chunk() -> None:
+    # Размер не заявлен, а лимит меньше первого прочитанного блока
+    content: bytes = make_image()
+    upload = UploadFile(io.BytesIO(content), filename="a.jpg")
+
+    with pytest.raises(HTTPException) as error:
+        await read_image_upload(upload, max_bytes=len(content) - 1)
+    assert error.value.status_code == 413
+
+    await upload.seek(0)
+    assert await read_image_upload(upload, max_bytes=len(content)) == content
+
+
+class FakeBackend(InferenceBackend):
+    name = "fake"
+
+    def __call__(self) -> FakeNet:
+        return FakeNet()
+
+
+class BrokenBackend(InferenceBackend):
+    name = "broken"
+
+    def __call__(self) -> FakeNet:
+        raise RuntimeError("нет модели")
+
+
+def test_benchmark_backends_reports_latency_and_errors() -> None:
+    results: dict = benchmark_backends(
+        [FakeBackend(threads=2), BrokenBackend(threads=1)], iterations=5, batch_size=4
+    )
+
+    fake: dict = results["fake"]
+    assert fake["threads"] == 2
+    assert fake["batch_size"] == 4
+    assert fake["p50_ms"] <= fake["p95_ms"]
+    assert fake["images_per_second"] > 0
+    assert results["broken"] == {"name": "broken", "threads": 1, "error": "нет модели"}
+
+
+def test_backend_thread_settings(monkeypatch, tmp_path) -> None:
+    monkeypatch.setattr(settings, "web_concurrency", 1)
+    cpus: int = default_threads()
+    monkeypatch.setattr(settings, "web_concurrency", cpus * 2)
+    assert default_threads() == 1
+
+    previous: int = cv2.getNumThreads()
+    backend = OpenCvDnnBackend(tmp_path / "a", tmp_path / "b", threads=1)
+    try:
+        backend.configure()
+        assert cv2.getNumThreads() == 1
+    finally:
+        cv2.setNumThreads(previous)
+    assert backend.describe() == {"name": "opencv", "threads": 1, "target": "cpu"}
+
+
+def test_onnxruntime_backend(monkeypatch) -> None:
+    class FakeSession:
+        def get_inputs(self) -> list:
+            return [type("Input", (), {"name": "data"})()]
+
+        def run(self, outputs, feeds: dict) -> list:
+            blob: np.ndarray = feeds["data"]
+            return [np.zeros((blob.shape[0], 2, 7), dtype=np.float32)]
+
+    net = OnnxRuntimeNet(FakeSession())
+    net.setInput(np.zeros((3, 3, 300, 300), dtype=np.float32))
+    assert net.forward().shape == (1, 1, 6, 7)
+
+    # Без установленного onnxruntime бэкенд сообщает понятную ошибку
+    monkeypatch.setitem(sys.modules, "onnxruntime", None)
+    with pytest.raises(RuntimeError, match="onnxruntime"):
+        OnnxRuntimeBackend(Path("model.onnx"), threads=1)()
+
+
+@pytest.mark.parametrize(
+    "shape, valid",
+    (
+        ([1, 1, "N", 7], True),
+        (["N", 7], True),
+        ([1, 3000, 4], False),  # сырые рамки без DetectionOutput
+        ([1, 3000, 21], False),
+        ([7], False),
+    ),
+)
+def test_onnxruntime_backend_checks_outputs(monkeypatch, shape, valid) -> None:
+    class FakeSession:
+        def __init__(self, *args, **kwargs) -> None:
+            pass
+
+        def get_inputs(self) -> list:
+            return [SimpleNamespace(name="data")]
+
+        def get_outputs(self) -> list:
+            return [SimpleNamespace(name="out", shape=shape)]
+
+    class Options:
+        pass
+
+    fake_ort = SimpleNamespace(
+        SessionOptions=Options,
+        ExecutionMode=SimpleNamespace(ORT_SEQUENTIAL=0),
+        GraphOptimizationLevel=SimpleNamespace(ORT_ENABLE_ALL=99),
+        InferenceSession=FakeSession,
+    )
+    monkeypatch.setitem(sys.modules, "onnxruntime", fake_ort)
+    backend = OnnxRuntimeBackend(Path("model.onnx"), threads=1)
+    if valid:
+        assert isinstance(backend(), OnnxRuntimeNet)
+    else:
+        with pytest.raises(RuntimeError, match=r"\[1, 1, N, 7\]"):
+            backend()
+
+
+def test_registry_reload_swaps_version_atomically() -> None:
+    registry = ModelRegistry(CountingLoader(), version="v1")
+    old = registry.acquire()
+    assert old.version == "v1"
+
+    new_loader = CountingLoader()
+    registry.reload(new_loader, "v2", workers=2)
+    assert new_loader.calls == 2  # сети заранее прогреты для потоков
+
+    # Начатый forward дорабатывает на старой сети
+    old.net.setInput(np.zeros((1, 3, 300, 300), np.float32))
+    assert old.net.forward().shape == (1, 1, 2, 7)
+
+    current = registry.acquire()
+    assert current.version == "v2"
+    assert current.net is not old.net
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        assert pool.submit(registry.acquire).result().version == "v2"
+    assert new_loader.calls == 2
+    assert registry.status()["version"] == "v2"
+    assert registry.status()["workers"] == 2
+
+
+@pytest.mark.asyncio
+async def test_start_model_reload(fake_registry, monkeypatch, tmp_path) -> None:
+    with pytest.raises(HTTPException) as exc_info:
+        service.start_model_reload("../v2")
+    assert exc_info.value.status_code == 400
+
+    monkeypatch.setattr(settings, "predict_models_dir", tmp_path)
+    with pytest.raises(HTTPException) as exc_info:
+        service.start_model_reload("v2")
+    assert exc_info.value.status_code == 404
+
+    version_dir = tmp_path / "v2"
+    version_dir.mkdir()
+    (version_dir / predictions_img.CONFIG_PATH.name).write_text("proto")
+    (version_dir / predictions_img.MODEL_PATH.name).write_bytes(b"weights")
+    monkeypatch.setattr(settings, "predict_backend", "opencv")
+    monkeypatch.setattr(service, "backend_for_version", lambda version: CountingLoader())
+
+    service.start_model_reload("v2")
+    with pytest.raises(HTTPException) as exc_info:
+        service.start_model_reload("v2")
+    assert exc_info.value.status_code == 409
+    await service._reload_task
+    assert fake_registry.version == "v2"
+
+    # Кеш не отдаёт результаты прежней версии
+    first = await prediction_cache.make_key(b"image", PredictionParams(), "v1")
+    assert first != await prediction_cache.make_key(b"image", PredictionParams(), "v2")
+
+
+@pytest_asyncio.fixture
+async def jobs_db(monkeypatch, tmp_path):
+    helper = DBHelper(url=f"sqlite+aiosqlite:///{tmp_path / 'jobs.db'}")
+    async with helper.engine.begin() as conn:
+        await conn.run_sync(metadata.create_all)
+    monkeypatch.setattr(job_scheduler, "_session_factory", helper.session_factory)
+    yield helper
+    job_scheduler.stop()
+    await helper.engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_prediction_jobs_api(fake_registry, jobs_db) -> None:
+    headers: dict = {"Authorization": f"Bearer {encode_jwt({'sub': '1'}, 'access')}"}
+    async with AsyncClient(
+        transport=ASGITransport(app=app), base_url="http://testserver"
+    ) as client:
+        response = await client.post(
+            "/predictions/jobs/",
+            params={"output": "json"},
+            files={"file": ("test.jpg", make_image(), "image/jpeg")},
+            headers=headers,
+        )
+        assert response.status_code == 202
+        job: dict = response.json()
+        assert job["status"] == "queued"
+
+        for _ in range(100):
+            response = await client.get(f"/predictions/jobs/{job['id']}", headers=headers)
+            assert response.status_code == 200
+            if response.json()["status"] == "done":
+                break
+            await asyncio.sleep(0.01)
+        data: dict = response.json()
+        assert data["status"] == "done"
+        assert data["status_code"] == 200
+        assert data["result"]["detections"][0]["class_name"] == "person"
+        assert "processed_image" not in data["result"]
+
+        # Чужие задачи не видны
+        other: dict = {"Authorization": f"Bearer {encode_jwt({'sub': '2'}, 'access')}"}
+        response = await client.get(f"/predictions/jobs/{job['id']}", headers=other)
+        assert response.status_code == 404
+
+        response = await client.post(
+            "/predictions/jobs/",
+            files={"file": ("bad.jpg", b"\xff\xd8\xff broken", "image/jpeg")},
+            headers=headers,
+        )
+        job_id: str = response.json()["id"]
+        for _ in range(100):
+            data = (await client.get(f"/predictions/jobs/{job_id}", headers=headers)).json()
+            if data["status"] == "failed":
+                break
+            await asyncio.sleep(0.01)
+        assert data["status"] == "failed"
+        assert data["status_code"] == 400
+
+        response = await client.post(
+            "/predictions/jobs/",
+            params={"output": "jpeg"},
+            files={"file": ("test.jpg", make_image(), "image/jpeg")},
+            headers=headers,
+        )
+        assert response.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_prediction_jobs_recover_and_limit(jobs_db, monkeypatch) -> None:
+    now: datetime = datetime.now(timezone.utc)
+    old: datetime = now - timedelta(hours=2)
+    # Задача остановленного процесса, задача другого живого процесса,
+    # своя задача в памяти, отметку которой обновит проверка,
+    # и своя задача, потерянная из-за ошибки записи
+    jobs: tuple[tuple[str, str, datetime], ...] = (
+        ("stale", "stopped", old),
+        ("alive", "other", now),
+        ("own", job_scheduler.owner, old),
+        ("orphan", job_scheduler.owner, old),
+    )
+    monkeypatch.setattr(job_scheduler, "_held", {"own"})
+    async with jobs_db.session_factory() as session:
+        for job_id, owner, heartbeat_at in jobs:
+            await PredictionJobsDao(session).add(
+                JobAddDB(
+                    id=job_id,
+                    user_id=1,
+                    status="queued",
+                    filename="a.jpg",
+                    params=PredictionParams().model_dump_json(),
+                    created_at=old,
+                    owner=owner,
+                    heartbeat_at=heartbeat_at,
+                )
+            )
+        await session.commit()
+
+    assert await job_scheduler.sweep() == 2
+    assert await job_scheduler.sweep() == 0
+    for job_id in ("stale", "orphan"):
+        info = await job_scheduler.get(job_id, 1)
+        assert info.status == "failed"
+        assert info.status_code == 500
+    assert (await job_scheduler.get("alive", 1)).status == "queued"
+    assert (await job_scheduler.get("own", 1)).status == "queued"
+
+    with monkeypatch.context() as patch:
+        patch.setattr(job_scheduler, "max_pending", 0)
+        with pytest.raises(HTTPException) as exc_info:
+            await job_scheduler.submit(b"image", "a.jpg", PredictionParams(), 1)
+        assert exc_info.value.status_code == 503
+
+    # Очередь ограничена и объёмом загруженных изображений
+    monkeypatch.setattr(job_scheduler, "max_pending_bytes", 4)
+    with pytest.raises(HTTPException) as exc_info:
+        await job_scheduler.submit(b"image", "a.jpg", PredictionParams(), 1)
+    assert exc_info.value.status_code == 503
+    assert job_scheduler.status()["pending_bytes"] == 0
+
+
+@pytest.mark.asyncio
+async def test_prediction_job_failed_when_state_not_saved(
+    fake_registry, jobs_db, monkeypatch
+) -> None:
+    """Ошибка записи состояния завершает задачу ошибкой, а не оставляет в очереди"""
+
+    async def fail(*args, **kwargs):
+        raise HTTPException(status_code=500, detail="база недоступна")
+
+    monkeypatch.setattr(PredictionJobsDao, "mark_running", fail)
+    monkeypatch.setattr(job_scheduler, "retry_after", 0)
+    job = await job_scheduler.submit(make_image(), "a.jpg", PredictionParams(), 1)
+    for _ in range(100):
+        info = await job_scheduler.get(job.id, 1)
+        if info.status == "failed":
+            break
+        await asyncio.sleep(0.01)
+    assert info.status == "failed"
+    assert info.status_code == 500
+    assert job_scheduler.status()["held"] == 0
+
+
+@pytest.mark.asyncio
+async def test_history_writer_flushes_in_bulk(jobs_db) -> None:
+    writer = DetectionHistoryWriter(
+        jobs_db.session_factory, flush_rows=3, flush_interval=60, max_buffer=100
+    )
+    person = Detection(class_name="person", confidence=0.9, box=[1, 2, 3, 4])
+    car = Detection(class_name="car", confidence=0.7, box=[5, 6, 7, 8])
+    since = datetime.now(timezone.utc) - timedelta(minutes=1)
+
+    writer.record(1, "a.jpg", PredictionResult(detections=[person, car], model_version="v1"))
+    writer.record(2, "b.jpg", PredictionResult(detections=[]))
+    assert writer.status()["buffered"] == 2
+    # Третья строка будит фоновую запись
+    writer.record(2, "c.jpg", PredictionResult(detections=[person]))
+    for _ in range(100):
+        if writer.written:
+            break
+        await asyncio.sleep(0.01)
+    assert writer.written == 3
+    await writer.close()
+
+    until = datetime.now(timezone.utc) + timedelta(minutes=1)
+    async with jobs_db.session_factory() as session:
+        dao = DetectionsDao(session)
+        users = await dao.find_users_with_class("person", since, until)
+        assert [tuple(row) for row in users] == [(1, 1), (2, 1)]
+        rows = await dao.find_for_user(1, since, until, class_name="car")
+        assert len(rows) == 1
+        assert rows[0].filename == "a.jpg"
+        assert (rows[0].x1, rows[0].y2, rows[0].model_version) == (5, 8, "v1")
+
+
+@pytest.mark.asyncio
+async def test_history_writer_keeps_rows_when_db_is_down() -> None:
+    def broken_session():
+        raise ConnectionError("база недоступна")
+
+    writer = DetectionHistoryWriter(
+        broken_session, flush_rows=100, flush_interval=60, max_buffer=3
+    )
+    person = Detection(class_name="person", confidence=0.9, box=[1, 2, 3, 4])
+    writer.record(1, "a.jpg", PredictionResult(detections=[person, person]))
+    assert await writer.flush() == 0
+    assert writer.status()["buffered"] == 2
+
+    writer.record(1, "b.jpg", PredictionResult(detections=[person, person]))
+    status: dict = writer.status()
+    assert status["buffered"] == 3
+    assert status["dropped"] == 1
+    assert status["failures"] == 1
+
+
+def test_plan_tiles() -> None:
+    assert plan_tiles(600, 400, tile_size=640, overlap=0.2, max_tiles=16) == []
+
+    tiles: list[Tile] = plan_tiles(1000, 700, tile_size=500, overlap=0.2, max_tiles=16)
+    assert [(t.x, t.y) for t in tiles] == [(0, 0), (400, 0), (500, 0), (0, 200), (400, 200), (500, 200)]
+    assert all(t.width == t.height == 500 for t in tiles)
+
+    # Слишком много фрагментов - они укрупняются, но изображение покрыто целиком
+    tiles = plan_tiles(4000, 3000, tile_size=300, overlap=0.2, max_tiles=6)
+    assert len(tiles) <= 6
+    assert max(t.x + t.width for t in tiles) == 4000
+    assert max(t.y + t.height for t in tiles) == 3000
+
+
+def test_merge_tile_detections_maps_boxes() -> None:
+    tile_output = np.array([[[[0, 15, 0.9, 0.5, 0.5, 1.0, 1.0]]]], dtype=np.float32)
+    merged: np.ndarray = merge_tile_detections(
+        [tile_output, tile_output], [Tile(0, 0, 500, 500), Tile(500, 250, 500, 500)], 1000, 750
+    )
+    assert merged.shape == (1, 1, 2, 7)
+    np.testing.assert_allclose(merged[0, 0, 0, 3:], [0.25, 1 / 3, 0.5, 2 / 3])
+    np.testing.assert_allclose(merged[0, 0, 1, 3:], [0.75, 2 / 3, 1.0, 1.0])
+
+
+@pytest.mark.asyncio
+async def test_predict_endpoint_tiled(fake_registry, monkeypatch) -> None:
+    monkeypatch.setattr(settings, "predict_tile_size", 1000)
+    monkeypatch.setattr(settings, "predict_max_tiles", 4)
+    headers: dict = {"Authorization": f"Bearer {encode_jwt({'sub': '1'}, 'access')}"}
+    tiles_before: int = metrics.snapshot()["counters"].get("tiles", 0)
+
+    async with AsyncClient(
+        transport=ASGITransport(app=app), base_url="http://testserver"
+    ) as client:
+        response = await client.post(
+            "/predictions/predict/",
+            params={"output": "json", "tiled": True},
+            files={"file": ("big.jpg", make_image(2000, 1500), "image/jpeg")},
+            headers=headers,
+        )
+    assert response.status_code == 200
+    boxes: list[list[int]] = [d["box"] for d in response.json()["detections"]]
+    # 4 фрагмента и изображение целиком: по человеку на каждом
+    assert len(boxes) == 5
+    assert [200, 150, 1000, 750] in boxes  # с целого изображения
+    assert all(x2 <= 2000 and y2 <= 1500 for _, _, x2, y2 in boxes)
+    assert metrics.snapshot()["counters"]["tiles"] == tiles_before + 5